@@ -0,0 +1,203 @@
+"""
+Benchmark of the innermost loop of the candles service, before and after the
+compact candle state and the single projection step: trades/sec on one core.
+
+For every trade the tumbling window store deserializes the candle state, calls the
+reducer, and serializes the state back, and in 'per_update' mode the current window
+goes through the projection steps. Both are reproduced here without Kafka:
+- before: a dict state, and one step per column assignment plus the projection
+- after: the list state of `candles.main`, and the `candle_message` step
+
+Usage:
+    uv run services/candles/benchmarks/candle_state.py
+"""
+
+import random
+import time
+from typing import Callable
+
+from candles.main import candle_message, init_candle, update_candle
+from quixstreams.utils.json import dumps, loads
+
+N_TRADES = 200_000
+CANDLE_SECONDS = 60
+
+COLUMNS = [
+    'pair',
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'window_start_ms',
+    'window_end_ms',
+]
+
+
+def init_candle_dict(trade: dict) -> dict:
+    return {
+        'open': trade['price'],
+        'high': trade['price'],
+        'low': trade['price'],
+        'close': trade['price'],
+        'volume': trade['quantity'],
+        'first_trade_timestamp_ms': trade['timestamp_ms'],
+        'last_trade_timestamp_ms': trade['timestamp_ms'],
+        'pair': trade['product_id'],
+    }
+
+
+def update_candle_dict(candle: dict, trade: dict) -> dict:
+    candle['high'] = max(candle['high'], trade['price'])
+    candle['low'] = min(candle['low'], trade['price'])
+    candle['close'] = trade['price']
+    candle['volume'] += trade['quantity']
+    candle['last_trade_timestamp_ms'] = trade['timestamp_ms']
+    return candle
+
+
+def _assign(column: str, field: str) -> Callable:
+    def step(value: dict) -> dict:
+        value[column] = value['value'][field]
+        return value
+
+    return step
+
+
+def _assign_window(column: str, key: str) -> Callable:
+    def step(value: dict) -> dict:
+        value[column] = value[key]
+        return value
+
+    return step
+
+
+def _project(value: dict) -> dict:
+    return {column: value[column] for column in COLUMNS}
+
+
+def _set_candle_seconds(value: dict) -> dict:
+    value['candle_seconds'] = CANDLE_SECONDS
+    return value
+
+
+# the steps of the `sdf['x'] = sdf['value']['x']` assignments and the projection
+PROJECTION_STEPS_BEFORE = [
+    *(
+        _assign(field, field)
+        for field in [
+            'open',
+            'high',
+            'low',
+            'close',
+            'volume',
+            'first_trade_timestamp_ms',
+            'last_trade_timestamp_ms',
+            'pair',
+        ]
+    ),
+    _assign_window('window_start_ms', 'start'),
+    _assign_window('window_end_ms', 'end'),
+    _project,
+    _set_candle_seconds,
+]
+
+
+def project_before(window: dict) -> dict:
+    for step in PROJECTION_STEPS_BEFORE:
+        window = step(window)
+    return window
+
+
+def project_after(window: dict) -> dict:
+    return candle_message(window, CANDLE_SECONDS)
+
+
+def generate_trades(n: int) -> list[dict]:
+    rng = random.Random(42)
+    timestamp_ms = 1745494500000
+    price = 95_000.0
+    trades = []
+    for _ in range(n):
+        timestamp_ms += int(rng.expovariate(1 / 50))
+        price += rng.gauss(0, 5)
+        trades.append(
+            {
+                'product_id': 'BTC/USD',
+                'price': round(price, 1),
+                'quantity': round(rng.expovariate(10), 8),
+                'timestamp_ms': timestamp_ms,
+            }
+        )
+    return trades
+
+
+def run(
+    trades: list[dict],
+    initializer: Callable,
+    reducer: Callable,
+    project: Callable,
+) -> tuple[float, list[dict], int]:
+    """
+    Aggregates `trades` into candles like the tumbling window does, emitting the
+    current candle after every trade.
+
+    Returns:
+        tuple[float, list[dict], int]: The seconds it took, the last candle of each
+            window, and the mean size of the serialized state in bytes
+    """
+    window_ms = CANDLE_SECONDS * 1000
+    store: dict[int, bytes] = {}
+    candles: dict[int, dict] = {}
+    state_bytes = 0
+
+    start = time.perf_counter()
+    for trade in trades:
+        window_start_ms = trade['timestamp_ms'] - trade['timestamp_ms'] % window_ms
+        data = store.get(window_start_ms)
+        if data is None:
+            state = initializer(trade)
+        else:
+            state = reducer(loads(data), trade)
+        data = store[window_start_ms] = dumps(state)
+        state_bytes += len(data)
+
+        candles[window_start_ms] = project(
+            {
+                'start': window_start_ms,
+                'end': window_start_ms + window_ms,
+                'value': state,
+            }
+        )
+    elapsed_sec = time.perf_counter() - start
+
+    return elapsed_sec, list(candles.values()), state_bytes // len(trades)
+
+
+def main():
+    trades = generate_trades(N_TRADES)
+
+    results = {}
+    for name, initializer, reducer, project in [
+        ('before', init_candle_dict, update_candle_dict, project_before),
+        ('after', init_candle, update_candle, project_after),
+    ]:
+        # best of 3 runs, to smooth out the noise
+        runs = [run(trades, initializer, reducer, project) for _ in range(3)]
+        elapsed_sec = min(elapsed_sec for elapsed_sec, _, _ in runs)
+        _, candles, state_bytes = runs[0]
+        results[name] = (N_TRADES / elapsed_sec, candles, state_bytes)
+
+    # both must build exactly the same candles
+    assert results['before'][1] == results['after'][1]
+
+    print(f'{N_TRADES} trades, {len(results["after"][1])} candles of {CANDLE_SECONDS}s')
+    print(f'{"":<8}{"trades/s":>12}{"state bytes":>14}')
+    for name, (trades_per_sec, _, state_bytes) in results.items():
+        print(f'{name:<8}{trades_per_sec:>12,.0f}{state_bytes:>14}')
+    speedup = results['after'][0] / results['before'][0]
+    print(f'speedup: {speedup:.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+Benchmark suite of the candles service, without Kafka.
+
+Drives synthetic trades (see `synthetic.py`) through the same processing steps as
+`candles.main`, in-process, for a few configurations of the service, and reports:
+- trades/sec on one core,
+- p50 and p99 latency to process a trade, including the candles it emits,
+- memory per open window: the bytes of its serialized state in the window store,
+  and the bytes of its state as Python objects.
+
+The tumbling window is emulated like Quix Streams runs it: for every message the
+state of the window is deserialized, reduced and serialized back with the JSON
+serializer of the state store, messages in an earlier window than the latest one
+of their key are dropped as late, and windows are expired when a message of the
+same key moves the time past their end.
+
+Usage:
+    uv run services/candles/benchmarks/pipeline.py
+    uv run services/candles/benchmarks/pipeline.py --trades 1000000 --pairs 20
+"""
+
+import argparse
+import gc
+import statistics
+import time
+import tracemalloc
+from typing import Callable, Optional
+
+from candles.batching import TradeBatcher
+from candles.emission import CandleThrottle
+from candles.main import (
+    candle_message,
+    init_candle,
+    init_candle_from_batch,
+    update_candle,
+    update_candle_with_batch,
+)
+from candles.rollup import CandleRollup
+from quixstreams.utils.json import dumps, loads
+from synthetic import generate_trades
+
+
+class DictState:
+    """
+    In-memory stand-in for the `State` of a stateful step, for one key.
+    """
+
+    def __init__(self):
+        self._values = {}
+
+    def get(self, key: str, default=None):
+        return self._values.get(key, default)
+
+    def set(self, key: str, value):
+        self._values[key] = value
+
+
+class JsonState(DictState):
+    """
+    `DictState` that serializes the values like the state store does, for the steps
+    whose state is written for every trade.
+    """
+
+    def get(self, key: str, default=None):
+        data = self._values.get(key)
+        return default if data is None else loads(data)
+
+    def set(self, key: str, value):
+        self._values[key] = dumps(value)
+
+
+class Pipeline:
+    """
+    The steps of `candles.main.run` for one configuration, without Kafka.
+    """
+
+    def __init__(
+        self,
+        candle_seconds: list[int],
+        emission_mode: str = 'per_update',
+        emission_throttle_ms: int = 1000,
+        batch_max_trades: int = 1,
+    ):
+        self.base_candle_seconds = min(candle_seconds)
+        self.window_ms = self.base_candle_seconds * 1000
+        self.emission_mode = emission_mode
+
+        larger_candle_seconds = sorted(set(candle_seconds) - {self.base_candle_seconds})
+        self.rollup = (
+            CandleRollup(
+                self.base_candle_seconds,
+                larger_candle_seconds,
+                final_only=emission_mode == 'final',
+            )
+            if larger_candle_seconds
+            else None
+        )
+        self.throttle = (
+            CandleThrottle(emission_throttle_ms)
+            if emission_mode == 'throttled'
+            else None
+        )
+        self.batcher = (
+            TradeBatcher(self.base_candle_seconds, batch_max_trades, 10**9)
+            if batch_max_trades > 1
+            else None
+        )
+        self.initializer, self.reducer = (
+            (init_candle_from_batch, update_candle_with_batch)
+            if self.batcher
+            else (init_candle, update_candle)
+        )
+
+        # key -> {window start: serialized state}
+        self._windows: dict[str, dict[int, bytes]] = {}
+        # key -> latest timestamp
+        self._latest_ms: dict[str, int] = {}
+        self._rollup_states: dict[str, DictState] = {}
+        self._batch_states: dict[str, JsonState] = {}
+
+        self.n_window_updates = 0
+        self.n_late = 0
+        self.n_emitted = 0
+        self.state_bytes = 0
+
+    def process(self, trade: dict):
+        if self.batcher:
+            state = self._batch_states.setdefault(trade['product_id'], JsonState())
+            messages = self.batcher.process(trade, state)
+        else:
+            messages = [trade]
+        for message in messages:
+            for window in self._window(message):
+                self._emit(candle_message(window, self.base_candle_seconds))
+
+    def _window(self, message: dict) -> list[dict]:
+        key = message['product_id']
+        timestamp_ms = message['timestamp_ms']
+        latest_ms = max(timestamp_ms, self._latest_ms.get(key, 0))
+        self._latest_ms[key] = latest_ms
+
+        start_ms = timestamp_ms - timestamp_ms % self.window_ms
+        if start_ms <= latest_ms - self.window_ms:
+            self.n_late += 1
+            return []
+
+        windows = self._windows.setdefault(key, {})
+        data = windows.get(start_ms)
+        state = (
+            self.initializer(message)
+            if data is None
+            else self.reducer(loads(data), message)
+        )
+        data = windows[start_ms] = dumps(state)
+        self.n_window_updates += 1
+        self.state_bytes += len(data)
+
+        emitted = []
+        if self.emission_mode != 'final':
+            emitted.append(
+                {'start': start_ms, 'end': start_ms + self.window_ms, 'value': state}
+            )
+
+        # expire the windows of the key that ended
+        for expired_ms in [
+            expired_ms
+            for expired_ms in windows
+            if expired_ms + self.window_ms <= latest_ms
+        ]:
+            value = loads(windows.pop(expired_ms))
+            if self.emission_mode == 'final':
+                emitted.append(
+                    {
+                        'start': expired_ms,
+                        'end': expired_ms + self.window_ms,
+                        'value': value,
+                    }
+                )
+        return emitted
+
+    def _emit(self, candle: dict):
+        candles = [candle]
+        if self.rollup is not None:
+            state = self._rollup_states.setdefault(candle['pair'], DictState())
+            candles = self.rollup.process(candle, state)
+        if self.throttle is not None:
+            candles = [
+                throttled
+                for candle in candles
+                for throttled in self.throttle.process(candle)
+            ]
+        for candle in candles:
+            # what the output topic does with it
+            dumps(candle)
+        self.n_emitted += len(candles)
+
+
+def run(trades: list[dict], pipeline: Pipeline) -> dict:
+    """
+    Processes `trades` one by one and returns the measurements.
+    """
+    latencies_ns = []
+    gc.collect()
+
+    start = time.perf_counter()
+    for trade in trades:
+        trade_start = time.perf_counter_ns()
+        pipeline.process(trade)
+        latencies_ns.append(time.perf_counter_ns() - trade_start)
+    elapsed_sec = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(latencies_ns, n=100)
+    return {
+        'trades_per_sec': len(trades) / elapsed_sec,
+        'p50_us': percentiles[49] / 1000,
+        'p99_us': percentiles[98] / 1000,
+        'updates_per_trade': pipeline.n_window_updates / len(trades),
+        'candles_per_trade': pipeline.n_emitted / len(trades),
+        'late': pipeline.n_late,
+        'state_bytes': pipeline.state_bytes / max(pipeline.n_window_updates, 1),
+    }
+
+
+def python_bytes_per_window(trades: list[dict], initializer: Callable) -> float:
+    """
+    Bytes of Python objects held by the state of an open window, over the states
+    of one window per trade.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    states = [initializer(trade) for trade in trades]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (after - before) / len(states)
+
+
+SCENARIOS = {
+    'per_update 60s': {'candle_seconds': [60]},
+    'final 60s': {'candle_seconds': [60], 'emission_mode': 'final'},
+    'throttled 60s': {'candle_seconds': [60], 'emission_mode': 'throttled'},
+    'per_update 60s..1h': {'candle_seconds': [60, 300, 900, 3600]},
+    'final 60s..1h': {
+        'candle_seconds': [60, 300, 900, 3600],
+        'emission_mode': 'final',
+    },
+    'batched 60s': {'candle_seconds': [60], 'batch_max_trades': 100},
+}
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--trades', type=int, default=200_000)
+    parser.add_argument('--pairs', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=500.0, help='trades/sec')
+    parser.add_argument('--out-of-order', type=float, default=0.001)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument(
+        '--scenario', action='append', choices=SCENARIOS, help='default: all'
+    )
+    args = parser.parse_args(argv)
+
+    trades = generate_trades(
+        args.trades,
+        n_pairs=args.pairs,
+        trades_per_sec=args.rate,
+        out_of_order_fraction=args.out_of_order,
+        seed=args.seed,
+    )
+    print(
+        f'{args.trades} trades, {args.pairs} pairs, {args.rate:g} trades/s, '
+        f'{args.out_of_order:.2%} out of order'
+    )
+    print(
+        f'{"scenario":<22}{"trades/s":>11}{"p50 µs":>9}{"p99 µs":>9}'
+        f'{"updates/trade":>15}{"candles/trade":>15}{"late":>7}{"state B":>9}'
+    )
+    for name in args.scenario or SCENARIOS:
+        result = run(trades, Pipeline(**SCENARIOS[name]))
+        print(
+            f'{name:<22}{result["trades_per_sec"]:>11,.0f}{result["p50_us"]:>9.1f}'
+            f'{result["p99_us"]:>9.1f}{result["updates_per_trade"]:>15.3f}'
+            f'{result["candles_per_trade"]:>15.4f}{result["late"]:>7}'
+            f'{result["state_bytes"]:>9.0f}'
+        )
+
+    # 'state B' is the serialized state of a window in the store, this is the
+    # state of a window being reduced
+    print(
+        'Python objects per open window: '
+        f'{python_bytes_per_window(trades[:10_000], init_candle):.0f} bytes'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Deterministic synthetic trade streams for the candles benchmarks.
+
+Trades arrive as a Poisson process at `trades_per_sec`, spread over the pairs with
+Zipf weights (the first pair trades the most, like BTC/USD), and the price of each
+pair follows a geometric random walk. A fraction of the trades can arrive late, by
+up to `max_delay_ms`, to exercise the late-trade handling of the windows.
+
+The same arguments always give the same trades.
+"""
+
+import math
+import random
+
+from trades.trade import Trade
+
+START_MS = 1745494500000
+
+
+def generate_trades(
+    n_trades: int,
+    n_pairs: int = 1,
+    trades_per_sec: float = 100.0,
+    volatility: float = 0.0002,
+    out_of_order_fraction: float = 0.0,
+    max_delay_ms: int = 5000,
+    seed: int = 42,
+) -> list[dict]:
+    """
+    Generates trades, in arrival order, as the dicts of the trades topic.
+
+    Args:
+        n_trades (int): Number of trades
+        n_pairs (int): Number of pairs
+        trades_per_sec (float): Trades per second over all the pairs
+        volatility (float): Standard deviation of the log return between two
+            trades of a pair
+        out_of_order_fraction (float): Fraction of trades that arrive late
+        max_delay_ms (int): Max delay of the late trades
+        seed (int): Seed of the random generator
+
+    Returns:
+        list[dict]: The trades
+    """
+    rng = random.Random(seed)
+    pairs = [f'PAIR{i}/USD' for i in range(n_pairs)]
+    weights = [1 / (i + 1) for i in range(n_pairs)]
+    prices = [100_000.0 / (i + 1) for i in range(n_pairs)]
+
+    timestamp_ms = float(START_MS)
+    trades = []
+    for pair_index in rng.choices(range(n_pairs), weights=weights, k=n_trades):
+        timestamp_ms += rng.expovariate(trades_per_sec / 1000)
+        prices[pair_index] *= math.exp(rng.gauss(0, volatility))
+
+        arrival_ms = timestamp_ms
+        if out_of_order_fraction and rng.random() < out_of_order_fraction:
+            arrival_ms += rng.uniform(0, max_delay_ms)
+
+        trades.append(
+            (
+                arrival_ms,
+                {
+                    'product_id': pairs[pair_index],
+                    'price': round(prices[pair_index], 2),
+                    'quantity': round(rng.expovariate(10), 8),
+                    'timestamp': Trade.unix_seconds_to_iso_format(timestamp_ms / 1000),
+                    'timestamp_ms': int(timestamp_ms),
+                },
+            )
+        )
+
+    if out_of_order_fraction:
+        trades.sort(key=lambda trade: trade[0])
+    return [trade for _, trade in trades]
@@ -0,0 +1,167 @@
+import time
+
+from loguru import logger
+from quixstreams import State
+
+
+class TradeBatcher:
+    """
+    Pre-aggregates the trades of a pair and window into one partial candle, so the
+    window is updated once per batch instead of once per trade.
+
+    Quix Streams hands us the messages one by one, so a batch is the consecutive
+    trades of a pair in the same window, up to `max_trades` of them, or until a
+    message of that pair arrives `max_delay_ms` after the first trade of the batch.
+    A batch goes to the window as a message like:
+
+        {'product_id', 'timestamp_ms', 'open', 'high', 'low', 'close', 'volume'}
+
+    with the latest timestamp of its trades, and the volume of the window after
+    them. The batcher adds the quantities of the window one by one, like the reducer
+    does with the trades, so the volume is the same sum.
+
+    The candles are the same as without batching:
+    - the first message of a window is passed alone, so the previous window closes
+      at the same message as without batching,
+    - trades in an earlier window than the latest one of the pair are passed alone,
+      for the window to drop them as late,
+    - ticks of the `IdleWindowCloser` (zero quantity) are passed alone, after the
+      batch of their window,
+    - the trades of the window the batcher was in when its state was created (e.g.
+      when batching is turned on) are passed alone, its volume so far is unknown.
+
+    It is a stateful step before the window, with one state per pair (the message
+    key) holding the batch being built and the window it is in. The held trades are
+    in the same checkpoint as their offsets, so they are committed, restored after
+    a crash and moved with their partition on a rebalance like the windows are,
+    and never lost. Within a checkpoint the state is kept in memory, so a trade
+    costs one read and write of the small batch instead of the window lookups,
+    update and expiration.
+
+    A batch is only flushed by a message of its pair: the next trades, or the tick
+    of the `IdleWindowCloser` that closes its window. Until then the intermediate
+    candles of a pair that stops trading lag behind its last trades.
+    """
+
+    def __init__(
+        self,
+        candle_seconds: int,
+        max_trades: int = 100,
+        max_delay_ms: int = 100,
+        stats_interval_sec: float = 10.0,
+    ):
+        """
+        Args:
+            candle_seconds (int): Duration of the windows
+            max_trades (int): Max number of trades in a batch
+            max_delay_ms (int): Max wall-clock time a trade is held in a batch, if
+                another message of the pair arrives
+            stats_interval_sec (float): How often the batching factor is logged
+        """
+        self.window_ms = candle_seconds * 1000
+        self.max_trades = max_trades
+        self.max_delay_sec = max_delay_ms / 1000
+        self.stats_interval_sec = stats_interval_sec
+
+        self._n_trades = 0
+        self._n_batches = 0
+        self._last_report = time.monotonic()
+
+    def process(self, trade: dict, state: State) -> list[dict]:
+        """
+        Takes a trade and returns the messages to send to the window now, trades
+        and batches, in order.
+        """
+        self._n_trades += 1
+        window_start_ms = trade['timestamp_ms'] - trade['timestamp_ms'] % self.window_ms
+        # window_ms: start of the latest window of the pair
+        # volume: volume of that window so far, None if it is unknown
+        # batch: the batch being built, its number of trades and the wall-clock time
+        # of its first trade
+        batching = state.get('batching')
+
+        if batching is None or window_start_ms > batching['window_ms']:
+            # new window, flush the batch of the previous one and pass the first
+            # trade through, so the previous window closes now
+            messages = [batching['batch']] if batching and batching['batch'] else []
+            messages.append(trade)
+            state.set(
+                'batching',
+                {
+                    'window_ms': window_start_ms,
+                    # the window starts with this trade, like `init_candle`
+                    'volume': trade['quantity'] if batching else None,
+                    'batch': None,
+                    'n_trades': 0,
+                    'started_at': 0.0,
+                },
+            )
+            return self._flushed(messages)
+
+        if window_start_ms < batching['window_ms'] or batching['volume'] is None:
+            # late, the window drops it, or the volume of the window is unknown
+            return self._flushed([trade])
+
+        batch = batching['batch']
+        quantity = trade['quantity']
+        if not quantity:
+            # tick of the IdleWindowCloser
+            batching['batch'] = None
+            state.set('batching', batching)
+            return self._flushed([batch, trade] if batch else [trade])
+
+        # like the reducer, a window that only had ticks starts with this trade
+        volume = batching['volume'] = (
+            batching['volume'] + quantity if batching['volume'] else quantity
+        )
+        price = trade['price']
+        now = time.time()
+        if batch is None:
+            batch = batching['batch'] = {
+                'product_id': trade['product_id'],
+                'timestamp_ms': trade['timestamp_ms'],
+                'open': price,
+                'high': price,
+                'low': price,
+                'close': price,
+                'volume': volume,
+            }
+            batching['n_trades'] = 1
+            batching['started_at'] = now
+        else:
+            if trade['timestamp_ms'] > batch['timestamp_ms']:
+                batch['timestamp_ms'] = trade['timestamp_ms']
+            if price > batch['high']:
+                batch['high'] = price
+            elif price < batch['low']:
+                batch['low'] = price
+            batch['close'] = price
+            batch['volume'] = volume
+            batching['n_trades'] += 1
+
+        if (
+            batching['n_trades'] >= self.max_trades
+            or now - batching['started_at'] >= self.max_delay_sec
+        ):
+            batching['batch'] = None
+            state.set('batching', batching)
+            return self._flushed([batch])
+
+        state.set('batching', batching)
+        return []
+
+    def _flushed(self, messages: list[dict]) -> list[dict]:
+        self._n_batches += len(messages)
+
+        now = time.monotonic()
+        if now - self._last_report >= self.stats_interval_sec:
+            logger.info(
+                f'Batched {self._n_trades} trades into {self._n_batches} window '
+                f'updates ({self._n_trades / max(self._n_batches, 1):.1f} trades per '
+                'update)'
+            )
+            self._n_trades = 0
+            self._n_batches = 0
+            self._last_report = now
+
+        return messages
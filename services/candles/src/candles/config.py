@@ -1,4 +1,7 @@
-from pydantic_settings import BaseSettings, SettingsConfigDict
+from typing import Annotated, Literal, Optional
+
+from pydantic import field_validator
+from pydantic_settings import BaseSettings, NoDecode, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -10,7 +13,48 @@ class Settings(BaseSettings):
     kafka_input_topic: str
     kafka_output_topic: str
     kafka_consumer_group: str
-    candle_seconds: int
+    # 'binary' uses the compact format of trades.codec instead of JSON
+    kafka_input_value_format: Literal['json', 'binary'] = 'json'
+    kafka_output_value_format: Literal['json', 'binary'] = 'json'
+    # one or more candle durations, e.g. "60" or "60,300,900,3600". The smallest is
+    # built from trades, the others are rolled up from it
+    candle_seconds: Annotated[list[int], NoDecode]
+    # 'per_update' emits the current candle after every trade, 'throttled' at most
+    # one per pair and timeframe every emission_throttle_ms, 'final' only closed ones
+    emission_mode: Literal['per_update', 'throttled', 'final'] = 'per_update'
+    emission_throttle_ms: int = 1000
+    # how often the received trades and emitted candles are logged
+    emission_stats_interval_sec: float = 10.0
+    # partitions of the output topic if it has to be created. Defaults to the
+    # partitions of the input topic
+    kafka_output_topic_partitions: Optional[int] = None
+    # close the windows of pairs without trades this long after their end, in
+    # wall-clock time, and optionally emit flat candles for the windows without trades
+    idle_timeout_ms: Optional[int] = None
+    idle_gap_fill: bool = False
+    # topic of the ticks that close the idle windows, only read by this service.
+    # Defaults to "{kafka_consumer_group}-idle-ticks"
+    idle_ticks_topic: Optional[str] = None
+    # pre-aggregate up to batch_max_trades trades of a pair and window in the state
+    # of the pair before updating the window state. 1 disables it
+    batch_max_trades: int = 1
+    batch_max_delay_ms: int = 100
+    # offline candle builder (candles/offline.py): trades from a Parquet, CSV or
+    # JSON lines file, or from the trade archive, and candles to a file or the topic
+    offline_trades_path: Optional[str] = None
+    offline_archive_dir: Optional[str] = None
+    offline_product_ids: list[str] = []
+    offline_last_n_days: int = 60
+    offline_output_path: Optional[str] = None
+
+    @field_validator('candle_seconds', mode='before')
+    @classmethod
+    def split_candle_seconds(cls, value):
+        if isinstance(value, str):
+            return [int(seconds) for seconds in value.split(',')]
+        if isinstance(value, int):
+            return [value]
+        return value
 
 
 config = Settings()
@@ -0,0 +1,121 @@
+import time
+from typing import Literal
+
+from loguru import logger
+
+EmissionMode = Literal['per_update', 'throttled', 'final']
+
+
+class CandleThrottle:
+    """
+    Emits at most one intermediate candle per (pair, candle_seconds) every
+    `throttle_ms` milliseconds of wall-clock time.
+
+    The candles in between are not dropped for good: the last one is held back,
+    and emitted when the next candle of that pair and timeframe comes for a new
+    window. So the last update of every window always goes out, and downstream
+    services see the same final candles as with per-update emission.
+
+    With `flush_on_empty`, a candle without trades, from a window that only had
+    ticks of the `IdleWindowCloser`, means that the pair is idle: it releases the
+    held candles of the pair, of every timeframe, and is passed through to be
+    dropped afterwards.
+
+    The held candles live in memory. If the service restarts, the held candle of
+    a window is lost, and that window's last emitted update may be up to
+    `throttle_ms` old.
+    """
+
+    def __init__(self, throttle_ms: int, flush_on_empty: bool = False):
+        self.throttle_sec = throttle_ms / 1000
+        self.flush_on_empty = flush_on_empty
+
+        # (pair, candle_seconds) -> (last emission time, held candle or None)
+        self._last: dict[tuple[str, int], tuple[float, dict | None]] = {}
+
+    def process(self, candle: dict) -> list[dict]:
+        """
+        Returns the candles to emit now: none, the given one, or the held candle
+        of the previous window followed by the given one.
+        """
+        if self.flush_on_empty and not candle['volume']:
+            return [*self.flush(candle['pair']), candle]
+
+        key = (candle['pair'], candle['candle_seconds'])
+        now = time.monotonic()
+        last_emitted_at, held = self._last.get(key, (0.0, None))
+
+        candles = []
+        new_window = held is not None and (
+            held['window_start_ms'] != candle['window_start_ms']
+        )
+        if new_window:
+            # the last update of the previous window
+            candles.append(held)
+
+        if new_window or now - last_emitted_at >= self.throttle_sec:
+            candles.append(candle)
+            self._last[key] = (now, None)
+        else:
+            self._last[key] = (last_emitted_at, candle)
+
+        return candles
+
+    def flush(self, pair: str) -> list[dict]:
+        """
+        Returns the held candles of the pair, of every timeframe, and forgets them.
+        """
+        held = []
+        for key, (last_emitted_at, candle) in self._last.items():
+            if key[0] == pair and candle is not None:
+                held.append(candle)
+                self._last[key] = (last_emitted_at, None)
+        return held
+
+
+class EmissionStats:
+    """
+    Counts the trades received and the candles emitted, and logs them every
+    `report_interval_sec` seconds, to see how much downstream load each emission
+    mode saves.
+    """
+
+    def __init__(self, emission_mode: EmissionMode, report_interval_sec: float = 10.0):
+        self.emission_mode = emission_mode
+        self.report_interval_sec = report_interval_sec
+
+        self.total_received = 0
+        self.total_emitted = 0
+        self._received = 0
+        self._emitted = 0
+        self._interval_start = time.monotonic()
+
+    def on_trade(self, trade: dict):
+        self._received += 1
+        self.total_received += 1
+
+    def on_candle(self, candle: dict):
+        self._emitted += 1
+        self.total_emitted += 1
+
+        now = time.monotonic()
+        if now - self._interval_start >= self.report_interval_sec:
+            self.report(now)
+
+    def report(self, now: float | None = None):
+        """
+        Logs the counters since the last report.
+        """
+        now = now or time.monotonic()
+        elapsed_sec = now - self._interval_start
+        logger.info(
+            f'Candles ({self.emission_mode}): '
+            f'{self._received / elapsed_sec:,.0f} trades/s received, '
+            f'{self._emitted / elapsed_sec:,.0f} candles/s emitted, '
+            f'{self._emitted / max(self._received, 1):.3f} candles per trade, '
+            f'{self.total_received:,} trades and {self.total_emitted:,} candles '
+            'in total'
+        )
+        self._interval_start = now
+        self._received = 0
+        self._emitted = 0
@@ -0,0 +1,203 @@
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+from quixstreams.kafka import Producer
+from quixstreams.models import Topic
+from trades.trade import Trade
+
+
+class IdleWindowCloser:
+    """
+    Closes the candle windows of pairs that stop trading.
+
+    The tumbling window only moves forward when a newer message arrives for the
+    same pair, so without trades the last window of a quiet pair stays open. Every
+    `check_interval_sec` a background thread looks at the pairs with no message for
+    `grace_ms` after the end of their last window (in wall-clock time), and produces
+    a tick for each of them: a trade with zero quantity at the price of the last
+    trade, timestamped at the start of the next window. The ticks go to a topic of
+    their own, with as many partitions as the trades topic, that only this service
+    reads together with the trades, and never to the trades topic, which other
+    services read too. A tick is keyed by pair, so it lands in the partition of the
+    pair's trades. When it comes back through the consumer, the window sees its
+    timestamp and closes the previous window, so in 'final' mode the candle is
+    emitted at most `grace_ms` after its window ended.
+
+    The reducer ignores ticks in windows that have trades. A window with only ticks
+    is a flat candle at the previous close with zero volume, which is emitted when
+    `gap_fill` is on, and dropped otherwise. With `gap_fill`, a quiet pair gets one
+    tick per window, so it gets a flat candle for every window without trades, at
+    most `max_ticks_per_check` of them per check.
+
+    Idle is measured in wall-clock time, so it only means something for the pairs
+    whose trades are live. A pair whose latest trade was more than `max_lag_ms` old
+    when it was consumed (a historical backfill, or a consumer catching up) gets no
+    ticks: they would close windows that still have trades to come.
+
+    Before the next tick of a pair, the previous one must have come back. If it
+    does not come back within `forget_after_sec`, the pair was moved to another
+    replica by a rebalance, and it is forgotten here.
+    """
+
+    def __init__(
+        self,
+        topic: Topic,
+        kafka_broker_address: str,
+        candle_seconds: int,
+        grace_ms: int,
+        gap_fill: bool = False,
+        check_interval_sec: float = 1.0,
+        forget_after_sec: float = 60.0,
+        max_lag_ms: int = 60000,
+        max_ticks_per_check: int = 100,
+    ):
+        """
+        Args:
+            topic (Topic): The topic of the ticks, with the serializer of the
+                trades format and the partitions of the trades topic
+            kafka_broker_address (str): Kafka broker address
+            candle_seconds (int): Duration of the windows to close
+            grace_ms (int): How long after the end of a window we wait for trades
+                before closing it
+            gap_fill (bool): True to emit flat candles for windows without trades
+            check_interval_sec (float): How often the pairs are checked
+            forget_after_sec (float): How long we wait for a tick to come back
+            max_lag_ms (int): Pairs whose latest trade was older than this when it
+                was consumed get no ticks
+            max_ticks_per_check (int): Max number of gap-fill ticks per pair and
+                check
+        """
+        self.topic = topic
+        self.window_ms = candle_seconds * 1000
+        self.grace_ms = grace_ms
+        self.gap_fill = gap_fill
+        self.check_interval_sec = check_interval_sec
+        self.forget_after_sec = forget_after_sec
+        self.max_lag_ms = max_lag_ms
+        self.max_ticks_per_check = max_ticks_per_check
+
+        # same key -> partition mapping as the trades service, so the ticks of a pair
+        # go to the partition of its trades
+        self._producer = Producer(
+            broker_address=kafka_broker_address,
+            extra_config={'partitioner': 'murmur2_random'},
+        )
+
+        # pair -> (timestamp_ms, price, is_tick) of the latest message seen, and the
+        # wall-clock time minus the timestamp of the latest trade when it was seen
+        self._last: dict[str, tuple[int, float, bool, int]] = {}
+        # pair -> (timestamp_ms, wall-clock time) of the latest tick produced
+        self._sent: dict[str, tuple[int, float]] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def on_trade(self, trade: dict):
+        """
+        Records the latest message of the pair, trade or tick.
+        """
+        timestamp_ms = trade['timestamp_ms']
+        is_tick = trade['quantity'] == 0
+        with self._lock:
+            last = self._last.get(trade['product_id'])
+            if last is None or timestamp_ms >= last[0]:
+                lag_ms = (
+                    last[3]
+                    if is_tick and last is not None
+                    else int(time.time() * 1000) - timestamp_ms
+                )
+                self._last[trade['product_id']] = (
+                    timestamp_ms,
+                    trade['price'],
+                    is_tick,
+                    lag_ms,
+                )
+
+    def ticks(self, now_ms: int) -> list[dict]:
+        """
+        Returns the ticks to produce at wall-clock time `now_ms`, and records them
+        as sent.
+        """
+        watermark_ms = now_ms - self.grace_ms
+        ticks = []
+        with self._lock:
+            for pair, (last_ms, price, is_tick, lag_ms) in list(self._last.items()):
+                sent = self._sent.get(pair)
+                if sent is not None and sent[0] > last_ms:
+                    # the last tick has not come back yet
+                    if time.monotonic() - sent[1] > self.forget_after_sec:
+                        logger.info(f'Ticks of {pair} do not come back, forgetting it')
+                        del self._last[pair]
+                        del self._sent[pair]
+                    continue
+
+                if lag_ms > self.max_lag_ms:
+                    # not live, its trades may just not be consumed yet
+                    continue
+
+                next_window_ms = last_ms - last_ms % self.window_ms + self.window_ms
+                if watermark_ms < next_window_ms or (is_tick and not self.gap_fill):
+                    continue
+
+                if self.gap_fill:
+                    # one tick per window, up to the watermark, and the next ones at
+                    # the next check once they came back
+                    starts_ms = range(next_window_ms, watermark_ms + 1, self.window_ms)[
+                        : self.max_ticks_per_check
+                    ]
+                else:
+                    starts_ms = [next_window_ms]
+                for start_ms in starts_ms:
+                    ticks.append(
+                        {
+                            'product_id': pair,
+                            'price': price,
+                            'quantity': 0.0,
+                            'timestamp': Trade.unix_seconds_to_iso_format(
+                                start_ms / 1000
+                            ),
+                            'timestamp_ms': start_ms,
+                        }
+                    )
+                self._sent[pair] = (starts_ms[-1], time.monotonic())
+
+        return ticks
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval_sec):
+            ticks = self.ticks(int(time.time() * 1000))
+            for tick in ticks:
+                message = self.topic.serialize(
+                    key=tick['product_id'],
+                    value=tick,
+                    timestamp_ms=tick['timestamp_ms'],
+                )
+                self._producer.produce(
+                    topic=self.topic.name,
+                    value=message.value,
+                    key=message.key,
+                    timestamp=message.timestamp,
+                )
+            if ticks:
+                self._producer.flush()
+                logger.debug(f'Produced {len(ticks)} ticks for idle pairs')
+
+    def start(self):
+        """
+        Starts the background thread.
+        """
+        self._thread = threading.Thread(
+            target=self._run, name='idle-window-closer', daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread and flushes the producer.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._producer.flush()
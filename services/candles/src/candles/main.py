@@ -2,7 +2,13 @@ from typing import Any, List, Optional, Tuple
 
 from loguru import logger
 from quixstreams import Application
-from quixstreams.models import TimestampType
+from quixstreams.models import TimestampType, TopicConfig
+from trades.codec import value_deserializer, value_serializer
+
+from candles.batching import TradeBatcher
+from candles.emission import CandleThrottle, EmissionMode, EmissionStats
+from candles.idle import IdleWindowCloser
+from candles.rollup import CandleRollup
 
 
 def custom_ts_extractor(
@@ -18,7 +24,13 @@ def custom_ts_extractor(
     return value['timestamp_ms']
 
 
-def init_candle(trade: dict) -> dict:
+# The candle state is a list with these positions, instead of a dict, because the
+# window store serializes it on every trade: it is smaller and faster to build,
+# read and (de)serialize.
+OPEN, HIGH, LOW, CLOSE, VOLUME, PAIR = range(6)
+
+
+def init_candle(trade: dict) -> list:
     """
     Initialize a candle with the first trade
     Returns the initial candle state
@@ -27,41 +39,141 @@ def init_candle(trade: dict) -> dict:
         trade (dict): The first trade
 
     Returns:
-        dict: The initial candle state
+        list: The initial candle state, [open, high, low, close, volume, pair]
     """
-    return {
-        'open': trade['price'],
-        'high': trade['price'],
-        'low': trade['price'],
-        'close': trade['price'],
-        'volume': trade['quantity'],
-        'first_trade_timestamp_ms': trade['timestamp_ms'],
-        'last_trade_timestamp_ms': trade['timestamp_ms'],
-        'pair': trade['product_id'],
-    }
+    price = trade['price']
+    return [price, price, price, price, trade['quantity'], trade['product_id']]
 
 
-def update_candle(candle: dict, trade: dict) -> dict:
+def update_candle(candle: list, trade: dict) -> list:
     """
     Takes the current candle (aka state) and the new trade, and updates the candle state
 
     Args:
-        candle (dict): The current candle state
+        candle (list): The current candle state
         trade (dict): The new trade
 
     Returns:
-        dict: The updated candle state
+        list: The updated candle state
     """
+    if isinstance(candle, dict):
+        # window opened before the state became a list
+        candle = _candle_from_dict(candle)
+
+    if not trade['quantity']:
+        # tick of the IdleWindowCloser, it only moves the window time forward
+        return candle
+    if not candle[VOLUME]:
+        # the window only had ticks so far, its first trade starts the candle
+        return init_candle(trade)
+
     # open price does not change, so there is no need to update it
-    candle['high'] = max(candle['high'], trade['price'])
-    candle['low'] = min(candle['low'], trade['price'])
-    candle['close'] = trade['price']
-    candle['volume'] += trade['quantity']
-    candle['last_trade_timestamp_ms'] = trade['timestamp_ms']
+    price = trade['price']
+    if price > candle[HIGH]:
+        candle[HIGH] = price
+    elif price < candle[LOW]:
+        candle[LOW] = price
+    candle[CLOSE] = price
+    candle[VOLUME] += trade['quantity']
+    return candle
+
+
+def init_candle_from_batch(message: dict) -> list:
+    """
+    Initialize a candle with the first message of the `TradeBatcher`, a trade or a
+    batch of trades
+
+    Args:
+        message (dict): The first trade or batch
+
+    Returns:
+        list: The initial candle state, [open, high, low, close, volume, pair]
+    """
+    if 'quantity' in message:
+        return init_candle(message)
+    return [
+        message['open'],
+        message['high'],
+        message['low'],
+        message['close'],
+        message['volume'],
+        message['product_id'],
+    ]
+
+
+def update_candle_with_batch(candle: list, message: dict) -> list:
+    """
+    Takes the current candle (aka state) and a message of the `TradeBatcher`, and
+    updates the candle state like `update_candle` does with each of its trades
+
+    Args:
+        candle (list): The current candle state
+        message (dict): A trade, or a batch of trades with the volume of the window
+            after them
+
+    Returns:
+        list: The updated candle state
+    """
+    if 'quantity' in message:
+        return update_candle(candle, message)
+
+    if isinstance(candle, dict):
+        candle = _candle_from_dict(candle)
+
+    if not candle[VOLUME]:
+        # the window only had ticks so far
+        return init_candle_from_batch(message)
 
+    if message['high'] > candle[HIGH]:
+        candle[HIGH] = message['high']
+    if message['low'] < candle[LOW]:
+        candle[LOW] = message['low']
+    candle[CLOSE] = message['close']
+    # added trade by trade by the batcher, so it is the same sum as here
+    candle[VOLUME] = message['volume']
     return candle
 
 
+def _candle_from_dict(candle: dict) -> list:
+    return [
+        candle['open'],
+        candle['high'],
+        candle['low'],
+        candle['close'],
+        candle['volume'],
+        candle['pair'],
+    ]
+
+
+def candle_message(window: dict, candle_seconds: int) -> dict:
+    """
+    Builds the output message of a candle from its window, in one step.
+
+    Args:
+        window (dict): The window emitted by the tumbling window, with the candle
+            state in 'value' and the window boundaries in 'start' and 'end'
+        candle_seconds (int): Candle duration in seconds
+
+    Returns:
+        dict: The candle message
+    """
+    candle = window['value']
+    if isinstance(candle, dict):
+        candle = _candle_from_dict(candle)
+
+    return {
+        'pair': candle[PAIR],
+        'open': candle[OPEN],
+        'high': candle[HIGH],
+        'low': candle[LOW],
+        'close': candle[CLOSE],
+        'volume': candle[VOLUME],
+        'window_start_ms': window['start'],
+        'window_end_ms': window['end'],
+        'candle_seconds': candle_seconds,
+    }
+
+
 def run(
     # kafka parameters
     kafka_broker_address: str,
@@ -69,8 +181,18 @@ def run(
     kafka_output_topic: str,
     kafka_consumer_group: str,
     # candles parameters
-    candle_seconds: int,
-    emit_intermediate_candles: bool = True,
+    candle_seconds: int | list[int],
+    emission_mode: EmissionMode = 'per_update',
+    emission_throttle_ms: int = 1000,
+    emission_stats_interval_sec: float = 10.0,
+    kafka_output_topic_partitions: Optional[int] = None,
+    kafka_input_value_format: str = 'json',
+    kafka_output_value_format: str = 'json',
+    idle_timeout_ms: Optional[int] = None,
+    idle_gap_fill: bool = False,
+    idle_ticks_topic: Optional[str] = None,
+    batch_max_trades: int = 1,
+    batch_max_delay_ms: int = 100,
 ):
     """
     Transforms a stream of input trades into a stream of output candles.
@@ -85,11 +207,66 @@ def run(
         kafka_input_topic (str): Kafka input topic name
         kafka_output_topic (str): Kafka output topic name
         kafka_consumer_group (str): Kafka consumer group name
-        candle_seconds (int): Candle duration in seconds
+        candle_seconds (int | list[int]): Candle duration in seconds, or several of
+            them. The smallest is built from the trades, and the others are rolled
+            up from it, so they must be multiples of it.
+        emission_mode (EmissionMode): When candles are emitted:
+            - 'per_update': the current candle after every trade, lowest latency
+            - 'throttled': at most one candle per pair and timeframe every
+              `emission_throttle_ms`, plus the last update of each window
+            - 'final': each candle once, when its window is closed
+        emission_throttle_ms (int): Minimum time between two candles of the same
+            pair and timeframe in 'throttled' mode
+        emission_stats_interval_sec (float): How often the received trades and
+            emitted candles are logged
+        kafka_output_topic_partitions (Optional[int]): Number of partitions of the
+            output topic, if it has to be created. Defaults to the partitions of the
+            input topic, so the next service can scale out like this one.
+        kafka_input_value_format (str): 'json', or 'binary' for the compact format
+            of `trades.codec`
+        kafka_output_value_format (str): 'json', or 'binary' for the compact format
+            of `trades.codec`
+        idle_timeout_ms (Optional[int]): If set, the windows of a pair with no
+            trades are closed this long after their end, in wall-clock time, by the
+            `IdleWindowCloser`
+        idle_gap_fill (bool): If the windows are closed on idle, also emit flat
+            candles at the previous close for the windows without trades
+        idle_ticks_topic (Optional[str]): Topic of the ticks of the
+            `IdleWindowCloser`, read together with the trades. Defaults to
+            `{kafka_consumer_group}-idle-ticks`, only this service reads it
+        batch_max_trades (int): If more than 1, the trades of a pair and window are
+            pre-aggregated in their state by the `TradeBatcher`, up to this many, before
+            they update the window state
+        batch_max_delay_ms (int): Max time a trade is held in a batch
+
+    Trades are keyed by pair, so all the trades of a pair go to the same partition
+    and the candle state of a pair lives in a single replica. Running N replicas
+    with the same `kafka_consumer_group` splits the partitions, and the pairs,
+    between them.
 
     Returns:
         None
     """
+    if emission_mode not in ('per_update', 'throttled', 'final'):
+        raise ValueError(f'Unknown emission mode {emission_mode!r}')
+    if isinstance(candle_seconds, int):
+        candle_seconds = [candle_seconds]
+    base_candle_seconds = min(candle_seconds)
+    larger_candle_seconds = sorted(set(candle_seconds) - {base_candle_seconds})
+    # fail before connecting to Kafka if the timeframes can't be rolled up
+    # windows that only had ticks are not emitted without gap filling
+    drop_empty = idle_timeout_ms is not None and not idle_gap_fill
+    rollup = (
+        CandleRollup(
+            base_candle_seconds,
+            larger_candle_seconds,
+            final_only=emission_mode == 'final',
+            skip_empty=drop_empty,
+        )
+        if larger_candle_seconds
+        else None
+    )
+
     app = Application(
         broker_address=kafka_broker_address,
         consumer_group=kafka_consumer_group,
@@ -98,66 +275,102 @@ def run(
     # input topic
     trades_topic = app.topic(
         kafka_input_topic,
-        value_deserializer='json',
+        value_deserializer=value_deserializer(kafka_input_value_format),
         timestamp_extractor=custom_ts_extractor,
     )
-    # output topic
+    # output topic, keyed by pair like the input topic
     candles_topic = app.topic(
         kafka_output_topic,
-        value_serializer='json',
+        value_serializer=value_serializer(kafka_output_value_format, 'candle'),
+        config=TopicConfig(
+            num_partitions=kafka_output_topic_partitions
+            or trades_topic.broker_config.num_partitions,
+            replication_factor=trades_topic.broker_config.replication_factor,
+        ),
     )
     # Step 1. Ingest trades from the input kafka topic
     # Create a Streaming DataFrame connected to the input Kafka topic
     sdf = app.dataframe(topic=trades_topic)
 
+    idle_closer = None
+    if idle_timeout_ms is not None:
+        # The ticks of the IdleWindowCloser have a topic of their own, partitioned
+        # like the trades, so the other readers of the trades topic never see them
+        ticks_topic = app.topic(
+            idle_ticks_topic or f'{kafka_consumer_group}-idle-ticks',
+            value_deserializer=value_deserializer(kafka_input_value_format),
+            value_serializer=value_serializer(kafka_input_value_format, 'trade'),
+            timestamp_extractor=custom_ts_extractor,
+            config=TopicConfig(
+                num_partitions=trades_topic.broker_config.num_partitions,
+                replication_factor=trades_topic.broker_config.replication_factor,
+            ),
+        )
+        idle_closer = IdleWindowCloser(
+            topic=ticks_topic,
+            kafka_broker_address=kafka_broker_address,
+            candle_seconds=base_candle_seconds,
+            grace_ms=idle_timeout_ms,
+            gap_fill=idle_gap_fill,
+        )
+        sdf = sdf.concat(app.dataframe(topic=ticks_topic))
+        sdf = sdf.update(idle_closer.on_trade)
+
+    stats = EmissionStats(emission_mode, emission_stats_interval_sec)
+    sdf = sdf.update(stats.on_trade)
+
+    reducer, initializer = update_candle, init_candle
+    if batch_max_trades > 1:
+        # Pre-aggregate the trades of a pair and window, so the window state is
+        # updated once per batch. The batch being built is kept in the state of the
+        # pair, so it is committed with the offsets of its trades. Each batch goes
+        # to the window with the timestamp of its latest trade.
+        batcher = TradeBatcher(
+            base_candle_seconds, batch_max_trades, batch_max_delay_ms
+        )
+        sdf = sdf.apply(batcher.process, stateful=True, expand=True)
+        sdf = sdf.set_timestamp(
+            lambda value, key, timestamp, headers: value['timestamp_ms']
+        )
+        reducer, initializer = update_candle_with_batch, init_candle_from_batch
+
     # Step 2. Aggregate trades into candles
-    # TODO: at the moment I am just printing it, to make sure this thing works.
-    sdf = sdf.update(lambda message: logger.info(f'Input:  {message}'))
-    breakpoint()
-    
     # Aggregation of trades into candles using tumbling windows
     from datetime import timedelta
 
     sdf = (
         # Define a tumbling window of 10 minutes
-        sdf.tumbling_window(timedelta(seconds=candle_seconds))
+        sdf.tumbling_window(timedelta(seconds=base_candle_seconds))
         # Create a "reduce" aggregation with "reducer" and "initializer" functions
-        .reduce(reducer=update_candle, initializer=init_candle)
+        .reduce(reducer=reducer, initializer=initializer)
     )
 
-    # we emit all intermediate candles to make the system more responsive
-    sdf = sdf.current()
-
-    # Extract open, high, low, close, volume, timestamp_ms, pair from the dataframe
-    sdf['open'] = sdf['value']['open']
-    sdf['high'] = sdf['value']['high']
-    sdf['low'] = sdf['value']['low']
-    sdf['close'] = sdf['value']['close']
-    sdf['volume'] = sdf['value']['volume']
-    sdf['first_trade_timestamp_ms'] = sdf['value']['first_trade_timestamp_ms']
-    sdf['last_trade_timestamp_ms'] = sdf['value']['last_trade_timestamp_ms']
-    sdf['pair'] = sdf['value']['pair']
-
-    # Extract window start and end timestamps
-    sdf['window_start_ms'] = sdf['start']
-    sdf['window_end_ms'] = sdf['end']
-
-    # keep only the relevant columns
-    sdf = sdf[
-        [
-            'pair',
-            # 'timestamp_ms',
-            'open',
-            'high',
-            'low',
-            'close',
-            'volume',
-            'window_start_ms',
-            'window_end_ms',
-        ]
-    ]
+    if emission_mode == 'final':
+        # each candle once, when the window is closed
+        sdf = sdf.final()
+    else:
+        # intermediate candles make the system more responsive, the throttled mode
+        # thins them out below
+        sdf = sdf.current()
+
+    # Build the output message from the window and its candle state
+    sdf = sdf.apply(lambda window: candle_message(window, base_candle_seconds))
+
+    if rollup is not None:
+        # Step 2b. Roll the base candles up into the larger timeframes, and emit
+        # the candles of all the timeframes
+        sdf = sdf.apply(rollup.process, stateful=True, expand=True)
+
+    if emission_mode == 'throttled':
+        # a window with only ticks releases the candles held for its pair
+        throttle = CandleThrottle(emission_throttle_ms, flush_on_empty=drop_empty)
+        sdf = sdf.apply(throttle.process, expand=True)
+
+    if drop_empty:
+        # drop the flat candles of the windows that only had ticks
+        sdf = sdf.filter(lambda candle: candle['volume'] > 0)
 
-    sdf['candle_seconds'] = candle_seconds
+    sdf = sdf.update(stats.on_candle)
 
     # logging on the console
     sdf = sdf.update(lambda value: logger.debug(f'Candle: {value}'))
@@ -166,7 +379,11 @@ def run(
     sdf = sdf.to_topic(candles_topic)
 
     # Starts the streaming app
+    if idle_closer is not None:
+        idle_closer.start()
     app.run()
+    if idle_closer is not None:
+        idle_closer.stop()
 
 
 if __name__ == '__main__':
@@ -178,4 +395,15 @@ if __name__ == '__main__':
         kafka_output_topic=config.kafka_output_topic,
         kafka_consumer_group=config.kafka_consumer_group,
         candle_seconds=config.candle_seconds,
+        emission_mode=config.emission_mode,
+        emission_throttle_ms=config.emission_throttle_ms,
+        emission_stats_interval_sec=config.emission_stats_interval_sec,
+        kafka_output_topic_partitions=config.kafka_output_topic_partitions,
+        kafka_input_value_format=config.kafka_input_value_format,
+        kafka_output_value_format=config.kafka_output_value_format,
+        idle_timeout_ms=config.idle_timeout_ms,
+        idle_gap_fill=config.idle_gap_fill,
+        idle_ticks_topic=config.idle_ticks_topic,
+        batch_max_trades=config.batch_max_trades,
+        batch_max_delay_ms=config.batch_max_delay_ms,
     )
@@ -0,0 +1,391 @@
+"""
+Offline candle builder, for historical backfills.
+
+Instead of pushing every historical trade through Kafka and the tumbling window one
+message at a time, it takes all the trades as columns, and computes the candles of
+every pair and window with vectorized NumPy group-bys on
+`window_start_ms = timestamp_ms - timestamp_ms % window_ms`.
+
+The candles are the ones the streaming service emits last for each window, field
+for field and bit for bit:
+- trades are processed per pair in arrival order, and trades that the tumbling
+  window would drop as late are dropped too,
+- volumes are summed in arrival order, like the reducer does, and not with the
+  pairwise or compensated sums of NumPy and pandas, which round differently,
+- larger timeframes are rolled up from the candles of the smallest one, like
+  `CandleRollup` does.
+"""
+
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from quixstreams import Application
+from quixstreams.models import TopicConfig
+from quixstreams.utils.json import dumps
+from trades.codec import value_serializer
+
+from candles.rollup import CandleRollup
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+TRADE_COLUMNS = ['product_id', 'price', 'quantity', 'timestamp_ms']
+
+# the fields of the candles the streaming service emits, in the same order
+CANDLE_COLUMNS = [
+    'pair',
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'window_start_ms',
+    'window_end_ms',
+    'candle_seconds',
+]
+
+
+def load_trades(path: str) -> pd.DataFrame:
+    """
+    Reads trades from a Parquet, CSV or JSON lines file with (at least) the
+    `product_id`, `price`, `quantity` and `timestamp_ms` columns, in arrival order.
+    """
+    if path.endswith('.parquet'):
+        trades = pd.read_parquet(path)
+    elif path.endswith('.csv'):
+        trades = pd.read_csv(path)
+    elif path.endswith(('.jsonl', '.json')):
+        trades = pd.read_json(path, lines=True)
+    else:
+        raise ValueError(f'Unknown trades file format: {path}')
+
+    missing = set(TRADE_COLUMNS) - set(trades.columns)
+    if missing:
+        raise ValueError(f'Trades file {path} has no {sorted(missing)} columns')
+    return trades
+
+
+def load_archived_trades(
+    archive_dir: str, product_ids: list[str], start_ms: int, end_ms: int
+) -> pd.DataFrame:
+    """
+    Reads the trades of `product_ids` in `[start_ms, end_ms)` from a `TradeArchive`.
+
+    Duplicates are dropped like the trades service drops them before producing,
+    so the trades are the ones a backfill would put in the trades topic.
+    """
+    import pyarrow as pa
+    from trades.trade_archive import TradeArchive
+
+    archive = TradeArchive(archive_dir)
+    table = pa.concat_tables(
+        [archive.read_table(product_id, start_ms, end_ms) for product_id in product_ids]
+    )
+    trades = table.to_pandas()
+
+    # same key as `TradeDeduplicator`: the Kraken trade id, and (timestamp, price,
+    # quantity) only for the trades without one, e.g. archived before it was kept
+    duplicated = np.where(
+        trades['trade_id'].notna(),
+        trades.duplicated(['product_id', 'trade_id']),
+        # the trades without an id are only compared with each other
+        trades.duplicated(
+            ['product_id', 'trade_id', 'timestamp_sec', 'price', 'quantity']
+        ),
+    )
+    return trades[~duplicated].reset_index(drop=True)
+
+
+def _sequential_sum(
+    values: np.ndarray, starts: np.ndarray, lengths: np.ndarray
+) -> np.ndarray:
+    """
+    Sums each segment `values[start:start + length]` from left to right, like a
+    `+=` loop does.
+
+    The segments are sorted by length, so at step k the ones longer than k are a
+    prefix, and each step adds their k-th value in one vectorized operation.
+    """
+    order = np.argsort(-lengths, kind='stable')
+    sorted_starts = starts[order]
+    sums = values[sorted_starts]
+
+    max_length = int(lengths.max(initial=0))
+    # for each k, the number of segments longer than k
+    n_longer = np.searchsorted(-lengths[order], -np.arange(max_length), side='left')
+    for k in range(1, max_length):
+        n = n_longer[k]
+        sums[:n] += values[sorted_starts[:n] + k]
+
+    result = np.empty_like(sums)
+    result[order] = sums
+    return result
+
+
+def _aggregate(
+    pairs: np.ndarray,
+    window_start_ms: np.ndarray,
+    open_: np.ndarray,
+    high: np.ndarray,
+    low: np.ndarray,
+    close: np.ndarray,
+    volume: np.ndarray,
+) -> dict[str, np.ndarray]:
+    """
+    Aggregates rows sorted by pair, and by window within each pair, into one
+    candle per (pair, window).
+    """
+    if not len(pairs):
+        return {
+            'pair': pairs,
+            'open': open_,
+            'high': high,
+            'low': low,
+            'close': close,
+            'volume': volume,
+            'window_start_ms': window_start_ms,
+        }
+
+    is_start = np.empty(len(pairs), dtype=bool)
+    is_start[0] = True
+    is_start[1:] = (pairs[1:] != pairs[:-1]) | (
+        window_start_ms[1:] != window_start_ms[:-1]
+    )
+    starts = np.flatnonzero(is_start)
+    lengths = np.diff(np.append(starts, len(pairs)))
+
+    return {
+        'pair': pairs[starts],
+        'open': open_[starts],
+        'high': np.maximum.reduceat(high, starts),
+        'low': np.minimum.reduceat(low, starts),
+        'close': close[starts + lengths - 1],
+        'volume': _sequential_sum(volume, starts, lengths),
+        'window_start_ms': window_start_ms[starts],
+    }
+
+
+def build_candles(
+    trades: pd.DataFrame, candle_seconds: int | list[int]
+) -> pd.DataFrame:
+    """
+    Computes the candles of `trades` for one or more durations.
+
+    Args:
+        trades (pd.DataFrame): Trades in arrival order, with the `product_id`,
+            `price`, `quantity` and `timestamp_ms` columns
+        candle_seconds (int | list[int]): Candle duration in seconds, or several of
+            them, multiples of the smallest
+
+    Returns:
+        pd.DataFrame: The candles, with the columns of the streaming output, sorted
+            by candle_seconds, pair and window
+    """
+    if isinstance(candle_seconds, int):
+        candle_seconds = [candle_seconds]
+    base_candle_seconds = min(candle_seconds)
+    larger_candle_seconds = sorted(set(candle_seconds) - {base_candle_seconds})
+    # same checks as the streaming service
+    CandleRollup(base_candle_seconds, larger_candle_seconds)
+
+    # Step 1. Group the trades by pair, keeping their arrival order
+    order = np.argsort(trades['product_id'].to_numpy(), kind='stable')
+    pairs = trades['product_id'].to_numpy()[order]
+    price = trades['price'].to_numpy(dtype=np.float64)[order]
+    quantity = trades['quantity'].to_numpy(dtype=np.float64)[order]
+    timestamp_ms = trades['timestamp_ms'].to_numpy(dtype=np.int64)[order]
+
+    # Step 2. Drop the trades the tumbling window drops as late: the ones in an
+    # earlier window than the latest trade of the pair so far
+    window_ms = base_candle_seconds * 1000
+    latest_ms = pd.Series(timestamp_ms).groupby(pairs, sort=False).cummax().to_numpy()
+    window_start_ms = timestamp_ms - timestamp_ms % window_ms
+    on_time = window_start_ms == latest_ms - latest_ms % window_ms
+    if not on_time.all():
+        logger.info(f'Dropping {(~on_time).sum()} late trades')
+        pairs, price, quantity, window_start_ms = (
+            pairs[on_time],
+            price[on_time],
+            quantity[on_time],
+            window_start_ms[on_time],
+        )
+
+    # Step 3. Aggregate the trades into candles of the smallest duration
+    base = _aggregate(pairs, window_start_ms, price, price, price, price, quantity)
+    all_candles = [_to_frame(base, base_candle_seconds)]
+
+    # Step 4. Roll them up into the larger durations
+    for seconds in larger_candle_seconds:
+        window_ms = seconds * 1000
+        candles = _aggregate(
+            base['pair'],
+            base['window_start_ms'] - base['window_start_ms'] % window_ms,
+            base['open'],
+            base['high'],
+            base['low'],
+            base['close'],
+            base['volume'],
+        )
+        all_candles.append(_to_frame(candles, seconds))
+
+    return pd.concat(all_candles, ignore_index=True)
+
+
+def _to_frame(candles: dict[str, np.ndarray], candle_seconds: int) -> pd.DataFrame:
+    frame = pd.DataFrame(candles)
+    frame['window_end_ms'] = frame['window_start_ms'] + candle_seconds * 1000
+    frame['candle_seconds'] = candle_seconds
+    return frame[CANDLE_COLUMNS]
+
+
+def write_candles(candles: pd.DataFrame, path: str):
+    """
+    Writes the candles to a Parquet, CSV or JSON lines file.
+    """
+    if path.endswith('.parquet'):
+        candles.to_parquet(path, index=False)
+    elif path.endswith('.csv'):
+        candles.to_csv(path, index=False)
+    elif path.endswith(('.jsonl', '.json')):
+        # the JSON serializer of the topics, pandas rounds floats to 15 digits
+        with open(path, 'wb') as f:
+            for candle in candles.to_dict('records'):
+                f.write(dumps(candle) + b'\n')
+    else:
+        raise ValueError(f'Unknown candles file format: {path}')
+
+
+def produce_candles(
+    candles: pd.DataFrame,
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_output_topic_partitions: Optional[int] = None,
+    kafka_output_value_format: str = 'json',
+):
+    """
+    Produces the candles to the candles topic like the streaming service does: keyed
+    by pair, with the window start as message timestamp.
+    """
+    app = Application(broker_address=kafka_broker_address)
+
+    trades_topic = app.topic(kafka_input_topic)
+    candles_topic = app.topic(
+        kafka_output_topic,
+        value_serializer=value_serializer(kafka_output_value_format, 'candle'),
+        config=TopicConfig(
+            num_partitions=kafka_output_topic_partitions
+            or trades_topic.broker_config.num_partitions,
+            replication_factor=trades_topic.broker_config.replication_factor,
+        ),
+    )
+
+    with app.get_producer() as producer:
+        for candle in candles.to_dict('records'):
+            message = candles_topic.serialize(
+                key=candle['pair'],
+                value=candle,
+                timestamp_ms=candle['window_start_ms'],
+            )
+            producer.produce(
+                topic=candles_topic.name,
+                value=message.value,
+                key=message.key,
+                timestamp=message.timestamp,
+            )
+
+
+def run(
+    # kafka parameters
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    # candles parameters
+    candle_seconds: int | list[int],
+    # offline parameters
+    trades_path: Optional[str] = None,
+    archive_dir: Optional[str] = None,
+    product_ids: Optional[list[str]] = None,
+    last_n_days: int = 60,
+    output_path: Optional[str] = None,
+    kafka_output_topic_partitions: Optional[int] = None,
+    kafka_output_value_format: str = 'json',
+):
+    """
+    Builds the candles of historical trades in one batch.
+
+    Args:
+        kafka_broker_address (str): Kafka broker address
+        kafka_input_topic (str): Kafka trades topic, to create the candles topic
+            with the same partitions, like the streaming service does
+        kafka_output_topic (str): Kafka candles topic
+        candle_seconds (int | list[int]): Candle duration in seconds, or several
+        trades_path (Optional[str]): Parquet, CSV or JSON lines file of trades
+        archive_dir (Optional[str]): Trade archive to read the trades from, if
+            there is no `trades_path`
+        product_ids (Optional[list[str]]): Pairs to read from the archive
+        last_n_days (int): Days of trades to read from the archive
+        output_path (Optional[str]): File to write the candles to. If not set, they
+            are produced to `kafka_output_topic`
+        kafka_output_topic_partitions (Optional[int]): Number of partitions of the
+            candles topic, if it has to be created
+        kafka_output_value_format (str): 'json', or 'binary' for the compact format
+            of `trades.codec`
+
+    Returns:
+        None
+    """
+    start = time.perf_counter()
+    if trades_path is not None:
+        trades = load_trades(trades_path)
+    elif archive_dir is not None and product_ids:
+        end_ms = int(time.time() * 1000)
+        trades = load_archived_trades(
+            archive_dir, product_ids, end_ms - last_n_days * MS_PER_DAY, end_ms
+        )
+    else:
+        raise ValueError('Set trades_path, or archive_dir and product_ids')
+    logger.info(f'Loaded {len(trades)} trades in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    candles = build_candles(trades, candle_seconds)
+    logger.info(f'Built {len(candles)} candles in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    if output_path is not None:
+        write_candles(candles, output_path)
+        destination = output_path
+    else:
+        produce_candles(
+            candles,
+            kafka_broker_address=kafka_broker_address,
+            kafka_input_topic=kafka_input_topic,
+            kafka_output_topic=kafka_output_topic,
+            kafka_output_topic_partitions=kafka_output_topic_partitions,
+            kafka_output_value_format=kafka_output_value_format,
+        )
+        destination = f'topic {kafka_output_topic}'
+    logger.info(
+        f'Wrote {len(candles)} candles to {destination} in '
+        f'{time.perf_counter() - start:.1f}s'
+    )
+
+
+if __name__ == '__main__':
+    from candles.config import config
+
+    run(
+        kafka_broker_address=config.kafka_broker_address,
+        kafka_input_topic=config.kafka_input_topic,
+        kafka_output_topic=config.kafka_output_topic,
+        candle_seconds=config.candle_seconds,
+        trades_path=config.offline_trades_path,
+        archive_dir=config.offline_archive_dir,
+        product_ids=config.offline_product_ids,
+        last_n_days=config.offline_last_n_days,
+        output_path=config.offline_output_path,
+        kafka_output_topic_partitions=config.kafka_output_topic_partitions,
+        kafka_output_value_format=config.kafka_output_value_format,
+    )
@@ -0,0 +1,165 @@
+from quixstreams import State
+
+
+def merge_candles(candle: dict, later: dict) -> dict:
+    """
+    Merges `later` into `candle`, a candle that ends at or before `later` starts.
+
+    Args:
+        candle (dict): The earlier candle, it is not modified
+        later (dict): The later candle
+
+    Returns:
+        dict: A candle with the window and `candle_seconds` of `candle`
+    """
+    return {
+        **candle,
+        'high': max(candle['high'], later['high']),
+        'low': min(candle['low'], later['low']),
+        'close': later['close'],
+        'volume': candle['volume'] + later['volume'],
+    }
+
+
+class CandleRollup:
+    """
+    Rolls candles of the smallest timeframe up into candles of larger timeframes
+    (cascade aggregation), so a single service builds all the timeframes from one
+    read of the trades topic.
+
+    It is a stateful step after the base candles, with one state per pair (the
+    message key) holding:
+    - the last base candle, which is still open until a candle of a later window
+      arrives, and
+    - for each larger timeframe, the open candle aggregated from the base candles
+      that are finished.
+
+    For every base candle it returns the base candle followed by the current
+    candle of each larger timeframe, i.e. the finished base candles of its window
+    merged with the current base candle.
+
+    With `final_only`, base candles come once, when their window is closed, and
+    larger candles are only returned once their window is closed too.
+
+    With `skip_empty`, base candles without trades (windows that only had ticks of
+    the `IdleWindowCloser`, when they are not gap-filled) are returned alone and
+    not rolled up, as if they never came.
+    """
+
+    def __init__(
+        self,
+        base_candle_seconds: int,
+        candle_seconds: list[int],
+        final_only: bool = False,
+        skip_empty: bool = False,
+    ):
+        """
+        Args:
+            base_candle_seconds (int): Duration of the base candles
+            candle_seconds (list[int]): Durations of the larger candles, each a
+                multiple of `base_candle_seconds`
+            final_only (bool): True if the base candles only come once, when their
+                window is closed, and the larger ones have to be emitted like that
+            skip_empty (bool): True to pass the base candles without trades
+                through, without rolling them up
+        """
+        for seconds in candle_seconds:
+            if seconds <= base_candle_seconds or seconds % base_candle_seconds:
+                raise ValueError(
+                    f'Candles of {seconds}s cannot be rolled up from candles of '
+                    f'{base_candle_seconds}s: it must be a larger multiple'
+                )
+
+        self.base_candle_seconds = base_candle_seconds
+        self.candle_seconds = sorted(candle_seconds)
+        self.final_only = final_only
+        self.skip_empty = skip_empty
+
+    @staticmethod
+    def _start_candle(base: dict, seconds: int) -> dict:
+        """
+        Starts a candle of `seconds` from its first base candle.
+        """
+        window_ms = seconds * 1000
+        window_start_ms = base['window_start_ms'] - base['window_start_ms'] % window_ms
+        return {
+            **base,
+            'window_start_ms': window_start_ms,
+            'window_end_ms': window_start_ms + window_ms,
+            'candle_seconds': seconds,
+        }
+
+    def _roll(self, base: dict, open_candles: dict[str, dict]) -> list[dict]:
+        """
+        Adds the finished `base` candle to the open candle of each larger timeframe.
+
+        Returns:
+            list[dict]: The larger candles that are finished now
+        """
+        finished = []
+        for seconds in self.candle_seconds:
+            candle = open_candles.get(str(seconds))
+            if (
+                candle is not None
+                and base['window_start_ms'] >= candle['window_end_ms']
+            ):
+                # the pair had no trades at the end of that window
+                finished.append(candle)
+                candle = None
+
+            if candle is None:
+                candle = self._start_candle(base, seconds)
+            else:
+                candle = merge_candles(candle, base)
+
+            if candle['window_end_ms'] == base['window_end_ms']:
+                # that was the last base candle of the window
+                finished.append(candle)
+                open_candles.pop(str(seconds), None)
+            else:
+                open_candles[str(seconds)] = candle
+
+        return finished
+
+    def process(self, candle: dict, state: State) -> list[dict]:
+        """
+        Takes a base candle and returns it with the current candle of each larger
+        timeframe.
+        """
+        if self.skip_empty and not candle['volume']:
+            return [candle]
+
+        rollup = state.get('rollup', default={'base': None, 'open': {}})
+        last_base = rollup['base']
+
+        if last_base is not None and (
+            candle['window_start_ms'] < last_base['window_start_ms']
+        ):
+            # update of a base window that we already rolled up, it's too late
+            return [candle]
+
+        if self.final_only:
+            rollup['base'] = candle
+            candles = [candle, *self._roll(candle, rollup['open'])]
+            state.set('rollup', rollup)
+            return candles
+
+        if last_base is not None and (
+            candle['window_start_ms'] > last_base['window_start_ms']
+        ):
+            # the last base candle will not get any more updates
+            self._roll(last_base, rollup['open'])
+        rollup['base'] = candle
+        state.set('rollup', rollup)
+
+        candles = [candle]
+        for seconds in self.candle_seconds:
+            open_candle = rollup['open'].get(str(seconds))
+            if open_candle is not None and (
+                candle['window_start_ms'] < open_candle['window_end_ms']
+            ):
+                candles.append(merge_candles(open_candle, candle))
+            else:
+                candles.append(self._start_candle(candle, seconds))
+
+        return candles
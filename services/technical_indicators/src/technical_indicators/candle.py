@@ -1,39 +1,47 @@
-from config import config
-from quixstreams import State
-
+from typing import Optional
 
-def same_window(candle1: dict, candle2: dict) -> bool:
-    """
-    Check if two candles are in the same window
-    """
-    return (
-        candle1['pair'] == candle2['pair']
-        and candle1['window_start_ms'] == candle2['window_start_ms']
-        and candle1['window_end_ms'] == candle2['window_end_ms']
-    )
+from candle_buffer import CandleBuffer
+from quixstreams import State
+from warm_start import WarmStart
 
 
-def update_candles_state(candle: dict, state: State):
+def update_candles_state(
+    candle: dict,
+    state: State,
+    capacity: int,
+    warm_start: Optional[WarmStart] = None,
+) -> Optional[CandleBuffer]:
     """
-    Update the state with the new candle
+    Adds the candle to the candles of the pair in the state, replacing the last one
+    if it is of the same window.
+
+    Args:
+        candle (dict): The candle
+        state (State): The state of the pair
+        capacity (int): Number of candles to keep
+        warm_start (Optional[WarmStart]): Past candles to seed the state of a pair
+            with, before its first candle
+
+    Returns:
+        Optional[CandleBuffer]: The latest candles, or None if the candle is of an
+            earlier window than the last one, and was ignored
     """
-    # Get the current count from the state
-    candles = state.get('candles', default=[])
-
-    # Need to check if the new candle corresponds to
-    if not candles:
-        candles.append(candle)
-    elif same_window(candle, candles[-1]):
-        candles[-1] = candle
+    data = state.get('candle_buffer', default=None)
+    if data is not None:
+        candles = CandleBuffer.from_bytes(data, capacity)
     else:
-        # add new candle to the list
-        candles.append(candle)
+        # the state of the previous versions is a list of candle dicts
+        past_candles = state.get('candles', default=None)
+        if past_candles is not None:
+            state.delete('candles')
+        elif warm_start is not None:
+            past_candles = warm_start.candles(candle)
+        candles = CandleBuffer.from_candles(past_candles or [], capacity)
 
-    if len(candles) > config.max_candles_in_state:
-        # remove the oldest candle
-        candles.pop(0)
+    if not candles.add(candle):
+        return None
 
-    # update the state with candles
-    state.set('candles', candles)
+    # the whole buffer is written, its size does not depend on the candles in it
+    state.set('candle_buffer', candles.to_bytes())
 
-    return candle
+    return candles
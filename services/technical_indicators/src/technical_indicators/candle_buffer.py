@@ -0,0 +1,165 @@
+"""
+Fixed-capacity, column-oriented ring buffer of the latest candles of a pair.
+
+The columns (window start, open, high, low, close, volume) are the rows of one
+float64 array. Every candle is written twice, at `i` and `i + capacity`, so the
+latest `count` candles are always a contiguous slice of each row: `buffer.close`
+is a view in time order that goes straight to the TA-Lib functions, without
+copies.
+
+In the state store the buffer takes a fixed number of bytes: a small header and
+`capacity` slots per column, whatever the number of candles in it.
+"""
+
+import struct
+from typing import Any, Optional
+
+import numpy as np
+from quixstreams.utils.json import dumps as json_dumps
+from quixstreams.utils.json import loads as json_loads
+
+WINDOW_START_MS, OPEN, HIGH, LOW, CLOSE, VOLUME = range(6)
+COLUMNS = ('window_start_ms', 'open', 'high', 'low', 'close', 'volume')
+
+# capacity, count, position of the next write
+_HEADER = struct.Struct('<III')
+
+
+class CandleBuffer:
+    """
+    The latest `capacity` candles of a pair, oldest first.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.count = 0
+        # position of the next write, in [0, capacity)
+        self.position = 0
+        self._data = np.zeros((len(COLUMNS), 2 * capacity))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _column(self, column: int) -> np.ndarray:
+        end = self.position + self.capacity
+        return self._data[column, end - self.count : end]
+
+    @property
+    def window_start_ms(self) -> np.ndarray:
+        return self._column(WINDOW_START_MS)
+
+    @property
+    def open(self) -> np.ndarray:
+        return self._column(OPEN)
+
+    @property
+    def high(self) -> np.ndarray:
+        return self._column(HIGH)
+
+    @property
+    def low(self) -> np.ndarray:
+        return self._column(LOW)
+
+    @property
+    def close(self) -> np.ndarray:
+        return self._column(CLOSE)
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self._column(VOLUME)
+
+    def columns(self) -> dict[str, np.ndarray]:
+        """
+        Views of all the columns, by name.
+        """
+        return {name: self._column(column) for column, name in enumerate(COLUMNS)}
+
+    @property
+    def last_window_start_ms(self) -> Optional[int]:
+        if not self.count:
+            return None
+        return int(self._data[WINDOW_START_MS, self.position + self.capacity - 1])
+
+    def _write(self, index: int, candle: dict):
+        values = [candle[name] for name in COLUMNS]
+        self._data[:, index] = values
+        self._data[:, index + self.capacity] = values
+
+    def add(self, candle: dict) -> bool:
+        """
+        Adds the candle. A candle of the same window as the last one replaces it,
+        and the oldest candle is dropped once the buffer is full.
+
+        Returns:
+            bool: False if the candle is of an earlier window than the last one,
+                and was not added
+        """
+        last_window_start_ms = self.last_window_start_ms
+        if last_window_start_ms is not None:
+            if candle['window_start_ms'] < last_window_start_ms:
+                return False
+            if candle['window_start_ms'] == last_window_start_ms:
+                self._write((self.position - 1) % self.capacity, candle)
+                return True
+
+        self._write(self.position, candle)
+        self.position = (self.position + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        return True
+
+    def to_bytes(self) -> bytes:
+        return (
+            _HEADER.pack(self.capacity, self.count, self.position)
+            + self._data[:, : self.capacity].tobytes()
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes, capacity: Optional[int] = None) -> 'CandleBuffer':
+        """
+        Loads a buffer, resized to `capacity` if given, keeping the latest candles.
+        """
+        stored_capacity, count, position = _HEADER.unpack_from(data)
+        slots = np.frombuffer(
+            data, offset=_HEADER.size, count=len(COLUMNS) * stored_capacity
+        ).reshape(len(COLUMNS), stored_capacity)
+
+        buffer = cls(capacity or stored_capacity)
+        if buffer.capacity == stored_capacity:
+            buffer._data[:, :stored_capacity] = slots
+            buffer._data[:, stored_capacity:] = slots
+            buffer.count = count
+            buffer.position = position
+            return buffer
+
+        # oldest first, then keep the latest ones
+        order = np.arange(position - count, position) % stored_capacity
+        kept = slots[:, order][:, -buffer.capacity :]
+        buffer.count = kept.shape[1]
+        buffer._data[:, : buffer.count] = kept
+        buffer._data[:, buffer.capacity : buffer.capacity + buffer.count] = kept
+        buffer.position = buffer.count % buffer.capacity
+        return buffer
+
+    @classmethod
+    def from_candles(cls, candles: list[dict], capacity: int) -> 'CandleBuffer':
+        buffer = cls(capacity)
+        for candle in candles:
+            buffer.add(candle)
+        return buffer
+
+
+# Values in the state store are JSON by default. Raw bytes, like the candle buffer,
+# are stored as they are, behind a marker byte that JSON never starts with.
+_BYTES_MARKER = b'\x00'
+
+
+def state_dumps(value: Any) -> bytes:
+    if isinstance(value, bytes):
+        return _BYTES_MARKER + value
+    return json_dumps(value)
+
+
+def state_loads(value: bytes) -> Any:
+    if value[:1] == _BYTES_MARKER:
+        return value[1:]
+    return json_loads(value)
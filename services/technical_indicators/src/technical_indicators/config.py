@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -10,8 +12,62 @@ class Settings(BaseSettings):
     kafka_input_topic: str
     kafka_output_topic: str
     kafka_consumer_group: str
+    # 'binary' uses the compact format of trades.codec instead of JSON
+    kafka_input_value_format: Literal['json', 'binary'] = 'json'
+    # keep 'json' if RisingWave reads the output topic (query.sql)
+    kafka_output_value_format: Literal['json', 'binary'] = 'json'
     candle_seconds: int
-    max_candles_in_state: int = 10
+    # names of the indicator outputs to compute, e.g. the features of a model. The
+    # periods are in the names, see registry.py. Other names are ignored
+    indicators: list[str] = [
+        'sma_7',
+        'sma_14',
+        'sma_21',
+        'sma_60',
+        'ema_7',
+        'ema_14',
+        'ema_21',
+        'ema_60',
+        'rsi_7',
+        'rsi_14',
+        'rsi_21',
+        'rsi_60',
+        'macd_7',
+        'macdsignal_7',
+        'macdhist_7',
+        'obv',
+    ]
+    # 'incremental' keeps a running state per indicator and updates it in constant
+    # time per candle. 'talib' recomputes them with talib.stream from the last
+    # max_candles_in_state candles
+    indicators_engine: Literal['incremental', 'talib'] = 'incremental'
+    # candles kept by the 'talib' engine. Defaults to the candles the indicators
+    # need to have a value
+    max_candles_in_state: Optional[int] = None
+    # where the state of a pair is seeded from when the service has no state for
+    # it, e.g. after the first deploy. None starts from the first candle
+    warm_start_source: Optional[Literal['candles_topic', 'risingwave']] = (
+        'candles_topic'
+    )
+    # past candles to seed the state with. Defaults to the candles the indicators
+    # need to have a value
+    warm_start_candles: Optional[int] = None
+    # offline backfill (offline.py): candles file to read instead of the candles
+    # topic, days of the candles topic to read, and file to write instead of the
+    # output topic
+    offline_candles_path: Optional[str] = None
+    offline_last_n_days: int = 60
+    offline_output_path: Optional[str] = None
+    # RisingWave, for the 'risingwave' warm start source
+    risingwave_host: str = 'localhost'
+    risingwave_port: int = 4567
+    risingwave_user: str = 'root'
+    risingwave_password: str = ''
+    risingwave_database: str = 'dev'
+    risingwave_table: str = 'public.technical_indicators'
+    # partitions of the output topic if it has to be created. Defaults to the
+    # partitions of the input topic
+    kafka_output_topic_partitions: Optional[int] = None
 
 
 config = Settings()
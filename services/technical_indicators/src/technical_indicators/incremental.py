@@ -0,0 +1,355 @@
+"""
+Incremental technical indicators, updated in constant time per candle.
+
+Each indicator keeps a small running state per (pair, candle_seconds) instead of
+recomputing from the whole candle history: rolling sums for SMA, the previous
+value for EMA, Wilder-smoothed gains and losses for RSI, the two EMAs and the
+signal EMA for MACD, and the cumulative OBV.
+
+The arithmetic is the one of the TA-Lib C functions, operation by operation,
+including how EMAs and RSI are seeded from the first `period` candles, so the
+values match the TA-Lib functions over the full candle history (e.g.
+`talib.SMA(close, 7)`) to within `TOLERANCE`: they differ in the last bits at
+most, where the C compiler rounds intermediate results differently. The rolling
+sum of SMA drifts over time like the one of TA-Lib does.
+
+Note that `talib.stream` functions only see the candles kept in the state, so
+they start their EMAs, RSI and OBV from the oldest of those candles, and give
+different values than TA-Lib over the full history.
+
+A candle is first `peek`ed: its values are computed from the state of the
+previous (finished) candles without changing it, so intermediate updates of the
+same window can be computed again and again. It is `commit`ted when a candle of
+the next window arrives.
+
+The states are lists of numbers, so they can be stored in the Quix Streams state.
+"""
+
+import math
+from typing import TYPE_CHECKING, Optional
+
+from quixstreams import State
+from warm_start import WarmStart
+
+if TYPE_CHECKING:
+    from registry import Indicator
+
+NAN = math.nan
+
+# |value - talib value| <= TOLERANCE * max(1, |talib value|)
+TOLERANCE = 1e-9
+
+
+class SMA:
+    """
+    Simple moving average of the close, like `talib.SMA`.
+
+    State: [n_committed, total, position, ring of the last period - 1 closes]
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self.lookback = period - 1
+
+    def initial_state(self) -> list:
+        return [0, 0.0, 0, [0.0] * (self.period - 1)]
+
+    def peek(self, state: list, close: float, volume: float) -> tuple:
+        n, total, _, _ = state
+        if n < self.period - 1:
+            return (NAN,)
+        return ((total + close) / self.period,)
+
+    def commit(self, state: list, close: float, volume: float):
+        n, total, position, ring = state
+        # TA-Lib adds the new close, and subtracts the one leaving the period once
+        # the SMA has a value
+        total += close
+        if n >= self.period - 1:
+            total -= ring[position] if ring else close
+        if ring:
+            ring[position] = close
+            position = (position + 1) % len(ring)
+        state[0] = n + 1
+        state[1] = total
+        state[2] = position
+
+
+class EMA:
+    """
+    Exponential moving average of the close, like `talib.EMA`: seeded with the SMA
+    of the first `period` closes, then smoothed with k = 2 / (period + 1).
+
+    `skip` ignores that many closes first. MACD uses it to start its fast EMA at
+    the same candle as its slow EMA, as TA-Lib does.
+
+    State: [n_committed, total of the first closes or the last EMA]
+    """
+
+    def __init__(self, period: int, skip: int = 0):
+        self.period = period
+        self.skip = skip
+        self.k = 2.0 / (period + 1)
+        self.lookback = skip + period - 1
+
+    def initial_state(self) -> list:
+        return [0, 0.0]
+
+    def value(self, state: list, x: float) -> float:
+        n, total = state
+        n -= self.skip
+        if n < self.period - 1:
+            return NAN
+        if n == self.period - 1:
+            return (total + x) / self.period
+        return ((x - total) * self.k) + total
+
+    def peek(self, state: list, close: float, volume: float) -> tuple:
+        return (self.value(state, close),)
+
+    def push(self, state: list, x: float):
+        n = state[0] - self.skip
+        if n == self.period - 1:
+            state[1] = (state[1] + x) / self.period
+        elif n >= self.period:
+            state[1] = ((x - state[1]) * self.k) + state[1]
+        elif n >= 0:
+            state[1] += x
+        state[0] += 1
+
+    def commit(self, state: list, close: float, volume: float):
+        self.push(state, close)
+
+
+class RSI:
+    """
+    Relative strength index of the close, like `talib.RSI`: Wilder-smoothed gains
+    and losses, seeded with their average over the first `period` changes.
+
+    State: [n_committed, previous close, gain, loss]
+    """
+
+    def __init__(self, period: int):
+        self.period = period
+        self.lookback = period
+
+    def initial_state(self) -> list:
+        return [0, 0.0, 0.0, 0.0]
+
+    def _step(self, state: list, close: float) -> tuple[float, float, float]:
+        """
+        Returns the gain, loss and RSI after `close`.
+        """
+        n, previous, gain, loss = state
+        if n == 0:
+            return 0.0, 0.0, NAN
+
+        change = close - previous
+        if n <= self.period:
+            # seeding, the sums of the first changes
+            if change < 0:
+                loss -= change
+            else:
+                gain += change
+            if n < self.period:
+                return gain, loss, NAN
+            loss /= self.period
+            gain /= self.period
+        else:
+            loss *= self.period - 1
+            gain *= self.period - 1
+            if change < 0:
+                loss -= change
+            else:
+                gain += change
+            loss /= self.period
+            gain /= self.period
+
+        total = gain + loss
+        # TA_IS_ZERO
+        rsi = 100.0 * (gain / total) if not -1e-8 < total < 1e-8 else 0.0
+        return gain, loss, rsi
+
+    def peek(self, state: list, close: float, volume: float) -> tuple:
+        return (self._step(state, close)[2],)
+
+    def commit(self, state: list, close: float, volume: float):
+        gain, loss, _ = self._step(state, close)
+        state[0] += 1
+        state[1] = close
+        state[2] = gain
+        state[3] = loss
+
+
+class MACD:
+    """
+    Moving average convergence divergence of the close, like `talib.MACD`: the
+    fast and slow EMAs both start at the candle where the slow one has a value,
+    and the signal is the EMA of their difference.
+
+    State: [fast EMA state, slow EMA state, signal EMA state]
+    """
+
+    def __init__(self, fast_period: int, slow_period: int, signal_period: int):
+        # like TA-Lib
+        if slow_period < fast_period:
+            fast_period, slow_period = slow_period, fast_period
+        self.fast = EMA(fast_period, skip=slow_period - fast_period)
+        self.slow = EMA(slow_period)
+        self.signal = EMA(signal_period)
+        self.lookback = slow_period - 1 + signal_period - 1
+
+    def initial_state(self) -> list:
+        return [
+            self.fast.initial_state(),
+            self.slow.initial_state(),
+            self.signal.initial_state(),
+        ]
+
+    def peek(self, state: list, close: float, volume: float) -> tuple:
+        fast_state, slow_state, signal_state = state
+        macd = self.fast.value(fast_state, close) - self.slow.value(slow_state, close)
+        if math.isnan(macd):
+            return NAN, NAN, NAN
+        signal = self.signal.value(signal_state, macd)
+        if math.isnan(signal):
+            # TA-Lib only outputs MACD once the signal has a value
+            return NAN, NAN, NAN
+        return macd, signal, macd - signal
+
+    def commit(self, state: list, close: float, volume: float):
+        fast_state, slow_state, signal_state = state
+        macd = self.fast.value(fast_state, close) - self.slow.value(slow_state, close)
+        self.fast.push(fast_state, close)
+        self.slow.push(slow_state, close)
+        if not math.isnan(macd):
+            self.signal.push(signal_state, macd)
+
+
+class OBV:
+    """
+    On-balance volume, like `talib.OBV`: starts at the volume of the first candle,
+    and adds or subtracts the volume of each candle that closes up or down.
+
+    State: [n_committed, previous close, OBV]
+    """
+
+    def __init__(self):
+        self.lookback = 0
+
+    def initial_state(self) -> list:
+        return [0, 0.0, 0.0]
+
+    def _step(self, state: list, close: float, volume: float) -> float:
+        n, previous, obv = state
+        if n == 0:
+            return volume
+        if close > previous:
+            return obv + volume
+        if close < previous:
+            return obv - volume
+        return obv
+
+    def peek(self, state: list, close: float, volume: float) -> tuple:
+        return (self._step(state, close, volume),)
+
+    def commit(self, state: list, close: float, volume: float):
+        state[2] = self._step(state, close, volume)
+        state[0] += 1
+        state[1] = close
+
+
+class IndicatorEngine:
+    """
+    Computes the indicators of one (pair, candle_seconds) series, one candle at a
+    time, from a state that does not grow with the history.
+
+    State: {'window_start_ms': of the pending candle, 'pending': [close, volume] of
+    the latest candle, not committed yet, 'indicators': {indicator key: its state}}
+    """
+
+    def __init__(
+        self,
+        indicators: list['Indicator'],
+        warm_start: Optional[WarmStart] = None,
+    ):
+        """
+        Args:
+            indicators (list[Indicator]): The indicators to compute, see
+                `registry.select`
+            warm_start (Optional[WarmStart]): Past candles to seed the state of a
+                pair with, before its first candle
+        """
+        self.indicators = indicators
+        self.warm_start = warm_start
+        self._incremental = [
+            (indicator.key, indicator.outputs, indicator.incremental())
+            for indicator in indicators
+        ]
+
+    def initial_state(self) -> dict:
+        return {
+            'window_start_ms': None,
+            'pending': None,
+            'indicators': {
+                key: incremental.initial_state()
+                for key, _, incremental in self._incremental
+            },
+        }
+
+    def update(self, state: dict, candle: dict) -> dict | None:
+        """
+        Adds the candle to the state and returns its indicators.
+
+        A candle of the same window as the pending one replaces it. A candle of a
+        later window commits the pending one first. A candle of an earlier window
+        is too late, it is ignored and None is returned.
+        """
+        window_start_ms = candle['window_start_ms']
+        pending_window_ms = state['window_start_ms']
+        indicators_state = state['indicators']
+        if pending_window_ms is not None:
+            if window_start_ms < pending_window_ms:
+                return None
+            if window_start_ms > pending_window_ms:
+                close, volume = state['pending']
+                for key, _, incremental in self._incremental:
+                    incremental.commit(indicators_state[key], close, volume)
+
+        state['window_start_ms'] = window_start_ms
+        state['pending'] = [candle['close'], candle['volume']]
+
+        values = {}
+        for key, outputs, incremental in self._incremental:
+            peeked = incremental.peek(
+                indicators_state[key], candle['close'], candle['volume']
+            )
+            for name, value in zip(outputs, peeked, strict=True):
+                # outputs that were not selected are None
+                if name is not None:
+                    values[name] = value
+        return values
+
+    def process(self, candle: dict, state: State) -> dict | None:
+        """
+        Stateful step of the service: returns the candle with its indicators, or
+        None if the candle is too late.
+        """
+        indicators_state = state.get('indicators', default=None)
+        if indicators_state is None:
+            indicators_state = self.initial_state()
+            if self.warm_start is not None:
+                for past_candle in self.warm_start.candles(candle):
+                    self.update(indicators_state, past_candle)
+        else:
+            # indicators added to the configuration start from this candle
+            for key, _, incremental in self._incremental:
+                if key not in indicators_state['indicators']:
+                    indicators_state['indicators'][key] = incremental.initial_state()
+
+        values = self.update(indicators_state, candle)
+        if values is None:
+            return None
+
+        state.set('indicators', indicators_state)
+        return {**candle, **values}
@@ -1,67 +1,57 @@
+from typing import Optional
+
+from candle import update_candles_state
 from loguru import logger
+from quixstreams import State
+from registry import Indicator
 from talib import stream
+from warm_start import WarmStart
 
 
 def compute_technical_indicators(
     candle: dict,
-    state: dict,
-):
+    state: State,
+    indicators: list[Indicator],
+    capacity: int,
+    warm_start: Optional[WarmStart] = None,
+) -> Optional[dict]:
     """
-    Computes technical indicators from the candles in the state dictionary.
+    Adds the candle to the candles in the state, and computes technical indicators
+    from them.
 
     Args:
-        candles (list): List of candles in the state dictionary
+        candle (dict): The candle
+        state (State): The state of the pair
+        indicators (list[Indicator]): The indicators to compute, see
+            `registry.select`
+        capacity (int): Number of candles to keep in the state
+        warm_start (Optional[WarmStart]): Past candles to seed the state of a pair
+            with, before its first candle
 
     Returns:
-        dict: Dictionary with the computed technical indicators
+        Optional[dict]: The candle with the computed technical indicators, or None
+            if the candle is of an earlier window than the last one in the state
     """
-    import numpy as np
-
-    # Extract the candles from the state dictionary
-    candles = state.get('candles', default=[])
+    candles = update_candles_state(candle, state, capacity, warm_start)
+    if candles is None:
+        return None
 
     logger.debug(f'Number of candles in state: {len(candles)}')
 
-    # Extract the open, close, high, low, volume candles (which is a list of dictionaries)
-    # into numpy arrays, because this is the type that TA-Lib expects to compute the indicators
-    _open = np.array([c['open'] for c in candles])
-    _high = np.array([c['high'] for c in candles])
-    _low = np.array([c['low'] for c in candles])
-    close = np.array([c['close'] for c in candles])
-    volume = np.array([c['volume'] for c in candles])
-
-    indicators = {}
-
-    # Simple Moving Average (SMA) for different periods
-    # indicators['sma_1'] = stream.SMA(close, timeperiod=1) # just to check the type
-    indicators['sma_7'] = stream.SMA(close, timeperiod=7)
-    indicators['sma_14'] = stream.SMA(close, timeperiod=14)
-    indicators['sma_21'] = stream.SMA(close, timeperiod=21)
-    indicators['sma_60'] = stream.SMA(close, timeperiod=60)
-
-    # Exponential Moving Average (EMA) for different periods
-    indicators['ema_7'] = stream.EMA(close, timeperiod=7)
-    indicators['ema_14'] = stream.EMA(close, timeperiod=14)
-    indicators['ema_21'] = stream.EMA(close, timeperiod=21)
-    indicators['ema_60'] = stream.EMA(close, timeperiod=60)
-
-    # Relative Strength Index (RSI) for different periods
-    indicators['rsi_7'] = stream.RSI(close, timeperiod=7)
-    indicators['rsi_14'] = stream.RSI(close, timeperiod=14)
-    indicators['rsi_21'] = stream.RSI(close, timeperiod=21)
-    indicators['rsi_60'] = stream.RSI(close, timeperiod=60)
-
-    # Moving Average Convergence Divergence (MACD) for different periods
-    indicators['macd_7'], indicators['macdsignal_7'], indicators['macdhist_7'] = (
-        stream.MACD(close, fastperiod=7, slowperiod=14, signalperiod=9)
-    )
-
-    # On-Balance Volume (OBV)
-    indicators['obv'] = stream.OBV(close, volume)
+    # Views of the columns of the candles, oldest first, in the float64 arrays that
+    # TA-Lib expects
+    columns = candles.columns()
 
-    # breakpoint()
+    values = {}
+    for indicator in indicators:
+        for name, value in zip(
+            indicator.outputs, indicator.compute(stream, columns), strict=True
+        ):
+            # outputs that were not selected are None
+            if name is not None:
+                values[name] = value
 
     return {
         **candle,  # unpack the candle
-        **indicators,
+        **values,
     }
@@ -1,7 +1,16 @@
-from candle import update_candles_state
+from functools import partial
+from typing import Optional
+
+from candle_buffer import state_dumps, state_loads
+from incremental import IndicatorEngine
 from indicators import compute_technical_indicators
 from loguru import logger
 from quixstreams import Application
+from quixstreams.models import TopicConfig
+from quixstreams.state.rocksdb import RocksDBOptions
+from registry import outputs, required_candles, select
+from trades.codec import INDICATOR_NAMES, value_deserializer, value_serializer
+from warm_start import warm_start_from_config
 
 
 def run(
@@ -12,6 +21,22 @@ def run(
     kafka_consumer_group: str,
     # candles parameters
     candle_seconds: int,
+    kafka_output_topic_partitions: Optional[int] = None,
+    kafka_input_value_format: str = 'json',
+    kafka_output_value_format: str = 'json',
+    # indicators parameters
+    indicators: Optional[list[str]] = None,
+    indicators_engine: str = 'incremental',
+    max_candles_in_state: Optional[int] = None,
+    # warm start parameters
+    warm_start_source: Optional[str] = 'candles_topic',
+    warm_start_candles: Optional[int] = None,
+    risingwave_host: str = 'localhost',
+    risingwave_port: int = 4567,
+    risingwave_user: str = 'root',
+    risingwave_password: str = '',
+    risingwave_database: str = 'dev',
+    risingwave_table: str = 'public.technical_indicators',
 ):
     """
     Transforms a stream of input candles into a stream of technical indicators.
@@ -27,18 +52,96 @@ def run(
         kafka_output_topic (str): Kafka output topic name
         kafka_consumer_group (str): Kafka consumer group name
         candle_seconds (int): Candle duration in seconds
+        kafka_output_topic_partitions (Optional[int]): Number of partitions of the
+            output topic, if it has to be created. Defaults to the partitions of the
+            input topic.
+        kafka_input_value_format (str): 'json', or 'binary' for the compact format
+            of `trades.codec`
+        kafka_output_value_format (str): 'json', or 'binary' for the compact format
+            of `trades.codec`
+        indicators (Optional[list[str]]): Names of the indicator outputs to
+            compute, e.g. the features of a model, see `registry.select`. Defaults
+            to all the indicators of `trades.codec.INDICATOR_NAMES`
+        indicators_engine (str): 'incremental' to update the indicators in
+            constant time per candle, from their running state, or 'talib' to
+            compute them with `talib.stream` from the last candles in the state
+        max_candles_in_state (Optional[int]): Candles kept by the 'talib' engine.
+            Defaults to the candles the indicators need to have a value
+        warm_start_source (Optional[str]): Where the state of a pair is seeded
+            from, before its first candle, if the service has no state for it:
+            'candles_topic', 'risingwave', or None to start from its first candle
+        warm_start_candles (Optional[int]): Number of past candles to seed the
+            state with. Defaults to the candles the indicators need to have a value
+        risingwave_host (str): Host of RisingWave, for the 'risingwave' source
+        risingwave_port (int): Port of RisingWave
+        risingwave_user (str): User of RisingWave
+        risingwave_password (str): Password of RisingWave
+        risingwave_database (str): Database of RisingWave
+        risingwave_table (str): Table of the technical indicators in RisingWave
+
+    Candles are keyed by pair, so the candles state of a pair lives in a single
+    replica. Running N replicas with the same `kafka_consumer_group` splits the
+    partitions, and the pairs, between them.
 
     Returns:
         None
     """
+    selected = select(indicators or list(INDICATOR_NAMES))
+    if not selected:
+        raise ValueError(f'No indicators in {indicators}')
+    if kafka_output_value_format == 'binary':
+        unknown = set(outputs(selected)) - set(INDICATOR_NAMES)
+        if unknown:
+            raise ValueError(
+                f'{sorted(unknown)} cannot be produced in the binary format, append '
+                'them to trades.codec.INDICATOR_NAMES'
+            )
+        if warm_start_source == 'risingwave':
+            # the RisingWave table reads the output topic as JSON (see query.sql)
+            raise ValueError(
+                "The 'risingwave' warm start needs the JSON output format, the "
+                'RisingWave table cannot read the binary one'
+            )
+    logger.info(f'Computing {outputs(selected)}')
+
     app = Application(
         broker_address=kafka_broker_address,
         consumer_group=kafka_consumer_group,
+        # the candle buffer is stored as raw bytes
+        rocksdb_options=RocksDBOptions(dumps=state_dumps, loads=state_loads),
     )
     # input topic
-    candles_topic = app.topic(kafka_input_topic, value_deserializer='json')
+    candles_topic = app.topic(
+        kafka_input_topic,
+        value_deserializer=value_deserializer(kafka_input_value_format),
+    )
     # output topic
-    technical_indicators_topic = app.topic(kafka_output_topic, value_serializer='json')
+    technical_indicators_topic = app.topic(
+        kafka_output_topic,
+        value_serializer=value_serializer(
+            kafka_output_value_format, 'technical_indicators'
+        ),
+        config=TopicConfig(
+            num_partitions=kafka_output_topic_partitions
+            or candles_topic.broker_config.num_partitions,
+            replication_factor=candles_topic.broker_config.replication_factor,
+        ),
+    )
+
+    warm_start = warm_start_from_config(
+        warm_start_source,
+        candles_topic=candles_topic,
+        kafka_broker_address=kafka_broker_address,
+        kafka_consumer_group=kafka_consumer_group,
+        candle_seconds=candle_seconds,
+        n_candles=warm_start_candles or required_candles(selected),
+        risingwave_host=risingwave_host,
+        risingwave_port=risingwave_port,
+        risingwave_user=risingwave_user,
+        risingwave_password=risingwave_password,
+        risingwave_database=risingwave_database,
+        risingwave_table=risingwave_table,
+    )
 
     # Step 1. Ingest candles from the input kafka topic
     # Create a Streaming DataFrame connected to the input Kafka topic
@@ -47,12 +150,26 @@ def run(
     # Step 2: Keep only the candles for the given `candle_seconds`
     sdf = sdf[sdf['candle_seconds'] == candle_seconds]
 
-    # Step 3. Add candles to state dictionary
-
-    sdf = sdf.apply(update_candles_state, stateful=True)
-    # Step 4. Compute technical indicators
-
-    sdf = sdf.apply(compute_technical_indicators, stateful=True)
+    if indicators_engine == 'incremental':
+        # Step 3. Update the running state of the indicators with the candle, and
+        # compute them
+        engine = IndicatorEngine(selected, warm_start=warm_start)
+        sdf = sdf.apply(engine.process, stateful=True)
+        # candles of a window older than the latest one are too late
+        sdf = sdf.filter(lambda value: value is not None)
+    else:
+        # Step 3. Add the candle to the candles in the state, and compute the
+        # technical indicators from them
+        sdf = sdf.apply(
+            partial(
+                compute_technical_indicators,
+                indicators=selected,
+                capacity=max_candles_in_state or required_candles(selected),
+                warm_start=warm_start,
+            ),
+            stateful=True,
+        )
+        sdf = sdf.filter(lambda value: value is not None)
 
     # logging on the console
     sdf = sdf.update(lambda value: logger.debug(f'Final message: {value}'))
@@ -74,4 +191,18 @@ if __name__ == '__main__':
         kafka_output_topic=config.kafka_output_topic,
         kafka_consumer_group=config.kafka_consumer_group,
         candle_seconds=config.candle_seconds,
+        kafka_output_topic_partitions=config.kafka_output_topic_partitions,
+        kafka_input_value_format=config.kafka_input_value_format,
+        kafka_output_value_format=config.kafka_output_value_format,
+        indicators=config.indicators,
+        indicators_engine=config.indicators_engine,
+        max_candles_in_state=config.max_candles_in_state,
+        warm_start_source=config.warm_start_source,
+        warm_start_candles=config.warm_start_candles,
+        risingwave_host=config.risingwave_host,
+        risingwave_port=config.risingwave_port,
+        risingwave_user=config.risingwave_user,
+        risingwave_password=config.risingwave_password,
+        risingwave_database=config.risingwave_database,
+        risingwave_table=config.risingwave_table,
     )
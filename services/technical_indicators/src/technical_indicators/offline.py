@@ -0,0 +1,334 @@
+"""
+Offline technical indicators, for historical backfills.
+
+Instead of replaying every historical candle through Kafka and the streaming engine
+one message at a time, it loads the candles of every pair as columns, and computes
+each indicator over the whole series of a pair in one call to the TA-Lib function
+on full arrays (e.g. `talib.SMA(close, 7)`).
+
+The values are the ones the streaming service emits for the last candle of each
+window with the 'incremental' engine, to within `incremental.TOLERANCE`:
+- candles are taken per pair in arrival order, candles that the engine would drop
+  as late are dropped too, and only the last candle of each window is kept, like
+  the engine keeps it in its state once the next window starts,
+- the incremental engine follows the arithmetic of the TA-Lib functions, see
+  `incremental.py`.
+"""
+
+import time
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import talib
+from confluent_kafka import TopicPartition
+from loguru import logger
+from quixstreams import Application
+from quixstreams.kafka import Consumer
+from quixstreams.models import TopicConfig
+from quixstreams.utils.json import dumps
+from registry import Indicator, outputs, select
+from trades.codec import INDICATOR_NAMES, value_deserializer, value_serializer
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+# the fields of the candles, in the order the streaming service emits them
+CANDLE_COLUMNS = [
+    'pair',
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'window_start_ms',
+    'window_end_ms',
+    'candle_seconds',
+]
+
+
+def load_candles(path: str) -> pd.DataFrame:
+    """
+    Reads candles from a Parquet, CSV or JSON lines file with the fields of the
+    candles topic, in arrival order, e.g. the output of `candles.offline`.
+    """
+    if path.endswith('.parquet'):
+        candles = pd.read_parquet(path)
+    elif path.endswith('.csv'):
+        candles = pd.read_csv(path)
+    elif path.endswith(('.jsonl', '.json')):
+        candles = pd.read_json(path, lines=True)
+    else:
+        raise ValueError(f'Unknown candles file format: {path}')
+    return candles[CANDLE_COLUMNS]
+
+
+def load_topic_candles(
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_consumer_group: str,
+    start_ms: int,
+    kafka_input_value_format: str = 'json',
+    timeout_sec: float = 10.0,
+) -> pd.DataFrame:
+    """
+    Reads the candles of the candles topic from `start_ms` to the end of every
+    partition. Candles are keyed by pair, so the candles of a pair are in arrival
+    order.
+    """
+    app = Application(broker_address=kafka_broker_address)
+    topic = app.topic(
+        kafka_input_topic,
+        value_deserializer=value_deserializer(kafka_input_value_format),
+    )
+    # reads the partitions it is assigned, it never commits offsets
+    consumer = Consumer(
+        broker_address=kafka_broker_address,
+        consumer_group=f'{kafka_consumer_group}-offline',
+        auto_offset_reset='earliest',
+        auto_commit_enable=False,
+    )
+
+    n_partitions = topic.broker_config.num_partitions
+    starts = consumer.offsets_for_times(
+        [TopicPartition(topic.name, p, start_ms) for p in range(n_partitions)],
+        timeout=timeout_sec,
+    )
+    candles = []
+    for start in starts:
+        _, end_offset = consumer.get_watermark_offsets(
+            TopicPartition(topic.name, start.partition), timeout=timeout_sec
+        )
+        if start.offset < 0 or start.offset >= end_offset:
+            continue
+
+        consumer.assign([start])
+        while True:
+            message = consumer.poll(timeout=timeout_sec)
+            if message is None:
+                raise TimeoutError(f'Timed out reading {topic.name}[{start.partition}]')
+            if message.error():
+                raise RuntimeError(message.error())
+            candles.append(topic.deserialize(message).value)
+            if message.offset() >= end_offset - 1:
+                break
+        consumer.unassign()
+    consumer.close()
+
+    return pd.DataFrame(candles, columns=CANDLE_COLUMNS)
+
+
+def final_candles(candles: pd.DataFrame, candle_seconds: int) -> pd.DataFrame:
+    """
+    Keeps the last candle of each pair and window that the streaming engine would
+    not drop as late, sorted by pair and window.
+    """
+    candles = candles[candles['candle_seconds'] == candle_seconds]
+
+    # the engine drops the candles of an earlier window than the latest one of the
+    # pair
+    latest_ms = candles.groupby('pair', sort=False)['window_start_ms'].cummax()
+    candles = candles[candles['window_start_ms'] >= latest_ms]
+
+    candles = candles.drop_duplicates(['pair', 'window_start_ms'], keep='last')
+    return candles.sort_values(['pair', 'window_start_ms'], kind='stable').reset_index(
+        drop=True
+    )
+
+
+def compute_indicators(
+    candles: pd.DataFrame, indicators: list[Indicator]
+) -> pd.DataFrame:
+    """
+    Computes the indicators of the final candles of every pair, see
+    `final_candles`, one TA-Lib call per pair and indicator.
+    """
+    columns = {
+        name: candles[name].to_numpy(dtype=np.float64)
+        for name in ('open', 'high', 'low', 'close', 'volume')
+    }
+    values = {name: np.full(len(candles), np.nan) for name in outputs(indicators)}
+
+    # candles are sorted by pair
+    pairs = candles['pair'].to_numpy()
+    bounds = [0, *(np.flatnonzero(pairs[1:] != pairs[:-1]) + 1)] if len(pairs) else []
+    bounds.append(len(candles))
+    for start, end in zip(bounds[:-1], bounds[1:], strict=True):
+        pair_columns = {name: column[start:end] for name, column in columns.items()}
+        for indicator in indicators:
+            for name, pair_values in zip(
+                indicator.outputs,
+                indicator.compute(talib, pair_columns),
+                strict=True,
+            ):
+                # outputs that were not selected are None
+                if name is not None:
+                    values[name][start:end] = pair_values
+
+    return pd.concat([candles, pd.DataFrame(values)], axis=1)
+
+
+def write_indicators(indicators: pd.DataFrame, path: str):
+    """
+    Writes the technical indicators to a Parquet, CSV or JSON lines file.
+    """
+    if path.endswith('.parquet'):
+        indicators.to_parquet(path, index=False)
+    elif path.endswith('.csv'):
+        indicators.to_csv(path, index=False)
+    elif path.endswith(('.jsonl', '.json')):
+        # the JSON serializer of the topics, NaN is written as null
+        with open(path, 'wb') as f:
+            for message in indicators.to_dict('records'):
+                f.write(dumps(message) + b'\n')
+    else:
+        raise ValueError(f'Unknown technical indicators file format: {path}')
+
+
+def produce_indicators(
+    indicators: pd.DataFrame,
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_output_topic_partitions: Optional[int] = None,
+    kafka_output_value_format: str = 'json',
+):
+    """
+    Produces the technical indicators to the output topic like the streaming service
+    does: keyed by pair, with the window start as message timestamp.
+    """
+    app = Application(broker_address=kafka_broker_address)
+
+    candles_topic = app.topic(kafka_input_topic)
+    technical_indicators_topic = app.topic(
+        kafka_output_topic,
+        value_serializer=value_serializer(
+            kafka_output_value_format, 'technical_indicators'
+        ),
+        config=TopicConfig(
+            num_partitions=kafka_output_topic_partitions
+            or candles_topic.broker_config.num_partitions,
+            replication_factor=candles_topic.broker_config.replication_factor,
+        ),
+    )
+
+    with app.get_producer() as producer:
+        for message in indicators.to_dict('records'):
+            serialized = technical_indicators_topic.serialize(
+                key=message['pair'],
+                value=message,
+                timestamp_ms=message['window_start_ms'],
+            )
+            producer.produce(
+                topic=technical_indicators_topic.name,
+                value=serialized.value,
+                key=serialized.key,
+                timestamp=serialized.timestamp,
+            )
+
+
+def run(
+    # kafka parameters
+    kafka_broker_address: str,
+    kafka_input_topic: str,
+    kafka_output_topic: str,
+    kafka_consumer_group: str,
+    # candles parameters
+    candle_seconds: int,
+    # indicators parameters
+    indicators: Optional[list[str]] = None,
+    # offline parameters
+    candles_path: Optional[str] = None,
+    last_n_days: int = 60,
+    output_path: Optional[str] = None,
+    kafka_output_topic_partitions: Optional[int] = None,
+    kafka_input_value_format: str = 'json',
+    kafka_output_value_format: str = 'json',
+):
+    """
+    Computes the technical indicators of historical candles in one batch.
+
+    Args:
+        kafka_broker_address (str): Kafka broker address
+        kafka_input_topic (str): Kafka candles topic, read if there is no
+            `candles_path`
+        kafka_output_topic (str): Kafka technical indicators topic
+        kafka_consumer_group (str): Kafka consumer group name, the candles topic
+            is read in its own group, that never commits offsets
+        candle_seconds (int): Candle duration in seconds
+        indicators (Optional[list[str]]): Names of the indicator outputs to
+            compute, see `registry.select`. Defaults to all the indicators of
+            `trades.codec.INDICATOR_NAMES`
+        candles_path (Optional[str]): Parquet, CSV or JSON lines file of candles
+        last_n_days (int): Days of candles to read from the candles topic
+        output_path (Optional[str]): File to write the technical indicators to. If
+            not set, they are produced to `kafka_output_topic`
+        kafka_output_topic_partitions (Optional[int]): Number of partitions of the
+            output topic, if it has to be created
+        kafka_input_value_format (str): 'json', or 'binary' for the compact format
+            of `trades.codec`
+        kafka_output_value_format (str): 'json', or 'binary' for the compact format
+            of `trades.codec`
+
+    Returns:
+        None
+    """
+    selected = select(indicators or list(INDICATOR_NAMES))
+
+    start = time.perf_counter()
+    if candles_path is not None:
+        candles = load_candles(candles_path)
+    else:
+        candles = load_topic_candles(
+            kafka_broker_address,
+            kafka_input_topic,
+            kafka_consumer_group,
+            start_ms=int(time.time() * 1000) - last_n_days * MS_PER_DAY,
+            kafka_input_value_format=kafka_input_value_format,
+        )
+    logger.info(f'Loaded {len(candles)} candles in {time.perf_counter() - start:.1f}s')
+
+    start = time.perf_counter()
+    candles = final_candles(candles, candle_seconds)
+    technical_indicators = compute_indicators(candles, selected)
+    logger.info(
+        f'Computed {outputs(selected)} for {len(candles)} candles in '
+        f'{time.perf_counter() - start:.1f}s'
+    )
+
+    start = time.perf_counter()
+    if output_path is not None:
+        write_indicators(technical_indicators, output_path)
+        destination = output_path
+    else:
+        produce_indicators(
+            technical_indicators,
+            kafka_broker_address=kafka_broker_address,
+            kafka_input_topic=kafka_input_topic,
+            kafka_output_topic=kafka_output_topic,
+            kafka_output_topic_partitions=kafka_output_topic_partitions,
+            kafka_output_value_format=kafka_output_value_format,
+        )
+        destination = f'topic {kafka_output_topic}'
+    logger.info(
+        f'Wrote {len(technical_indicators)} technical indicators to {destination} in '
+        f'{time.perf_counter() - start:.1f}s'
+    )
+
+
+if __name__ == '__main__':
+    from config import config
+
+    run(
+        kafka_broker_address=config.kafka_broker_address,
+        kafka_input_topic=config.kafka_input_topic,
+        kafka_output_topic=config.kafka_output_topic,
+        kafka_consumer_group=config.kafka_consumer_group,
+        candle_seconds=config.candle_seconds,
+        indicators=config.indicators,
+        candles_path=config.offline_candles_path,
+        last_n_days=config.offline_last_n_days,
+        output_path=config.offline_output_path,
+        kafka_output_topic_partitions=config.kafka_output_topic_partitions,
+        kafka_input_value_format=config.kafka_input_value_format,
+        kafka_output_value_format=config.kafka_output_value_format,
+    )
@@ -1,3 +1,6 @@
+-- Reads the technical indicators topic as JSON: the service that produces to it
+-- must keep KAFKA_OUTPUT_VALUE_FORMAT=json (the default), RisingWave cannot decode
+-- the binary format of trades.codec.
 CREATE TABLE technical_indicators (
 	pair VARCHAR,
 	open FLOAT,
@@ -0,0 +1,194 @@
+"""
+Registry of the technical indicators the service knows how to compute.
+
+An indicator is selected by the names of its outputs, with its parameters in the
+name, e.g. `sma_7`, `rsi_14` or `macdsignal_12_26_9`, so the list of features of a
+model is also the list of indicators to compute:
+
+    indicators = select(['close', 'sma_7', 'rsi_14', 'macd_7', 'macdhist_7'])
+
+gives SMA 7, RSI 14 and one MACD 7/14/9 with its `macd_7` and `macdhist_7`
+outputs. Names that are not indicators, like the candle columns, are ignored.
+Parameters left out of the name take their default, e.g. `macd_7` is MACD with a
+slow period of 14 and a signal period of 9.
+
+Each entry of `REGISTRY` has the incremental implementation of the indicator, the
+TA-Lib function and its keyword arguments, and the candle columns it takes. The
+lookback (the number of candles before the first value) comes from the
+parameters, so `required_candles` sizes the state for the selected indicators.
+
+To add an indicator, implement it in `incremental.py` like TA-Lib does, and add
+it here. To output it in the binary format, also append its names to
+`trades.codec.INDICATOR_NAMES`.
+"""
+
+from typing import Callable, Mapping, Optional
+
+from incremental import EMA, MACD, OBV, RSI, SMA
+
+
+class IndicatorType:
+    """
+    An entry of the registry.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        incremental: Callable,
+        talib_function: str,
+        inputs: tuple[str, ...],
+        params: tuple[str, ...],
+        outputs: Optional[tuple[str, ...]] = None,
+        defaults: Optional[Callable[..., tuple[int, ...]]] = None,
+    ):
+        """
+        Args:
+            name (str): Name of the indicator, the prefix of its output names
+            incremental (Callable): Class of `incremental.py`, built with the
+                parameters
+            talib_function (str): Name of the function in `talib` and
+                `talib.stream`
+            inputs (tuple[str, ...]): Candle columns the TA-Lib function takes
+            params (tuple[str, ...]): Keyword arguments of the TA-Lib function, in
+                the order of the parameters in the names
+            outputs (Optional[tuple[str, ...]]): Prefixes of the output names, in
+                the order of the TA-Lib outputs. Defaults to `name`
+            defaults (Optional[Callable[..., tuple[int, ...]]]): Takes the
+                parameters given in the name, returns all the parameters
+        """
+        self.name = name
+        self.incremental = incremental
+        self.talib_function = talib_function
+        self.inputs = inputs
+        self.params = params
+        self.outputs = outputs or (name,)
+        self.defaults = defaults
+
+
+class Indicator:
+    """
+    An indicator with its parameters, e.g. RSI 14, and the outputs selected.
+    """
+
+    def __init__(
+        self,
+        indicator_type: IndicatorType,
+        params: tuple[int, ...],
+    ):
+        self.type = indicator_type
+        self.params = params
+        # names of the outputs, None for the outputs that are not selected
+        self.outputs: tuple[Optional[str], ...] = (None,) * len(indicator_type.outputs)
+        # key of its state, with all the parameters
+        self.key = '_'.join((indicator_type.name, *map(str, params)))
+        self.lookback = self.incremental().lookback
+
+    def select(self, name: str):
+        outputs = list(self.outputs)
+        outputs[self.type.outputs.index(name.split('_')[0])] = name
+        self.outputs = tuple(outputs)
+
+    def incremental(self):
+        """
+        Returns the incremental implementation, see `incremental.py`.
+        """
+        return self.type.incremental(*self.params)
+
+    def compute(self, functions, columns: Mapping) -> tuple:
+        """
+        Computes the indicator with a TA-Lib module.
+
+        Args:
+            functions: `talib` for the values of every candle, `talib.stream` for
+                the value of the last one
+            columns (Mapping): Candle columns as float64 arrays, oldest first
+
+        Returns:
+            tuple: One value or array per output, selected or not
+        """
+        function = getattr(functions, self.type.talib_function)
+        values = function(
+            *(columns[name] for name in self.type.inputs),
+            **dict(zip(self.type.params, self.params, strict=True)),
+        )
+        return values if len(self.type.outputs) > 1 else (values,)
+
+
+REGISTRY: dict[str, IndicatorType] = {
+    indicator_type.name: indicator_type
+    for indicator_type in (
+        IndicatorType('sma', SMA, 'SMA', ('close',), ('timeperiod',)),
+        IndicatorType('ema', EMA, 'EMA', ('close',), ('timeperiod',)),
+        IndicatorType('rsi', RSI, 'RSI', ('close',), ('timeperiod',)),
+        IndicatorType(
+            'macd',
+            MACD,
+            'MACD',
+            ('close',),
+            ('fastperiod', 'slowperiod', 'signalperiod'),
+            outputs=('macd', 'macdsignal', 'macdhist'),
+            # macd_7 is MACD 7/14/9
+            defaults=lambda fast, slow=None, signal=9: (fast, slow or 2 * fast, signal),
+        ),
+        IndicatorType('obv', OBV, 'OBV', ('close', 'volume'), ()),
+    )
+}
+
+# output prefix -> indicator type
+_OUTPUTS = {
+    output: indicator_type
+    for indicator_type in REGISTRY.values()
+    for output in indicator_type.outputs
+}
+
+
+def select(names: list[str]) -> list[Indicator]:
+    """
+    Returns the indicators that compute the outputs in `names`, in the order of
+    their first output in `names`. Names that are not indicator outputs, like
+    the candle columns, are ignored.
+
+    Raises:
+        ValueError: If a name is a known indicator with wrong parameters
+    """
+    # key -> indicator, `macd_7` and `macdsignal_7_14_9` are the same MACD
+    indicators: dict[str, Indicator] = {}
+    for name in names:
+        prefix, _, suffix = name.partition('_')
+        indicator_type = _OUTPUTS.get(prefix)
+        if indicator_type is None:
+            continue
+
+        try:
+            params = tuple(int(param) for param in suffix.split('_')) if suffix else ()
+            if indicator_type.defaults is not None:
+                params = indicator_type.defaults(*params)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'Invalid indicator {name}: {e}') from e
+        if len(params) != len(indicator_type.params) or any(p < 1 for p in params):
+            raise ValueError(
+                f'Invalid indicator {name}, expected the parameters '
+                f'{indicator_type.params} in the name'
+            )
+
+        indicator = Indicator(indicator_type, params)
+        indicator = indicators.setdefault(indicator.key, indicator)
+        indicator.select(name)
+
+    return list(indicators.values())
+
+
+def outputs(indicators: list[Indicator]) -> list[str]:
+    """
+    Names of the selected outputs of the indicators.
+    """
+    return [name for indicator in indicators for name in indicator.outputs if name]
+
+
+def required_candles(indicators: list[Indicator]) -> int:
+    """
+    Number of candles the indicators need to all have a value, e.g. 60 for SMA 60
+    and 61 for RSI 60.
+    """
+    return max((indicator.lookback for indicator in indicators), default=0) + 1
@@ -0,0 +1,294 @@
+"""
+Seeds the state of a pair from its past candles, when the service has no state for
+it: on the first deploy, with a new consumer group, or after the state was reset.
+
+Without it, the indicators with long periods (e.g. `sma_60`) are NaN until the
+service has seen enough candles of the pair, an hour of 1-minute candles.
+
+The state of a pair is seeded when its first candle is processed, before that
+candle, so the candles of the pair are processed in order, and the other pairs are
+not delayed until they need it. The past candles come from:
+- the candles topic: the messages of the partition of the pair, from the first one
+  at the start of the history up to the message being processed, read once per
+  partition for all its pairs,
+- or the RisingWave table of the technical indicators, that has the candles the
+  service produced before.
+"""
+
+import time
+from typing import Optional, Protocol
+
+from confluent_kafka import TopicPartition
+from loguru import logger
+from quixstreams import message_context
+from quixstreams.kafka import Consumer
+from quixstreams.models import Topic
+
+
+class CandleHistory(Protocol):
+    def fetch(self, pair: str, start_ms: int, end_ms: int) -> list[dict]:
+        """
+        Returns the candles of the pair with `start_ms <= window_start_ms < end_ms`,
+        oldest first.
+        """
+        ...
+
+
+class CandlesTopicHistory:
+    """
+    Past candles of a pair from the candles topic.
+
+    Candles are keyed by pair, so the candles of a pair are in the partition of the
+    message being processed, before its offset.
+
+    Each partition is read once: the first fetch reads it from the start of the
+    history, the next ones only from where the previous read stopped, and the
+    candles of the pairs not seeded yet are kept for their fetch. Each read stops
+    after `timeout_sec`, with the candles it got.
+    """
+
+    def __init__(
+        self,
+        topic: Topic,
+        kafka_broker_address: str,
+        kafka_consumer_group: str,
+        candle_seconds: int,
+        timeout_sec: float = 10.0,
+    ):
+        """
+        Args:
+            topic (Topic): The candles topic, with the deserializer of its format
+            kafka_broker_address (str): Kafka broker address
+            kafka_consumer_group (str): Consumer group of the service. The history
+                is read in its own group, that never commits offsets
+            candle_seconds (int): Duration of the candles
+            timeout_sec (float): Max time spent reading a partition per fetch
+        """
+        self.topic = topic
+        self.candle_seconds = candle_seconds
+        self.timeout_sec = timeout_sec
+        # reads the partitions it is assigned, it does not subscribe
+        self._consumer = Consumer(
+            broker_address=kafka_broker_address,
+            consumer_group=f'{kafka_consumer_group}-warm-start',
+            auto_offset_reset='earliest',
+            auto_commit_enable=False,
+        )
+        # partition -> offset where the next read starts
+        self._read_offsets: dict[int, int] = {}
+        # partition -> pair -> candles read and not fetched yet, oldest first
+        self._candles: dict[int, dict[str, list[dict]]] = {}
+        # partition -> pairs already fetched, their candles are not kept
+        self._fetched: dict[int, set[str]] = {}
+
+    def _read(self, partition: int, start_ms: int, end_offset: int):
+        """
+        Reads the candles of the partition up to `end_offset` (excluded), from the
+        first message at or after `start_ms` if it was never read.
+        """
+        start_offset = self._read_offsets.get(partition)
+        if start_offset is None:
+            # first message at or after `start_ms`. The candles of the windows that
+            # start at `start_ms` or later have a later timestamp
+            start_offset = self._consumer.offsets_for_times(
+                [TopicPartition(self.topic.name, partition, start_ms)],
+                timeout=self.timeout_sec,
+            )[0].offset
+            if start_offset < 0:
+                # no message at or after `start_ms` yet
+                start_offset = end_offset
+        if start_offset >= end_offset:
+            self._read_offsets[partition] = max(start_offset, end_offset)
+            return
+
+        candles = self._candles.setdefault(partition, {})
+        fetched = self._fetched.setdefault(partition, set())
+        deadline = time.monotonic() + self.timeout_sec
+        self._consumer.assign(
+            [TopicPartition(self.topic.name, partition, start_offset)]
+        )
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                message = self._consumer.poll(timeout=max(remaining, 0))
+                if message is None:
+                    logger.warning(
+                        f'Timed out reading the history of '
+                        f'{self.topic.name}[{partition}] at offset {start_offset}'
+                    )
+                    break
+                if message.error():
+                    logger.warning(
+                        f'Error reading the history of '
+                        f'{self.topic.name}[{partition}]: {message.error()}'
+                    )
+                    break
+                if message.offset() >= end_offset:
+                    break
+
+                start_offset = message.offset() + 1
+                candle = self.topic.deserialize(message).value
+                if (
+                    candle['candle_seconds'] == self.candle_seconds
+                    and candle['pair'] not in fetched
+                ):
+                    # intermediate updates of a window replace each other in the
+                    # state, like when they were processed
+                    candles.setdefault(candle['pair'], []).append(candle)
+
+                if start_offset >= end_offset:
+                    break
+        finally:
+            self._consumer.unassign()
+
+        # what was not read is not read again, those candles are missing
+        self._read_offsets[partition] = end_offset
+
+        # the pairs seeded later have a later history
+        for pair, pair_candles in candles.items():
+            candles[pair] = [
+                c for c in pair_candles if c['window_start_ms'] >= start_ms
+            ]
+
+    def fetch(self, pair: str, start_ms: int, end_ms: int) -> list[dict]:
+        context = message_context()
+        self._read(context.partition, start_ms, context.offset)
+
+        self._fetched.setdefault(context.partition, set()).add(pair)
+        candles = self._candles.get(context.partition, {}).pop(pair, [])
+        return [
+            candle
+            for candle in candles
+            if start_ms <= candle['window_start_ms'] < end_ms
+        ]
+
+
+class RisingWaveHistory:
+    """
+    Past candles of a pair from the RisingWave table of the technical indicators.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        user: str,
+        password: str,
+        database: str,
+        table: str,
+        candle_seconds: int,
+    ):
+        # optional dependency, only needed for this source
+        from risingwave import RisingWave, RisingWaveConnOptions
+
+        self.table = table
+        self.candle_seconds = candle_seconds
+        self._rw = RisingWave(
+            RisingWaveConnOptions.from_connection_info(
+                host=host, port=port, user=user, password=password, database=database
+            )
+        )
+
+    def fetch(self, pair: str, start_ms: int, end_ms: int) -> list[dict]:
+        from risingwave import OutputFormat
+
+        # the values are bound parameters, only the table name comes from the config
+        query = f"""
+        select
+            pair, open, high, low, close, volume,
+            window_start_ms, window_end_ms, candle_seconds
+        from
+            {self.table}
+        where
+            pair = :pair
+            and candle_seconds = :candle_seconds
+            and window_start_ms >= :start_ms
+            and window_start_ms < :end_ms
+        order by
+            window_start_ms;
+        """
+        params = {
+            'pair': pair,
+            'candle_seconds': self.candle_seconds,
+            'start_ms': start_ms,
+            'end_ms': end_ms,
+        }
+        data = self._rw.fetch(query, OutputFormat.DATAFRAME, params)
+        return data.to_dict('records')
+
+
+class WarmStart:
+    """
+    Past candles to seed the state of a pair with, before its first candle.
+    """
+
+    def __init__(self, history: CandleHistory, candle_seconds: int, n_candles: int):
+        """
+        Args:
+            history (CandleHistory): Where the past candles come from
+            candle_seconds (int): Duration of the candles
+            n_candles (int): Number of windows before the first candle to seed the
+                state with
+        """
+        self.history = history
+        self.window_ms = candle_seconds * 1000
+        self.n_candles = n_candles
+
+    def candles(self, candle: dict) -> list[dict]:
+        """
+        Returns the candles of the `n_candles` windows before the window of
+        `candle`, oldest first. Nothing if they cannot be read, the state then
+        starts from `candle`.
+        """
+        end_ms = candle['window_start_ms']
+        start_ms = end_ms - self.n_candles * self.window_ms
+        try:
+            candles = self.history.fetch(candle['pair'], start_ms, end_ms)
+        except Exception as e:
+            logger.error(f'Failed to read the history of {candle["pair"]}: {e}')
+            return []
+
+        logger.info(
+            f'Seeding the state of {candle["pair"]} with {len(candles)} past candles'
+        )
+        return candles
+
+
+def warm_start_from_config(
+    source: Optional[str],
+    candles_topic: Topic,
+    kafka_broker_address: str,
+    kafka_consumer_group: str,
+    candle_seconds: int,
+    n_candles: int,
+    risingwave_host: str,
+    risingwave_port: int,
+    risingwave_user: str,
+    risingwave_password: str,
+    risingwave_database: str,
+    risingwave_table: str,
+) -> Optional[WarmStart]:
+    """
+    Returns the warm start for the given `source`, None if it is off.
+    """
+    if source is None:
+        return None
+
+    if source == 'candles_topic':
+        history = CandlesTopicHistory(
+            candles_topic, kafka_broker_address, kafka_consumer_group, candle_seconds
+        )
+    elif source == 'risingwave':
+        history = RisingWaveHistory(
+            host=risingwave_host,
+            port=risingwave_port,
+            user=risingwave_user,
+            password=risingwave_password,
+            database=risingwave_database,
+            table=risingwave_table,
+            candle_seconds=candle_seconds,
+        )
+    else:
+        raise ValueError(f'Unknown warm start source: {source}')
+
+    return WarmStart(history, candle_seconds, n_candles)
@@ -0,0 +1,124 @@
+"""
+Microbenchmark of the binary wire format of `trades.codec` against the JSON
+serializer the topics use by default: bytes per message and µs to encode and
+decode a trade, a candle and a technical indicators message.
+
+Usage:
+    uv run services/trades/benchmarks/codec.py
+"""
+
+import random
+import time
+from typing import Callable
+
+from quixstreams.utils.json import dumps, loads
+from trades import codec
+from trades.trade import Trade
+
+N_MESSAGES = 100_000
+
+
+def generate_trades(n: int) -> list[dict]:
+    rng = random.Random(42)
+    timestamp_sec = time.time() - 86400
+    trades = []
+    for _ in range(n):
+        timestamp_sec += rng.expovariate(10)
+        trades.append(
+            Trade(
+                product_id='BTC/USD',
+                price=round(rng.uniform(90_000, 100_000), 1),
+                quantity=round(rng.expovariate(10), 8),
+                timestamp=round(timestamp_sec, 6),
+            ).to_dict()
+        )
+    return trades
+
+
+def generate_candles(n: int) -> list[dict]:
+    rng = random.Random(42)
+    candles = []
+    for i in range(n):
+        prices = [rng.uniform(90_000, 100_000) for _ in range(4)]
+        candles.append(
+            {
+                'pair': 'BTC/USD',
+                'open': prices[0],
+                'high': max(prices),
+                'low': min(prices),
+                'close': prices[3],
+                'volume': rng.expovariate(1),
+                'window_start_ms': 1745494500000 + 60000 * i,
+                'window_end_ms': 1745494560000 + 60000 * i,
+                'candle_seconds': 60,
+            }
+        )
+    return candles
+
+
+def generate_technical_indicators(candles: list[dict]) -> list[dict]:
+    rng = random.Random(42)
+    return [
+        {
+            **candle,
+            **{name: rng.uniform(0, 100_000) for name in codec.INDICATOR_NAMES},
+        }
+        for candle in candles
+    ]
+
+
+def us_per_message(fn: Callable, inputs: list, repeat: int = 3) -> float:
+    """
+    Best time over `repeat` runs to call `fn` on each of `inputs`, in µs per call
+    """
+    best_sec = min(_time(fn, inputs) for _ in range(repeat))
+    return 1e6 * best_sec / len(inputs)
+
+
+def _time(fn: Callable, inputs: list) -> float:
+    start = time.perf_counter()
+    for x in inputs:
+        fn(x)
+    return time.perf_counter() - start
+
+
+def main():
+    candles = generate_candles(N_MESSAGES)
+    messages = {
+        'trade': generate_trades(N_MESSAGES),
+        'candle': candles,
+        'technical_indicators': generate_technical_indicators(candles),
+    }
+
+    print(f'{N_MESSAGES} messages of each kind')
+    print(
+        f'{"kind":<22}{"format":<8}{"bytes/msg":>10}{"encode µs":>12}{"decode µs":>12}'
+    )
+    for kind, values in messages.items():
+        encoded_json = [dumps(value) for value in values]
+        encoded_binary = [codec.encode(kind, value) for value in values]
+
+        # both formats must give back exactly the same messages
+        assert [codec.decode(data) for data in encoded_binary] == values
+        assert [loads(data) for data in encoded_json] == values
+
+        for value_format, encoded, encode, decode in [
+            ('json', encoded_json, dumps, loads),
+            (
+                'binary',
+                encoded_binary,
+                lambda value, kind=kind: codec.encode(kind, value),
+                codec.decode,
+            ),
+        ]:
+            n_bytes = sum(len(data) for data in encoded) / len(encoded)
+            encode_us = us_per_message(encode, values)
+            decode_us = us_per_message(decode, encoded)
+            print(
+                f'{kind:<22}{value_format:<8}{n_bytes:>10.1f}'
+                f'{encode_us:>12.2f}{decode_us:>12.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
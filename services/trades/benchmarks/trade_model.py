@@ -0,0 +1,155 @@
+"""
+Microbenchmark of the `Trade` model: trades/sec to build a trade from a Kraken
+websocket or REST response and turn it into a dict, compared with the pydantic
+model the service used before.
+
+Usage:
+    uv run services/trades/benchmarks/trade_model.py
+"""
+
+import datetime
+import random
+import time
+from typing import Callable
+
+from pydantic import BaseModel
+from trades.trade import Trade
+
+N_TRADES = 200_000
+
+
+class PydanticTrade(BaseModel):
+    """
+    The previous pydantic implementation of `Trade`, kept here as the baseline.
+    """
+
+    product_id: str
+    price: float
+    quantity: float
+    timestamp: str
+    timestamp_ms: int
+
+    def to_dict(self) -> dict:
+        return self.model_dump()
+
+    @staticmethod
+    def unix_seconds_to_iso_format(timestamp_sec: float) -> str:
+        dt = datetime.datetime.fromtimestamp(timestamp_sec, tz=datetime.timezone.utc)
+        return dt.isoformat().replace('+00:00', 'Z')
+
+    @staticmethod
+    def iso_format_to_unix_seconds(iso_format: str) -> float:
+        return datetime.datetime.fromisoformat(iso_format).timestamp()
+
+    @classmethod
+    def from_kraken_websocket_response(
+        cls, product_id: str, price: float, quantity: float, timestamp: str
+    ) -> 'PydanticTrade':
+        return cls(
+            product_id=product_id,
+            price=price,
+            quantity=quantity,
+            timestamp=timestamp,
+            timestamp_ms=int(cls.iso_format_to_unix_seconds(timestamp) * 1000),
+        )
+
+    @classmethod
+    def from_kraken_rest_api_response(
+        cls, product_id: str, price: float, quantity: float, timestamp_sec: float
+    ) -> 'PydanticTrade':
+        return cls(
+            product_id=product_id,
+            price=price,
+            quantity=quantity,
+            timestamp=cls.unix_seconds_to_iso_format(timestamp_sec),
+            timestamp_ms=int(timestamp_sec * 1000),
+        )
+
+
+def generate_rest_rows(n: int) -> list[list]:
+    """
+    Rows as sent by the Kraken REST API: [price, volume, time, ...]
+    """
+    rng = random.Random(42)
+    timestamp_sec = time.time() - 86400
+    rows = []
+    for _ in range(n):
+        timestamp_sec += rng.expovariate(10)
+        rows.append(
+            [
+                f'{rng.uniform(90_000, 100_000):.1f}',
+                f'{rng.expovariate(10):.8f}',
+                round(timestamp_sec, 6),
+            ]
+        )
+    return rows
+
+
+def generate_websocket_trades(rest_rows: list[list]) -> list[dict]:
+    """
+    Trades as sent by the Kraken websocket API, in the `data` field of a message
+    """
+    return [
+        {
+            'symbol': 'BTC/USD',
+            'price': float(row[0]),
+            'qty': float(row[1]),
+            'timestamp': PydanticTrade.unix_seconds_to_iso_format(row[2]),
+        }
+        for row in rest_rows
+    ]
+
+
+def trades_per_second(fn: Callable[[], list], n: int, repeat: int = 3) -> float:
+    best_sec = min(_time(fn) for _ in range(repeat))
+    return n / best_sec
+
+
+def _time(fn: Callable[[], list]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    rest_rows = generate_rest_rows(N_TRADES)
+    ws_trades = generate_websocket_trades(rest_rows)
+
+    def websocket(model):
+        return lambda: [
+            model.from_kraken_websocket_response(
+                product_id=t['symbol'],
+                price=t['price'],
+                quantity=t['qty'],
+                timestamp=t['timestamp'],
+            ).to_dict()
+            for t in ws_trades
+        ]
+
+    def rest(model):
+        return lambda: [
+            model.from_kraken_rest_api_response(
+                product_id='BTC/USD',
+                price=row[0],
+                quantity=row[1],
+                timestamp_sec=row[2],
+            ).to_dict()
+            for row in rest_rows
+        ]
+
+    # both models must produce exactly the same messages
+    assert websocket(Trade)() == websocket(PydanticTrade)()
+    assert rest(Trade)() == rest(PydanticTrade)()
+
+    print(f'{N_TRADES} trades, build + to_dict()')
+    print(f'{"path":<12}{"pydantic":>16}{"slots":>16}{"speedup":>10}')
+    for path, bench in [('websocket', websocket), ('rest', rest)]:
+        baseline = trades_per_second(bench(PydanticTrade), N_TRADES)
+        fast = trades_per_second(bench(Trade), N_TRADES)
+        print(
+            f'{path:<12}{baseline:>12,.0f} t/s{fast:>12,.0f} t/s{fast / baseline:>9.1f}x'
+        )
+
+
+if __name__ == '__main__':
+    main()
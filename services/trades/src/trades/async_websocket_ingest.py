@@ -0,0 +1,171 @@
+import asyncio
+import random
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+from trades.kraken_websocket_api import KrakenWebsocketAPI
+from trades.trade import Trade
+
+
+class AsyncWebsocketIngest:
+    """
+    Live ingestion from the Kraken websocket API where reading the socket and
+    decoding + producing to Kafka run as separate asyncio tasks, connected by a
+    bounded queue of raw messages.
+
+    - The reader only receives raw messages and puts them in the queue, so a slow
+      Kafka broker never stops us from reading the socket.
+    - If the queue is full, the oldest message is dropped to make room for the new
+      one, so ingest latency stays flat instead of growing without bound.
+    - If the connection drops or goes silent for `recv_timeout_sec`, the reader
+      reconnects with exponential backoff and subscribes again to all the pairs.
+    - Queue depth, dropped messages, late trades and reconnects are logged every
+      `stats_interval_sec` seconds.
+    """
+
+    def __init__(
+        self,
+        product_ids: list[str],
+        queue_max_size: int = 10000,
+        late_trade_threshold_ms: int = 5000,
+        recv_timeout_sec: float = 30.0,
+        max_reconnect_backoff_sec: float = 30.0,
+        stats_interval_sec: float = 10.0,
+        record_path: Optional[str] = None,
+    ):
+        """
+        Args:
+            product_ids (list[str]): The pairs to subscribe to
+            queue_max_size (int): Max number of raw messages waiting to be produced
+            late_trade_threshold_ms (int): Trades produced later than this after they
+                happened are counted as late
+            recv_timeout_sec (float): Reconnect if nothing arrives for this long.
+                Kraken sends a heartbeat every second, so this only fires when the
+                connection is dead.
+            max_reconnect_backoff_sec (float): Upper bound of the reconnect backoff
+            stats_interval_sec (float): How often the ingest counters are logged
+            record_path (Optional[str]): If set, the raw messages are also appended
+                to this file, to be replayed later
+        """
+        self.product_ids = product_ids
+        self.queue_max_size = queue_max_size
+        self.late_trade_threshold_ms = late_trade_threshold_ms
+        self.recv_timeout_sec = recv_timeout_sec
+        self.max_reconnect_backoff_sec = max_reconnect_backoff_sec
+        self.stats_interval_sec = stats_interval_sec
+        self.record_path = record_path
+
+        self.n_dropped = 0
+        self.n_late = 0
+        self.n_reconnects = 0
+
+    def run(self, produce_batch: Callable[[list[Trade]], None]):
+        """
+        Runs the ingestion forever.
+
+        Args:
+            produce_batch (Callable): Serializes and produces a batch of trades. It is
+                called in a worker thread, so it may block without stalling the
+                socket reader.
+        """
+        asyncio.run(self._run(produce_batch))
+
+    async def _run(self, produce_batch: Callable[[list[Trade]], None]):
+        queue: asyncio.Queue[str] = asyncio.Queue(maxsize=self.queue_max_size)
+        await asyncio.gather(
+            self._read(queue),
+            self._produce(queue, produce_batch),
+            self._report(queue),
+        )
+
+    async def _connect(self) -> KrakenWebsocketAPI:
+        """
+        Connects and subscribes to all the pairs, retrying with exponential backoff
+        and jitter until it succeeds.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.to_thread(
+                    KrakenWebsocketAPI,
+                    product_ids=self.product_ids,
+                    timeout_sec=self.recv_timeout_sec,
+                    record_path=self.record_path,
+                )
+            except Exception as e:
+                attempt += 1
+                backoff_sec = min(self.max_reconnect_backoff_sec, 2 ** (attempt - 1))
+                logger.error(
+                    f'Failed to connect to the Kraken websocket API: {e}. '
+                    f'Retrying in up to {backoff_sec}s'
+                )
+                await asyncio.sleep(random.uniform(0, backoff_sec))
+
+    async def _read(self, queue: asyncio.Queue):
+        """
+        Reads raw messages from the socket into the queue, reconnecting whenever
+        the connection breaks.
+        """
+        kraken_api = await self._connect()
+        logger.info(f'Subscribed to trades for {self.product_ids}')
+
+        while True:
+            try:
+                message = await asyncio.to_thread(kraken_api.recv)
+            except Exception as e:
+                logger.warning(f'Websocket connection lost: {e}. Reconnecting')
+                kraken_api.close()
+                self.n_reconnects += 1
+                kraken_api = await self._connect()
+                logger.info(f'Resubscribed to trades for {self.product_ids}')
+                continue
+
+            if queue.full():
+                # drop the oldest message, fresh trades are worth more than old ones
+                queue.get_nowait()
+                self.n_dropped += 1
+            queue.put_nowait(message)
+
+    async def _produce(
+        self,
+        queue: asyncio.Queue,
+        produce_batch: Callable[[list[Trade]], None],
+    ):
+        """
+        Decodes the queued messages into trades and produces them, one batch with
+        all the messages waiting in the queue at a time.
+        """
+        while True:
+            messages = [await queue.get()]
+            while not queue.empty():
+                messages.append(queue.get_nowait())
+
+            trades = [
+                trade
+                for message in messages
+                for trade in KrakenWebsocketAPI.parse_message(message)
+            ]
+
+            if trades:
+                await asyncio.to_thread(produce_batch, trades)
+
+                now_ms = int(time.time() * 1000)
+                self.n_late += sum(
+                    1
+                    for trade in trades
+                    if now_ms - trade.timestamp_ms > self.late_trade_threshold_ms
+                )
+
+    async def _report(self, queue: asyncio.Queue):
+        """
+        Logs the ingest counters every `stats_interval_sec` seconds.
+        """
+        while True:
+            await asyncio.sleep(self.stats_interval_sec)
+            logger.info(
+                f'Websocket ingest: queue depth {queue.qsize()}/{self.queue_max_size}, '
+                f'{self.n_dropped} dropped messages, {self.n_late} late trades, '
+                f'{self.n_reconnects} reconnects'
+            )
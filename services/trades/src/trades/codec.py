@@ -0,0 +1,316 @@
+"""
+Compact binary wire format for the messages of the pipeline: trades, candles and
+technical indicators.
+
+Every message starts with a 2 byte header, the message kind and the schema
+version, followed by a fixed `struct` layout of little-endian numbers and
+length-prefixed UTF-8 strings:
+
+    trade                 header | price quantity timestamp_ms | product_id timestamp
+    candle                header | len(pair) | open high low close volume
+                                   window_start_ms window_end_ms candle_seconds | pair
+    technical_indicators  header | len(pair) | u64 bitmask | <candle numbers> |
+                                   f64 per set bit | pair
+
+Indicator values are identified by their position in `INDICATOR_NAMES`, so that
+tuple is append-only: never reorder or remove names, only add new ones at the end.
+
+Decoded messages are the same dicts the JSON serializer round-trips, including
+missing indicator values (NaN) coming back as None, so services can switch formats
+without changing their processing code.
+"""
+
+import math
+import struct
+from operator import itemgetter
+from typing import Any, Literal
+
+from quixstreams.models import (
+    Deserializer,
+    SerializationContext,
+    SerializationError,
+    Serializer,
+)
+
+MessageKind = Literal['trade', 'candle', 'technical_indicators']
+ValueFormat = Literal['json', 'binary']
+
+KINDS: tuple[MessageKind, ...] = ('trade', 'candle', 'technical_indicators')
+TRADE, CANDLE, TECHNICAL_INDICATORS = 1, 2, 3
+VERSION = 1
+
+# Append-only. The position of a name is its bit in the bitmask of the message.
+INDICATOR_NAMES = (
+    'sma_7',
+    'sma_14',
+    'sma_21',
+    'sma_60',
+    'ema_7',
+    'ema_14',
+    'ema_21',
+    'ema_60',
+    'rsi_7',
+    'rsi_14',
+    'rsi_21',
+    'rsi_60',
+    'macd_7',
+    'macdsignal_7',
+    'macdhist_7',
+    'obv',
+)
+INDICATOR_BITS = {name: 1 << i for i, name in enumerate(INDICATOR_NAMES)}
+assert len(INDICATOR_NAMES) <= 64, 'the indicators bitmask is a u64'
+ALL_INDICATORS = (1 << len(INDICATOR_NAMES)) - 1
+
+# numeric fields of a candle, in wire order
+CANDLE_NUMBERS = (
+    'open',
+    'high',
+    'low',
+    'close',
+    'volume',
+    'window_start_ms',
+    'window_end_ms',
+    'candle_seconds',
+)
+CANDLE_FIELDS = frozenset(('pair', *CANDLE_NUMBERS))
+
+# every field of a technical indicators message with all the indicators, except
+# the pair, in wire order
+ALL_INDICATORS_NUMBERS = CANDLE_NUMBERS + INDICATOR_NAMES
+
+_HEADER = struct.Struct('<BB')
+# header, price, quantity, timestamp_ms, len(product_id), len(timestamp)
+_TRADE = struct.Struct('<BBddqBB')
+# header, len(pair), open, high, low, close, volume, window_start_ms,
+# window_end_ms, candle_seconds
+_CANDLE = struct.Struct('<BBBdddddqqI')
+# header, len(pair), indicators bitmask, candle numbers
+_INDICATORS_HEAD = struct.Struct('<BBBQdddddqqI')
+_INDICATORS_BITMASK = struct.Struct('<Q')
+# the head followed by all the indicators, so the common case is a single unpack
+_ALL_INDICATORS = struct.Struct(f'<BBBQdddddqqI{len(INDICATOR_NAMES)}d')
+
+_get_candle_numbers = itemgetter(*CANDLE_NUMBERS)
+_get_all_indicators = itemgetter(*INDICATOR_NAMES)
+
+
+def encode_trade(trade: dict) -> bytes:
+    if len(trade) != 5:
+        raise ValueError(f'Unexpected trade fields: {sorted(trade)}')
+
+    product_id = trade['product_id'].encode()
+    timestamp = trade['timestamp'].encode()
+    return (
+        _TRADE.pack(
+            TRADE,
+            VERSION,
+            trade['price'],
+            trade['quantity'],
+            trade['timestamp_ms'],
+            len(product_id),
+            len(timestamp),
+        )
+        + product_id
+        + timestamp
+    )
+
+
+def decode_trade(data: bytes) -> dict:
+    _, _, price, quantity, timestamp_ms, n_product_id, n_timestamp = _TRADE.unpack_from(
+        data
+    )
+    offset = _TRADE.size + n_product_id
+    return {
+        'product_id': data[_TRADE.size : offset].decode(),
+        'price': price,
+        'quantity': quantity,
+        'timestamp': data[offset : offset + n_timestamp].decode(),
+        'timestamp_ms': timestamp_ms,
+    }
+
+
+def encode_candle(candle: dict) -> bytes:
+    if len(candle) != len(CANDLE_FIELDS):
+        raise ValueError(f'Unexpected candle fields: {sorted(candle)}')
+
+    pair = candle['pair'].encode()
+    return _CANDLE.pack(CANDLE, VERSION, len(pair), *_get_candle_numbers(candle)) + pair
+
+
+def decode_candle(data: bytes) -> dict:
+    values = _CANDLE.unpack_from(data)
+    candle = dict(zip(CANDLE_NUMBERS, values[3:], strict=True))
+    candle['pair'] = data[_CANDLE.size : _CANDLE.size + values[2]].decode()
+    return candle
+
+
+def encode_technical_indicators(message: dict) -> bytes:
+    pair = message['pair'].encode()
+    candle_numbers = _get_candle_numbers(message)
+
+    if len(message) == len(CANDLE_FIELDS) + len(INDICATOR_NAMES):
+        # fast path, the message has all the indicators we know
+        try:
+            values = _get_all_indicators(message)
+        except KeyError:
+            pass
+        else:
+            if None in values:
+                values = [math.nan if value is None else value for value in values]
+            return (
+                _ALL_INDICATORS.pack(
+                    TECHNICAL_INDICATORS,
+                    VERSION,
+                    len(pair),
+                    ALL_INDICATORS,
+                    *candle_numbers,
+                    *values,
+                )
+                + pair
+            )
+
+    bitmask = 0
+    values = []
+    # indicators are packed in `INDICATOR_NAMES` order, whatever the dict order
+    for name, bit in INDICATOR_BITS.items():
+        if name in message:
+            bitmask |= bit
+            value = message[name]
+            values.append(math.nan if value is None else value)
+
+    if len(values) + len(CANDLE_FIELDS) != len(message):
+        unknown = set(message) - CANDLE_FIELDS - INDICATOR_BITS.keys()
+        raise ValueError(f'Unexpected technical indicators fields: {sorted(unknown)}')
+
+    return (
+        _INDICATORS_HEAD.pack(
+            TECHNICAL_INDICATORS, VERSION, len(pair), bitmask, *candle_numbers
+        )
+        + struct.pack(f'<{len(values)}d', *values)
+        + pair
+    )
+
+
+def decode_technical_indicators(data: bytes) -> dict:
+    (bitmask,) = _INDICATORS_BITMASK.unpack_from(data, 3)
+
+    if bitmask == ALL_INDICATORS:
+        values = _ALL_INDICATORS.unpack_from(data)
+        names = ALL_INDICATORS_NUMBERS
+        offset = _ALL_INDICATORS.size
+    else:
+        names = CANDLE_NUMBERS + tuple(
+            name for name, bit in INDICATOR_BITS.items() if bitmask & bit
+        )
+        values_struct = struct.Struct(
+            f'{_INDICATORS_HEAD.format}{len(names) - len(CANDLE_NUMBERS)}d'
+        )
+        values = values_struct.unpack_from(data)
+        offset = values_struct.size
+
+    n_pair = values[2]
+    values = values[4:]
+
+    # NaN means the indicator has no value yet, as None does in JSON. The sum is
+    # NaN if any value is, so the common case with all values set stays cheap.
+    total = sum(values)
+    if total != total:
+        values = [None if value != value else value for value in values]
+
+    message = dict(zip(names, values, strict=True))
+    message['pair'] = data[offset : offset + n_pair].decode()
+    return message
+
+
+_ENCODERS = {
+    'trade': encode_trade,
+    'candle': encode_candle,
+    'technical_indicators': encode_technical_indicators,
+}
+_DECODERS = {
+    TRADE: decode_trade,
+    CANDLE: decode_candle,
+    TECHNICAL_INDICATORS: decode_technical_indicators,
+}
+
+
+def encode(kind: MessageKind, value: dict) -> bytes:
+    """
+    Encodes a message of the given kind in the binary format.
+
+    Raises:
+        ValueError: If the message does not have exactly the fields of its kind
+        KeyError: If a field of the kind is missing
+    """
+    return _ENCODERS[kind](value)
+
+
+def decode(data: bytes) -> dict:
+    """
+    Decodes a binary message of any kind, the kind is read from its header.
+
+    Raises:
+        ValueError: If the message kind or schema version is not known
+    """
+    kind, version = _HEADER.unpack_from(data)
+    if version > VERSION:
+        raise ValueError(
+            f'Message has schema version {version}, this service knows up to '
+            f'{VERSION}. Upgrade it before its producers.'
+        )
+    try:
+        decoder = _DECODERS[kind]
+    except KeyError:
+        raise ValueError(f'Unknown message kind {kind}') from None
+    return decoder(data)
+
+
+class BinarySerializer(Serializer):
+    """
+    Quix Streams serializer for messages of one `kind` in the binary format.
+    """
+
+    def __init__(self, kind: MessageKind):
+        if kind not in _ENCODERS:
+            raise ValueError(f'kind must be one of {KINDS}')
+        self.kind = kind
+        self._encode = _ENCODERS[kind]
+
+    def __call__(self, value: Any, ctx: SerializationContext) -> bytes:
+        try:
+            return self._encode(value)
+        except (ValueError, KeyError, TypeError, struct.error) as exc:
+            raise SerializationError(f'Failed to encode {self.kind}: {exc!r}') from exc
+
+
+class BinaryDeserializer(Deserializer):
+    """
+    Quix Streams deserializer for messages of any kind in the binary format.
+    """
+
+    def __call__(self, value: bytes, ctx: SerializationContext) -> dict:
+        try:
+            return decode(value)
+        except (ValueError, UnicodeDecodeError, struct.error) as exc:
+            raise SerializationError(f'Failed to decode message: {exc!r}') from exc
+
+
+def value_serializer(
+    value_format: ValueFormat, kind: MessageKind
+) -> str | BinarySerializer:
+    """
+    Returns the `value_serializer` to pass to `app.topic` for `value_format`.
+    """
+    if value_format == 'binary':
+        return BinarySerializer(kind)
+    return 'json'
+
+
+def value_deserializer(value_format: ValueFormat) -> str | BinaryDeserializer:
+    """
+    Returns the `value_deserializer` to pass to `app.topic` for `value_format`.
+    """
+    if value_format == 'binary':
+        return BinaryDeserializer()
+    return 'json'
@@ -1,4 +1,4 @@
-from typing import Literal
+from typing import Literal, Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -16,8 +16,46 @@ class Settings(BaseSettings):
     ]
     kafka_broker_address: str
     kafka_topic_name: str
-    live_or_historical: Literal['live', 'historical'] = 'historical'
+    # trades are keyed by product_id, so up to this many candles replicas can
+    # consume the topic in parallel
+    kafka_topic_partitions: int = 1
+    kafka_topic_replication_factor: int = 1
+    # 'binary' uses the compact format of trades.codec instead of JSON
+    kafka_value_format: Literal['json', 'binary'] = 'json'
+    live_or_historical: Literal['live', 'historical', 'replay'] = 'historical'
+    # 'async' decouples the websocket reader from the Kafka producer with a queue
+    live_ingest_mode: Literal['sync', 'async'] = 'sync'
+    ingest_queue_max_size: int = 10000
+    late_trade_threshold_ms: int = 5000
+    # number of worker processes the live product_ids are sharded across
+    n_live_shards: int = 1
     last_n_days: int = 30
+    # request budget shared by all the pairs during a historical backfill
+    max_requests_per_second: float = 5.0
+    # number of time slices each pair's backfill is split into and paged in parallel
+    n_slices_per_pair: int = 1
+    # local Parquet archive of trades. If set, historical runs read from it first
+    # and only download the missing ranges
+    archive_dir: Optional[str] = None
+    # file the raw live websocket messages are appended to, for later replays
+    record_frames_path: Optional[str] = None
+    # replay of recorded trades, from `archive_dir` or else `replay_frames_path`,
+    # this many times faster than real time (0 means as fast as possible)
+    replay_speed: float = 1.0
+    replay_frames_path: Optional[str] = None
+    # trades seen in the last `dedup_window_ms` (of trade time) are not produced
+    # again. 0 disables the deduplication
+    dedup_window_ms: int = 60000
+    dedup_max_keys_per_pair: int = 100000
+    # file where live runs keep the dedup keys across restarts. Historical runs
+    # keep them in the source state
+    dedup_state_path: Optional[str] = None
+    # producer batching and compression
+    kafka_linger_ms: int = 100
+    kafka_batch_size: int = 1048576
+    kafka_compression_type: Literal['none', 'gzip', 'snappy', 'lz4', 'zstd'] = 'lz4'
+    # how often the throughput counters are logged
+    stats_interval_sec: float = 10.0
 
 
 config = Settings()
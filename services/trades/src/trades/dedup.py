@@ -0,0 +1,187 @@
+import json
+import os
+import time
+from collections import deque
+from itertools import islice
+from typing import Optional
+
+from loguru import logger
+
+from trades.trade import Trade
+
+
+class TradeDeduplicator:
+    """
+    Drops trades we have already produced, e.g. the trades that the REST API sends
+    again at page boundaries, or the websocket sends again after a reconnect.
+
+    For each pair we remember the keys of the trades seen in the last `window_ms`
+    milliseconds (of trade time), in a hash set for O(1) lookups and a ring of
+    (timestamp_ms, key) in arrival order to evict them when they get too old, so
+    memory stays bounded whatever the trade rate. A trade is identified by its
+    Kraken `trade_id`, or by its (timestamp, price, quantity) if it has none.
+
+    If `state_path` is set, the remembered keys are saved there every
+    `persist_interval_sec` seconds and loaded on start, so duplicates are also
+    dropped across restarts.
+    """
+
+    def __init__(
+        self,
+        window_ms: int = 60000,
+        max_keys_per_pair: int = 100000,
+        state_path: Optional[str] = None,
+        persist_interval_sec: float = 10.0,
+        stats_interval_sec: float = 10.0,
+    ):
+        """
+        Args:
+            window_ms (int): How long (in trade time) the key of a trade is kept
+            max_keys_per_pair (int): Upper bound of the keys kept for each pair
+            state_path (Optional[str]): File where the keys are persisted
+            persist_interval_sec (float): How often the keys are saved
+            stats_interval_sec (float): How often the suppressed count is logged
+        """
+        self.window_ms = window_ms
+        self.max_keys_per_pair = max_keys_per_pair
+        self.state_path = state_path
+        self.persist_interval_sec = persist_interval_sec
+        self.stats_interval_sec = stats_interval_sec
+
+        # pair -> (ring of (timestamp_ms, key), set of keys)
+        self._seen: dict[str, tuple[deque, set]] = {}
+        # pair -> number of keys added to its ring, in total and at the last
+        # `snapshot` or `changes`
+        self._n_added: dict[str, int] = {}
+        self._n_added_saved: dict[str, int] = {}
+
+        self.n_suppressed = 0
+        self._last_persist = time.monotonic()
+        self._last_report = time.monotonic()
+        self._n_suppressed_reported = 0
+
+        if state_path is not None and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.restore(json.load(f))
+            logger.info(
+                f'Loaded dedup keys of {len(self._seen)} pairs from {state_path}'
+            )
+
+    @staticmethod
+    def _key(trade: Trade) -> int | tuple:
+        if trade.trade_id is not None:
+            return trade.trade_id
+        return (trade.timestamp, trade.price, trade.quantity)
+
+    def filter(self, trades: list[Trade]) -> list[Trade]:
+        """
+        Returns the trades of `trades` that were not seen before, in the same order.
+        """
+        unique = []
+        for trade in trades:
+            if self._remember(trade.product_id, trade.timestamp_ms, self._key(trade)):
+                unique.append(trade)
+            else:
+                self.n_suppressed += 1
+
+        now = time.monotonic()
+        if self.state_path is not None and (
+            now - self._last_persist >= self.persist_interval_sec
+        ):
+            self.save()
+            self._last_persist = now
+        if now - self._last_report >= self.stats_interval_sec:
+            self.report()
+            self._last_report = now
+
+        return unique
+
+    def _remember(self, pair: str, timestamp_ms: int, key: int | tuple) -> bool:
+        """
+        Adds the key to the keys of the pair.
+
+        Returns:
+            bool: False if the key was already there
+        """
+        ring, keys = self._seen.setdefault(pair, (deque(), set()))
+        if key in keys:
+            return False
+
+        keys.add(key)
+        ring.append((timestamp_ms, key))
+        self._n_added[pair] = self._n_added.get(pair, 0) + 1
+
+        # forget the keys that are too old, or too many
+        oldest_ms = timestamp_ms - self.window_ms
+        while ring[0][0] < oldest_ms or len(ring) > self.max_keys_per_pair:
+            keys.discard(ring.popleft()[1])
+        return True
+
+    def report(self):
+        """
+        Logs how many duplicates were suppressed, if any since the last report.
+        """
+        if self.n_suppressed > self._n_suppressed_reported:
+            logger.info(
+                f'Suppressed {self.n_suppressed - self._n_suppressed_reported} '
+                f'duplicate trades ({self.n_suppressed} in total)'
+            )
+            self._n_suppressed_reported = self.n_suppressed
+
+    def snapshot(self) -> dict[str, list]:
+        """
+        Returns the remembered keys as a JSON-serializable dict, to be passed to
+        `restore`.
+        """
+        self._n_added_saved = dict(self._n_added)
+        return {
+            pair: [[timestamp_ms, key] for timestamp_ms, key in ring]
+            for pair, (ring, _) in self._seen.items()
+        }
+
+    def changes(self) -> dict[str, list]:
+        """
+        Returns the keys remembered since the last `snapshot` or `changes`, as a
+        JSON-serializable dict to be passed to `update`. Unlike a snapshot, its size
+        does not grow with the number of keys remembered.
+        """
+        changes = {}
+        for pair, n_added in self._n_added.items():
+            n = n_added - self._n_added_saved.get(pair, 0)
+            if n:
+                ring, _ = self._seen[pair]
+                # the last n keys of the ring, without the ones evicted since then
+                recent = list(islice(reversed(ring), n))[::-1]
+                changes[pair] = [[timestamp_ms, key] for timestamp_ms, key in recent]
+        self._n_added_saved = dict(self._n_added)
+        return changes
+
+    def restore(self, snapshot: dict[str, list]):
+        """
+        Replaces the remembered keys with the ones of a `snapshot`.
+        """
+        self._seen = {}
+        self._n_added = {}
+        self._n_added_saved = {}
+        self.update(snapshot)
+
+    def update(self, changes: dict[str, list]):
+        """
+        Adds the keys of `changes` (or of a `snapshot`) to the remembered keys.
+        """
+        for pair, entries in changes.items():
+            for timestamp_ms, key in entries:
+                # JSON turns the tuple keys into lists
+                self._remember(
+                    pair, timestamp_ms, tuple(key) if isinstance(key, list) else key
+                )
+        self._n_added_saved = dict(self._n_added)
+
+    def save(self):
+        """
+        Writes the remembered keys to `state_path`, atomically.
+        """
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, self.state_path)
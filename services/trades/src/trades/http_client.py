@@ -0,0 +1,189 @@
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from trades.rate_limiter import RateLimiter
+
+
+class KrakenHTTPClient:
+    """
+    HTTP client shared by all the cursors that talk to the Kraken REST API.
+
+    - Keeps a pool of keep-alive connections, so we pay the TCP+TLS handshake once
+      per connection and not once per page.
+    - Paces the requests with a shared `RateLimiter` that slows down when Kraken
+      rate limits us or responses get slow, and speeds up again when they are fine.
+    - Retries failed requests with exponential backoff and full jitter.
+    - Logs requests/sec and retry counts every `stats_interval_sec` seconds.
+    """
+
+    # Kraken returns HTTP 200 with one of these in the `error` list when we go
+    # over the rate limit of the public endpoints
+    RATE_LIMIT_ERRORS = ('EGeneral:Too many requests', 'EAPI:Rate limit exceeded')
+
+    def __init__(
+        self,
+        max_requests_per_second: float,
+        pool_size: int = 10,
+        max_retries: int = 5,
+        backoff_base_sec: float = 0.5,
+        backoff_max_sec: float = 30.0,
+        timeout_sec: float = 10.0,
+        slow_response_sec: float = 2.0,
+        stats_interval_sec: float = 30.0,
+    ):
+        """
+        Args:
+            max_requests_per_second (float): Upper bound of the request rate
+            pool_size (int): Max number of keep-alive connections to Kraken
+            max_retries (int): Retries before a request is given up
+            backoff_base_sec (float): Backoff before the first retry
+            backoff_max_sec (float): Upper bound of the backoff between retries
+            timeout_sec (float): Connect and read timeout of each request
+            slow_response_sec (float): Responses slower than this slow down the pace
+            stats_interval_sec (float): How often the request stats are logged
+        """
+        self.rate_limiter = RateLimiter(max_requests_per_second)
+        self.max_retries = max_retries
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.timeout_sec = timeout_sec
+        self.slow_response_sec = slow_response_sec
+        self.stats_interval_sec = stats_interval_sec
+
+        self._session = requests.Session()
+        self._session.headers.update({'Accept': 'application/json'})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+
+        # request stats, shared by all the threads using this client
+        self._lock = threading.Lock()
+        self._n_requests = 0
+        self._n_retries = 0
+        self._n_rate_limited = 0
+        self._n_failed = 0
+        self._n_requests_last_report = 0
+        self._last_report = time.monotonic()
+
+    def get(self, url: str, params: dict) -> Optional[dict]:
+        """
+        Sends a GET request and returns the parsed JSON response, retrying on
+        connection errors, 5xx responses and rate limit errors.
+
+        Returns:
+            Optional[dict]: The response as a dictionary, or None if the request
+                failed after `max_retries` retries or Kraken returned an error
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self._count('_n_retries')
+                self._backoff(attempt)
+
+            self.rate_limiter.wait()
+            self._count('_n_requests')
+            start = time.monotonic()
+
+            try:
+                response = self._session.get(
+                    url, params=params, timeout=self.timeout_sec
+                )
+            except requests.exceptions.RequestException as e:
+                logger.warning(f'Request to {url} failed: {e}')
+                continue
+
+            latency_sec = time.monotonic() - start
+
+            if response.status_code == 429:
+                self._on_rate_limited(f'HTTP {response.status_code}')
+                continue
+
+            if response.status_code >= 500:
+                logger.warning(f'Kraken API returned HTTP {response.status_code}')
+                continue
+
+            try:
+                data = response.json()
+            except ValueError as e:
+                logger.warning(f'Failed to parse response as json: {e}')
+                continue
+
+            errors = data.get('error') or []
+            if any(error in self.RATE_LIMIT_ERRORS for error in errors):
+                self._on_rate_limited(', '.join(errors))
+                continue
+
+            if errors:
+                # Errors like an unknown pair won't go away by retrying
+                logger.error(f'Kraken API returned errors: {errors}')
+                self._count('_n_failed')
+                return None
+
+            # adapt the pace to how fast Kraken is answering
+            if latency_sec > self.slow_response_sec:
+                self.rate_limiter.slow_down(factor=1.25)
+            else:
+                self.rate_limiter.speed_up()
+
+            self._maybe_report_stats()
+            return data
+
+        logger.error(f'Giving up on {url} after {self.max_retries} retries')
+        self._count('_n_failed')
+        return None
+
+    def _backoff(self, attempt: int):
+        """
+        Sleeps a random time between 0 and `backoff_base_sec * 2 ** (attempt - 1)`,
+        capped at `backoff_max_sec` (exponential backoff with full jitter).
+        """
+        backoff_sec = min(
+            self.backoff_max_sec, self.backoff_base_sec * 2 ** (attempt - 1)
+        )
+        time.sleep(random.uniform(0, backoff_sec))
+
+    def _on_rate_limited(self, reason: str):
+        self._count('_n_rate_limited')
+        self.rate_limiter.slow_down()
+        logger.warning(
+            f'Rate limited by Kraken ({reason}). Slowing down to '
+            f'{self.rate_limiter.requests_per_second:.2f} requests/sec'
+        )
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self) -> dict:
+        """
+        Returns the request counters since the client was created.
+        """
+        with self._lock:
+            return {
+                'requests': self._n_requests,
+                'retries': self._n_retries,
+                'rate_limited': self._n_rate_limited,
+                'failed': self._n_failed,
+                'allowed_requests_per_second': self.rate_limiter.requests_per_second,
+            }
+
+    def _maybe_report_stats(self):
+        with self._lock:
+            now = time.monotonic()
+            elapsed_sec = now - self._last_report
+            if elapsed_sec < self.stats_interval_sec:
+                return
+
+            requests_per_second = (
+                self._n_requests - self._n_requests_last_report
+            ) / elapsed_sec
+            self._n_requests_last_report = self._n_requests
+            self._last_report = now
+
+        logger.info(
+            f'Kraken REST API: {requests_per_second:.2f} requests/sec, stats: {self.stats()}'
+        )
@@ -1,24 +1,49 @@
-import json
 import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
 
-import requests
 from loguru import logger
 
+from trades.http_client import KrakenHTTPClient
 from trades.trade import Trade
 
+if TYPE_CHECKING:
+    from trades.trade_archive import TradeArchive
+
 
 class KrakenRestAPI:
     URL = 'https://api.kraken.com/0/public/Trades'
 
-    def __init__(self, product_id: str, last_n_days: int):
+    def __init__(
+        self,
+        product_id: str,
+        last_n_days: int,
+        http_client: Optional[KrakenHTTPClient] = None,
+        since_timestamp_ns: Optional[int] = None,
+        until_timestamp_ns: Optional[int] = None,
+    ):
+        """
+        Args:
+            product_id (str): The pair to fetch trades for
+            last_n_days (int): How many days back the backfill starts
+            http_client (Optional[KrakenHTTPClient]): Client shared with other cursors.
+                If None, the cursor creates its own.
+            since_timestamp_ns (Optional[int]): Start of the backfill. Overrides `last_n_days`
+            until_timestamp_ns (Optional[int]): End of the backfill (exclusive). If None,
+                the cursor pages until it reaches the current time.
+        """
         self.product_id = product_id
         self.last_n_days = last_n_days
+        self.http_client = http_client or KrakenHTTPClient(max_requests_per_second=1)
+        self.until_timestamp_ns = until_timestamp_ns
         self._is_done = False
 
-        # get current timestamp in nanoseconds
-        self.since_timestamp_ns = int(
-            time.time_ns() - last_n_days * 24 * 60 * 60 * 1000000000
-        )
+        if since_timestamp_ns is None:
+            # get current timestamp in nanoseconds
+            since_timestamp_ns = int(
+                time.time_ns() - last_n_days * 24 * 60 * 60 * 1000000000
+            )
+        self.since_timestamp_ns = since_timestamp_ns
 
     def get_trades(self) -> list[Trade]:
         """
@@ -28,37 +53,16 @@ class KrakenRestAPI:
         Returns:
             list[Trade]: List of trades for the given product_id and since the given timestamp
         """
-        # Step 1. Set the right headers and parameters for the request
-        headers = {'Accept': 'application/json'}
+        # Step 1. Set the right parameters for the request
         params = {
             'pair': self.product_id,
             'since': self.since_timestamp_ns,
         }
 
-        # Step 2. Send GET request to Kraken API
-        try:
-            # Send a GET request to the Kraken API
-            response = requests.request('GET', self.URL, headers=headers, params=params)
-
-        except requests.exceptions.SSLError as e:
-            # If we get an error, we sleep for 10 seconds and early return the function
-            logger.error(f'The Kraken API is not reachable. Error: {e}')
-
-            # wait 10 seconds and try again
-            # It would be better to make this source stateful and recoverable, so if
-            # the container goes down and gets restarted by Kubernetes, it can resume
-            # from where it left off.
-            # TODO: reimplement this class a stateful Quix Streams data source so we don't
-            # have sleep here.
-            logger.error('Sleeping for 10 seconds and trying again...')
-            time.sleep(10)
-            return []
-
-        # Step 3. Parse the output as a dictionary
-        try:
-            data = json.loads(response.text)
-        except json.JSONDecodeError as e:
-            logger.error(f'Failed to parse response as json: {e}')
+        # Step 2. Send GET request to Kraken API and parse the output as a dictionary.
+        # The client takes care of pacing and retries, and returns None if it gave up.
+        data = self.http_client.get(self.URL, params=params)
+        if data is None:
             return []
 
         try:
@@ -68,13 +72,15 @@ class KrakenRestAPI:
             logger.error(f'Failed to get trades for pair {self.product_id}: {e}')
             return []
 
-        # Step 4. Transform the trades data into a list of Trade objects
+        # Step 3. Transform the trades data into a list of Trade objects
         trades = [
             Trade.from_kraken_rest_api_response(
                 product_id=self.product_id,
                 price=trade[0],
                 quantity=trade[1],
                 timestamp_sec=trade[2],
+                # [price, volume, time, buy/sell, market/limit, misc, trade_id]
+                trade_id=trade[6] if len(trade) > 6 else None,
             )
             for trade in trades
         ]
@@ -83,7 +89,18 @@ class KrakenRestAPI:
         self.since_timestamp_ns = int(float(data['result']['last']))
 
         # check stopping condition
-        if self.since_timestamp_ns > int(time.time_ns() - 1000000000):
+        if self.until_timestamp_ns is not None:
+            # drop the trades that belong to the next time slice
+            trades = [
+                trade
+                for trade in trades
+                if trade.timestamp_ms * 1000000 < self.until_timestamp_ns
+            ]
+            if self.since_timestamp_ns >= self.until_timestamp_ns:
+                # we got all the trades of our time slice, so we can stop
+                self._is_done = True
+
+        elif self.since_timestamp_ns > int(time.time_ns() - 1000000000):
             # we got trades until now, so we can stop
             self._is_done = True
 
@@ -93,3 +110,218 @@ class KrakenRestAPI:
 
     def is_done(self) -> bool:
         return self._is_done
+
+
+class KrakenRestAPIMultiplePairs:
+    """
+    Backfills several pairs at the same time, with one or more `KrakenRestAPI`
+    cursors per pair.
+
+    Each call to `get_trades` fetches the next page of every cursor that is not done
+    yet in parallel, so the wall-clock time of the backfill is driven by the pair
+    with the most pages, not by the sum of all pairs. We never send more than
+    `max_requests_per_second` requests to Kraken.
+
+    With `n_slices_per_pair > 1` the `[now - last_n_days, now)` range of each pair
+    is split into contiguous time slices that are paged independently. Trades of a
+    slice are held back until all the previous slices of the same pair are done, so
+    the trades of each pair still come out in timestamp order.
+    """
+
+    def __init__(
+        self,
+        product_ids: list[str],
+        last_n_days: int,
+        max_requests_per_second: float,
+        n_slices_per_pair: int = 1,
+        checkpoint: Optional[dict[str, list[list[Optional[int]]]]] = None,
+        archive: Optional['TradeArchive'] = None,
+    ):
+        """
+        Args:
+            product_ids (list[str]): The pairs to backfill
+            last_n_days (int): How many days back the backfill starts
+            max_requests_per_second (float): Request budget shared by all the cursors
+            n_slices_per_pair (int): Number of time slices each pair is split into
+            checkpoint (Optional[dict]): Output of `checkpoint()` from a previous run.
+                Pairs found in it resume from their saved cursors instead of
+                starting again from `last_n_days`.
+            archive (Optional[TradeArchive]): If given, trades are read from this
+                local archive and only the missing ranges are fetched from Kraken
+        """
+        if n_slices_per_pair < 1:
+            raise ValueError('n_slices_per_pair must be at least 1')
+
+        self.product_ids = product_ids
+        checkpoint = checkpoint or {}
+
+        # slice boundaries are aligned to whole seconds, so the millisecond
+        # timestamps of the trades never fall on the wrong side of a boundary
+        now_ns = time.time_ns() // 1000000000 * 1000000000
+        start_ns = now_ns - last_n_days * 24 * 60 * 60 * 1000000000
+        slice_ns = (now_ns - start_ns) // n_slices_per_pair
+        boundaries = [start_ns + i * slice_ns for i in range(n_slices_per_pair)]
+        # The last slice has no upper bound and pages until the current time.
+        time_slices = [
+            [since_ns, boundaries[i + 1] if i + 1 < n_slices_per_pair else None]
+            for i, since_ns in enumerate(boundaries)
+        ]
+
+        # one pool of keep-alive connections and one request budget for all cursors
+        self.http_client = KrakenHTTPClient(
+            max_requests_per_second=max_requests_per_second,
+            pool_size=len(product_ids) * len(time_slices),
+        )
+
+        # for each pair, the list of cursors ordered by time slice.
+        self.apis: dict[str, list[KrakenRestAPI]] = {}
+        for product_id in product_ids:
+            if product_id in checkpoint:
+                logger.info(f'Resuming backfill of {product_id} from checkpoint')
+
+            self.apis[product_id] = [
+                self._cursor(
+                    product_id=product_id,
+                    last_n_days=last_n_days,
+                    since_timestamp_ns=since_ns,
+                    until_timestamp_ns=until_ns,
+                    archive=archive,
+                )
+                for since_ns, until_ns in checkpoint.get(product_id, time_slices)
+            ]
+
+        # the start of each cursor's time slice, needed to checkpoint the slices
+        # whose trades are still held back
+        self._since_ns: dict[str, list[int]] = {
+            product_id: [api.since_timestamp_ns for api in apis]
+            for product_id, apis in self.apis.items()
+        }
+
+        # for each pair, the index of the earliest slice whose trades have not all
+        # been returned yet, and the trades fetched for each slice but not returned
+        self._head: dict[str, int] = dict.fromkeys(product_ids, 0)
+        self._pending: dict[str, list[list[Trade]]] = {
+            product_id: [[] for _ in apis] for product_id, apis in self.apis.items()
+        }
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, sum(len(apis) for apis in self.apis.values())),
+            thread_name_prefix='kraken-rest',
+        )
+
+    def _cursor(
+        self,
+        product_id: str,
+        last_n_days: int,
+        since_timestamp_ns: int,
+        until_timestamp_ns: Optional[int],
+        archive: Optional['TradeArchive'],
+    ) -> KrakenRestAPI:
+        """
+        Creates the cursor of one time slice, backed by the archive if there is one.
+        """
+        if archive is None:
+            return KrakenRestAPI(
+                product_id=product_id,
+                last_n_days=last_n_days,
+                http_client=self.http_client,
+                since_timestamp_ns=since_timestamp_ns,
+                until_timestamp_ns=until_timestamp_ns,
+            )
+
+        # imported here so pyarrow is only needed when the archive is used
+        from trades.trade_archive import ArchivedKrakenRestAPI
+
+        return ArchivedKrakenRestAPI(
+            product_id=product_id,
+            last_n_days=last_n_days,
+            archive=archive,
+            http_client=self.http_client,
+            since_timestamp_ns=since_timestamp_ns,
+            until_timestamp_ns=until_timestamp_ns,
+        )
+
+    def get_trades(self) -> list[Trade]:
+        """
+        Fetches the next page of trades for all the cursors that are not done yet.
+
+        Returns:
+            list[Trade]: Trades of all the pairs, grouped by pair and in timestamp
+                order within each pair
+        """
+        cursors = [
+            (product_id, i, api)
+            for product_id, apis in self.apis.items()
+            for i, api in enumerate(apis)
+            if not api.is_done()
+        ]
+
+        # one page per cursor, all of them in flight at the same time
+        pages = self._executor.map(lambda cursor: cursor[2].get_trades(), cursors)
+        for (product_id, i, _), page in zip(cursors, pages, strict=True):
+            self._pending[product_id][i].extend(page)
+
+        trades = []
+        for product_id in self.product_ids:
+            trades.extend(self._pop_ordered_trades(product_id))
+
+        if self.is_done():
+            logger.info(
+                f'Backfill completed for pairs {self.product_ids}. '
+                f'Request stats: {self.http_client.stats()}'
+            )
+            self._executor.shutdown(wait=False)
+
+        return trades
+
+    def _pop_ordered_trades(self, product_id: str) -> list[Trade]:
+        """
+        Returns the trades of `product_id` that can be released without breaking
+        the timestamp order, i.e. those of the earliest unfinished slice and of any
+        slice before it.
+        """
+        apis = self.apis[product_id]
+        pending = self._pending[product_id]
+
+        trades = []
+        while self._head[product_id] < len(apis):
+            head = self._head[product_id]
+            trades.extend(pending[head])
+            pending[head] = []
+
+            if not apis[head].is_done():
+                break
+            self._head[product_id] += 1
+
+        return trades
+
+    def checkpoint(self) -> dict[str, list[list[Optional[int]]]]:
+        """
+        Returns the `[since_ns, until_ns]` bounds of the time slices still left to
+        backfill for each pair, considering only the trades already returned by
+        `get_trades`.
+
+        The earliest unfinished slice resumes from its current cursor. Later slices
+        resume from their start, because the trades fetched for them are still held
+        back and would be lost on a restart.
+        """
+        checkpoint = {}
+        for product_id, apis in self.apis.items():
+            head = self._head[product_id]
+            checkpoint[product_id] = [
+                [
+                    api.since_timestamp_ns
+                    if i == head
+                    else self._since_ns[product_id][i],
+                    api.until_timestamp_ns,
+                ]
+                for i, api in enumerate(apis)
+                if i >= head
+            ]
+        return checkpoint
+
+    def is_done(self) -> bool:
+        return all(
+            self._head[product_id] == len(apis)
+            for product_id, apis in self.apis.items()
+        )
@@ -1,4 +1,5 @@
 import json
+from typing import Optional
 
 from loguru import logger
 from websocket import create_connection
@@ -12,18 +13,50 @@ class KrakenWebsocketAPI:
     def __init__(
         self,
         product_ids: list[str],
+        timeout_sec: Optional[float] = None,
+        record_path: Optional[str] = None,
     ):
+        """
+        Args:
+            product_ids (list[str]): The pairs to subscribe to
+            timeout_sec (Optional[float]): If set, `recv` raises a timeout error when
+                nothing (not even a heartbeat) arrives for this long
+            record_path (Optional[str]): If set, every raw message received is
+                appended to this file, one per line, so it can be replayed later
+                with `ReplayTradesSource`
+        """
         self.product_ids = product_ids
+        self._record_file = open(record_path, 'a') if record_path else None
 
         # create a websocket client
-        self._ws_client = create_connection(self.URL)
+        self._ws_client = create_connection(self.URL, timeout=timeout_sec)
 
         # send initial subscribe message
         self._subscribe(product_ids)
 
     def get_trades(self) -> list[Trade]:
-        data: str = self._ws_client.recv()
+        return self.parse_message(self.recv())
 
+    def recv(self) -> str:
+        """
+        Blocks until the next raw message arrives on the websocket.
+        """
+        message = self._ws_client.recv()
+        if self._record_file is not None:
+            self._record_file.write(message + '\n')
+        return message
+
+    def close(self):
+        self._ws_client.close()
+        if self._record_file is not None:
+            self._record_file.close()
+
+    @staticmethod
+    def parse_message(data: str) -> list[Trade]:
+        """
+        Parses a raw websocket message into a list of trades. Heartbeats and
+        messages without trades give an empty list.
+        """
         if 'heartbeat' in data:
             logger.info('Heartbeat received')
             return []
@@ -62,6 +95,7 @@ class KrakenWebsocketAPI:
                 price=trade['price'],
                 quantity=trade['qty'],
                 timestamp=trade['timestamp'],
+                trade_id=trade.get('trade_id'),
             )
             for trade in trades_data
         ]
@@ -1,12 +1,21 @@
 # Create an Application instance with Kafka configs
+import time
 from typing import Optional
 
 from loguru import logger
 from quixstreams import Application
+from quixstreams.models import TopicConfig
 
-from trades.kraken_rest_api import KrakenRestAPI
+from trades.async_websocket_ingest import AsyncWebsocketIngest
+from trades.codec import value_serializer
+from trades.dedup import TradeDeduplicator
+from trades.kraken_rest_api import KrakenRestAPI, KrakenRestAPIMultiplePairs
 from trades.kraken_websocket_api import KrakenWebsocketAPI
+from trades.metrics import ThroughputMeter
+from trades.replay import ReplayTradesSource
+from trades.sharded_live import ShardSupervisor
 from trades.trade import Trade
+from trades.trades_data_source import HistoricalTradesDataSource
 
 
 def run(
@@ -15,63 +24,266 @@ def run(
     # Old way to say an object if of this type or that type
     # kraken_api: Union[KrakenWebsocketAPI, KrakenRestAPI],
     # New way to say an object if of this type or that type
-    kraken_api: KrakenWebsocketAPI | KrakenRestAPI,
+    kraken_api: KrakenWebsocketAPI
+    | KrakenRestAPI
+    | KrakenRestAPIMultiplePairs
+    | HistoricalTradesDataSource
+    | AsyncWebsocketIngest
+    | ReplayTradesSource,
     kafka_topic_partitions: Optional[int] = 1,
+    kafka_topic_replication_factor: Optional[int] = 1,
+    kafka_value_format: str = 'json',
+    # producer batching parameters
+    kafka_linger_ms: int = 100,
+    kafka_batch_size: int = 1048576,
+    kafka_compression_type: str = 'lz4',
+    stats_interval_sec: float = 10.0,
+    deduplicator: Optional[TradeDeduplicator] = None,
 ):
+    """
+    Fetches trades from the Kraken API and produces them to a Kafka topic.
+
+    Trades come in batches (a websocket message or a REST page), so each batch is
+    serialized in one go and handed to the producer, which groups messages into
+    compressed Kafka batches of up to `kafka_batch_size` bytes, waiting at most
+    `kafka_linger_ms` for a batch to fill. Instead of logging every trade, the
+    throughput and batch latency are logged every `stats_interval_sec` seconds.
+
+    Args:
+        kafka_broker_address (str): Kafka broker address
+        kafka_topic_name (str): Kafka topic to produce the trades to
+        kraken_api: Where the trades come from
+        kafka_topic_partitions (Optional[int]): Number of partitions of the topic.
+            Trades are keyed by `product_id`, so each pair always lands in the same
+            partition and up to this many consumers can share the topic.
+        kafka_topic_replication_factor (Optional[int]): Replication factor used if
+            the topic has to be created
+        kafka_value_format (str): 'json', or 'binary' for the compact format of
+            `trades.codec`
+        kafka_linger_ms (int): Max time the producer waits to fill a batch
+        kafka_batch_size (int): Max size of a producer batch in bytes
+        kafka_compression_type (str): Compression codec of the producer batches
+        stats_interval_sec (float): How often the throughput counters are logged
+        deduplicator (Optional[TradeDeduplicator]): If set, trades that were
+            already produced are dropped before producing. The historical source
+            deduplicates on its own.
+    """
     app = Application(
         broker_address=kafka_broker_address,
+        producer_extra_config={
+            'linger.ms': kafka_linger_ms,
+            'batch.size': kafka_batch_size,
+            'compression.type': kafka_compression_type,
+            # same key -> partition mapping as the Java clients, so a pair keeps its
+            # partition whatever client produces it
+            'partitioner': 'murmur2_random',
+        },
     )
 
-    # Define a topic "my_topic" with JSON serialization
+    # Define a topic "my_topic" with JSON or binary serialization.
+    # The topic is created with this config if it does not exist yet.
     topic = app.topic(
         name=kafka_topic_name,
-        value_serializer='json',
-        # You can use the from quixstreams.models import TopicConfig to configure the topic, if the topic does not exist yet.
-        # config=TopicConfig(replication_factor=1, num_partitions=kafka_topic_partitions)
+        value_serializer=value_serializer(kafka_value_format, 'trade'),
+        config=TopicConfig(
+            num_partitions=kafka_topic_partitions,
+            replication_factor=kafka_topic_replication_factor,
+        ),
     )
+    validate_topic_partitions(topic.name, topic.broker_config, kafka_topic_partitions)
+
+    if isinstance(kraken_api, HistoricalTradesDataSource):
+        # The stateful source produces the trades itself and checkpoints its
+        # progress, so we just run it until the backfill is done.
+        app.add_source(kraken_api, topic=topic)
+        app.run()
+        return
+
+    meter = ThroughputMeter('trades producer', report_interval_sec=stats_interval_sec)
 
     # Create a Producer instance
     with app.get_producer() as producer:
+
+        def produce_batch(events: list[Trade]):
+            start = time.monotonic()
+
+            if deduplicator is not None:
+                events = deduplicator.filter(events)
+
+            # Serialize the whole batch of events using the defined Topic
+            messages = [
+                topic.serialize(key=event.product_id, value=event.to_dict())
+                for event in events
+            ]
+
+            # Produce the messages into the Kafka topic. The producer batches and
+            # compresses them before sending them to the broker.
+            for message in messages:
+                producer.produce(topic=topic.name, value=message.value, key=message.key)
+
+            meter.record(len(messages), time.monotonic() - start)
+
+        if isinstance(kraken_api, AsyncWebsocketIngest):
+            # The websocket is read in its own task, decoupled from the producer
+            kraken_api.run(produce_batch)
+            return
+
         while not kraken_api.is_done():
-            # 1. Fetch the event from the external API
+            # 1. Fetch the events from the external API
             events: list[Trade] = kraken_api.get_trades()
-            # event = {"id": "1", "text": "Lorem ipsum dolor sit amet"}
 
-            for event in events:
-                # 2. Serialize an event using the defined Topic
-                message = topic.serialize(key=event.product_id, value=event.to_dict())
+            # 2. Serialize and produce them
+            if events:
+                produce_batch(events)
 
-                # 3. Produce a message into the Kafka topic
-                producer.produce(topic=topic.name, value=message.value, key=message.key)
 
-                # logger.info(f'Produced message to topic {topic.name}')
-                logger.info(f'Trade {event.to_dict()} pushed to Kafa')
+def validate_topic_partitions(
+    topic_name: str, broker_config: TopicConfig, expected_partitions: int
+):
+    """
+    Checks that an existing topic has the number of partitions we asked for.
 
-            # breakpoint()
+    Kafka does not change the partitions of existing topics for us, and adding
+    partitions moves pairs to other partitions, so we fail loudly instead of
+    silently running with fewer partitions than the consumers expect.
 
+    Raises:
+        ValueError: If the topic has a different number of partitions
+    """
+    if broker_config.num_partitions != expected_partitions:
+        raise ValueError(
+            f'Topic {topic_name} has {broker_config.num_partitions} partitions, '
+            f'but kafka_topic_partitions is {expected_partitions}. '
+            'Recreate the topic or update kafka_topic_partitions.'
+        )
+    logger.info(f'Topic {topic_name} has {expected_partitions} partitions')
 
-if __name__ == '__main__':
-    from trades.config import config
 
-    # create object that can talk to the Kraken API and get us the trade data in real time
-    if config.live_or_historical == 'live':
-        logger.info('Using live data from Kraken API')
-        api = KrakenWebsocketAPI(product_ids=config.product_ids)
+def live_api(product_ids: list[str]) -> KrakenWebsocketAPI | AsyncWebsocketIngest:
+    """
+    Creates the object that reads live trades for `product_ids` from the Kraken
+    websocket API, in the ingest mode set in the config.
+    """
+    from trades.config import config
 
-    elif config.live_or_historical == 'historical':
-        logger.info('Using historical data from Kraken API')
-        api = KrakenRestAPI(
-            product_id=config.product_ids[0],
-            last_n_days=config.last_n_days,
+    if config.live_ingest_mode == 'async':
+        logger.info(f'Using live data from Kraken API for {product_ids}, async ingest')
+        return AsyncWebsocketIngest(
+            product_ids=product_ids,
+            queue_max_size=config.ingest_queue_max_size,
+            late_trade_threshold_ms=config.late_trade_threshold_ms,
+            stats_interval_sec=config.stats_interval_sec,
+            record_path=config.record_frames_path,
         )
-    else:
-        raise ValueError(
-            'Invalid value for live_or_historical. Must be "live" or "historical".'
+
+    logger.info(f'Using live data from Kraken API for {product_ids}')
+    return KrakenWebsocketAPI(
+        product_ids=product_ids, record_path=config.record_frames_path
+    )
+
+
+def run_with_config(
+    kraken_api: KrakenWebsocketAPI
+    | KrakenRestAPIMultiplePairs
+    | HistoricalTradesDataSource
+    | AsyncWebsocketIngest
+    | ReplayTradesSource,
+    dedup_state_path: Optional[str] = None,
+):
+    """
+    Runs the service for `kraken_api` with the Kafka settings from the config.
+
+    Args:
+        kraken_api: Where the trades come from
+        dedup_state_path (Optional[str]): File where the deduplicator keeps its
+            keys across restarts. Defaults to the one in the config.
+    """
+    from trades.config import config
+
+    deduplicator = None
+    if config.dedup_window_ms > 0:
+        deduplicator = TradeDeduplicator(
+            window_ms=config.dedup_window_ms,
+            max_keys_per_pair=config.dedup_max_keys_per_pair,
+            state_path=dedup_state_path or config.dedup_state_path,
+            stats_interval_sec=config.stats_interval_sec,
         )
 
     run(
         kafka_broker_address=config.kafka_broker_address,
         kafka_topic_name=config.kafka_topic_name,
-        kraken_api=api,
-        # kafka_topic_partitions=len(config.kafka_topic_partitions),
+        kraken_api=kraken_api,
+        kafka_topic_partitions=config.kafka_topic_partitions,
+        kafka_topic_replication_factor=config.kafka_topic_replication_factor,
+        kafka_value_format=config.kafka_value_format,
+        kafka_linger_ms=config.kafka_linger_ms,
+        kafka_batch_size=config.kafka_batch_size,
+        kafka_compression_type=config.kafka_compression_type,
+        stats_interval_sec=config.stats_interval_sec,
+        deduplicator=deduplicator,
     )
+
+
+def run_live_shard(product_ids: list[str]):
+    """
+    Runs the live ingestion for one shard of the pairs, with its own websocket
+    connection and Kafka producer. Each shard runs in its own worker process.
+    """
+    from trades.config import config
+
+    # each shard remembers the trades of its own pairs
+    dedup_state_path = None
+    if config.dedup_state_path is not None:
+        shard_name = '-'.join(product_ids).replace('/', '')
+        dedup_state_path = f'{config.dedup_state_path}.{shard_name}'
+
+    run_with_config(live_api(product_ids), dedup_state_path=dedup_state_path)
+
+
+if __name__ == '__main__':
+    from trades.config import config
+
+    if config.live_or_historical == 'live' and config.n_live_shards > 1:
+        # one worker process per shard of the pairs, each running `run_live_shard`,
+        # supervised until the service is stopped
+        logger.info(f'Using live data from Kraken API in {config.n_live_shards} shards')
+        ShardSupervisor(
+            product_ids=config.product_ids,
+            n_shards=config.n_live_shards,
+            target=run_live_shard,
+        ).run()
+
+    else:
+        # create object that can talk to the Kraken API and get us the trade data in real time
+        if config.live_or_historical == 'live':
+            api = live_api(config.product_ids)
+
+        elif config.live_or_historical == 'historical':
+            logger.info('Using historical data from Kraken API')
+            api = HistoricalTradesDataSource(
+                product_ids=config.product_ids,
+                last_n_days=config.last_n_days,
+                max_requests_per_second=config.max_requests_per_second,
+                n_slices_per_pair=config.n_slices_per_pair,
+                stats_interval_sec=config.stats_interval_sec,
+                archive_dir=config.archive_dir,
+                dedup_window_ms=config.dedup_window_ms,
+                dedup_max_keys_per_pair=config.dedup_max_keys_per_pair,
+            )
+
+        elif config.live_or_historical == 'replay':
+            logger.info(f'Replaying recorded trades at {config.replay_speed}x')
+            api = ReplayTradesSource(
+                product_ids=config.product_ids,
+                speed=config.replay_speed,
+                archive_dir=config.archive_dir,
+                frames_path=config.replay_frames_path,
+                last_n_days=config.last_n_days,
+            )
+        else:
+            raise ValueError(
+                'Invalid value for live_or_historical. '
+                'Must be "live", "historical" or "replay".'
+            )
+
+        run_with_config(api)
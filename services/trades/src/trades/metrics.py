@@ -0,0 +1,54 @@
+import time
+
+from loguru import logger
+
+
+class ThroughputMeter:
+    """
+    Counts produced messages and batch latencies, and logs a summary every
+    `report_interval_sec` seconds instead of one log line per message.
+    """
+
+    def __init__(self, name: str, report_interval_sec: float = 10.0):
+        self.name = name
+        self.report_interval_sec = report_interval_sec
+
+        self.total_messages = 0
+        self._reset(time.monotonic())
+
+    def _reset(self, now: float):
+        self._interval_start = now
+        self._messages = 0
+        self._batches = 0
+        self._latency_sum_sec = 0.0
+        self._latency_max_sec = 0.0
+
+    def record(self, n_messages: int, latency_sec: float):
+        """
+        Records a batch of `n_messages` that took `latency_sec` to be processed.
+        """
+        self.total_messages += n_messages
+        self._messages += n_messages
+        self._batches += 1
+        self._latency_sum_sec += latency_sec
+        self._latency_max_sec = max(self._latency_max_sec, latency_sec)
+
+        now = time.monotonic()
+        if now - self._interval_start >= self.report_interval_sec:
+            self.report(now)
+
+    def report(self, now: float | None = None):
+        """
+        Logs the throughput and latency since the last report.
+        """
+        now = now or time.monotonic()
+        elapsed_sec = now - self._interval_start
+        if self._batches:
+            logger.info(
+                f'{self.name}: {self._messages / elapsed_sec:,.0f} msg/s, '
+                f'{self._batches} batches, '
+                f'avg batch latency {1000 * self._latency_sum_sec / self._batches:.2f} ms, '
+                f'max batch latency {1000 * self._latency_max_sec:.2f} ms, '
+                f'{self.total_messages:,} messages in total'
+            )
+        self._reset(now)
@@ -0,0 +1,66 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Thread-safe request budget shared by all the REST cursors of a backfill.
+
+    Callers block in `wait()` until the next request slot is free, so the total
+    request rate stays below `max_requests_per_second` no matter how many pairs
+    are being paged at the same time.
+
+    The pace is adaptive: `slow_down()` stretches the interval between requests
+    (e.g. when Kraken says we are sending too many), and `speed_up()` shrinks it
+    back step by step until it reaches `max_requests_per_second` again.
+    """
+
+    def __init__(
+        self,
+        max_requests_per_second: float,
+        max_interval_sec: float = 10.0,
+    ):
+        if max_requests_per_second <= 0:
+            raise ValueError('max_requests_per_second must be positive')
+
+        self.min_interval_sec = 1.0 / max_requests_per_second
+        self.max_interval_sec = max(max_interval_sec, self.min_interval_sec)
+        self.interval_sec = self.min_interval_sec
+        self._next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the caller is allowed to send its next request.
+        """
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval_sec
+
+        # sleep outside the lock so other threads can book their own slots
+        delay = slot - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def slow_down(self, factor: float = 2.0):
+        """
+        Multiplies the interval between requests by `factor`.
+        """
+        with self._lock:
+            self.interval_sec = min(self.interval_sec * factor, self.max_interval_sec)
+
+    def speed_up(self, factor: float = 0.9):
+        """
+        Multiplies the interval between requests by `factor` (< 1), without going
+        over `max_requests_per_second`.
+        """
+        with self._lock:
+            self.interval_sec = max(self.interval_sec * factor, self.min_interval_sec)
+
+    @property
+    def requests_per_second(self) -> float:
+        """
+        The request rate the limiter is currently allowing.
+        """
+        return 1.0 / self.interval_sec
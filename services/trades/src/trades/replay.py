@@ -0,0 +1,150 @@
+import heapq
+import time
+from typing import Iterator, Optional
+
+from loguru import logger
+
+from trades.kraken_websocket_api import KrakenWebsocketAPI
+from trades.trade import Trade
+
+
+class ReplayTradesSource:
+    """
+    Replays recorded trades into the trades topic, to load-test the downstream
+    services with realistic traffic without waiting for the live market.
+
+    Trades are read either from the local trade archive (see `TradeArchive`) or
+    from a file of raw websocket frames recorded by `KrakenWebsocketAPI`, and are
+    produced with their original inter-arrival times divided by `speed`. With
+    `speed=0` they are produced as fast as the producer takes them.
+
+    When the replay is over, the achieved messages/sec is logged next to the rate
+    the recording had, so we can tell if the pipeline kept up.
+    """
+
+    def __init__(
+        self,
+        product_ids: list[str],
+        speed: float = 1.0,
+        archive_dir: Optional[str] = None,
+        frames_path: Optional[str] = None,
+        last_n_days: int = 30,
+        max_batch_size: int = 1000,
+    ):
+        """
+        Args:
+            product_ids (list[str]): The pairs to replay
+            speed (float): How many times faster than real time trades are replayed.
+                0 replays them as fast as possible.
+            archive_dir (Optional[str]): Trade archive to replay the last
+                `last_n_days` from
+            frames_path (Optional[str]): File with one raw websocket frame per line.
+                Used if `archive_dir` is not set.
+            last_n_days (int): How many days of the archive are replayed
+            max_batch_size (int): Max number of trades returned by `get_trades`
+        """
+        if speed < 0:
+            raise ValueError('speed must be 0 (as fast as possible) or positive')
+        if archive_dir is None and frames_path is None:
+            raise ValueError('Either archive_dir or frames_path must be set')
+
+        self.product_ids = product_ids
+        self.speed = speed
+        self.max_batch_size = max_batch_size
+
+        if archive_dir is not None:
+            self._trades = self._read_archive(archive_dir, last_n_days)
+        else:
+            self._trades = self._read_frames(frames_path)
+
+        # the next trade to replay, and the event/wall clocks the replay started at
+        self._next: Optional[Trade] = next(self._trades, None)
+        self._first_event_ms: Optional[int] = None
+        self._last_event_ms: Optional[int] = None
+        self._start_wall = 0.0
+        self._n_trades = 0
+        self._is_done = self._next is None
+
+    def _read_archive(self, archive_dir: str, last_n_days: int) -> Iterator[Trade]:
+        """
+        Yields the archived trades of all the pairs, merged in timestamp order.
+        """
+        # imported here so pyarrow is only needed when the archive is used
+        from trades.trade_archive import TradeArchive
+
+        archive = TradeArchive(archive_dir)
+        end_ms = time.time_ns() // 1000000
+        start_ms = end_ms - last_n_days * 24 * 60 * 60 * 1000
+
+        per_pair = [
+            (trade for page in archive.read(pid, start_ms, end_ms) for trade in page)
+            for pid in self.product_ids
+        ]
+        return heapq.merge(*per_pair, key=lambda trade: trade.timestamp_ms)
+
+    def _read_frames(self, frames_path: str) -> Iterator[Trade]:
+        """
+        Yields the trades of the recorded websocket frames, in recording order.
+        """
+        product_ids = set(self.product_ids)
+        with open(frames_path) as f:
+            for line in f:
+                for trade in KrakenWebsocketAPI.parse_message(line.rstrip('\n')):
+                    if trade.product_id in product_ids:
+                        yield trade
+
+    def get_trades(self) -> list[Trade]:
+        """
+        Waits until the next trade is due, and returns it with all the other trades
+        that are due by then.
+        """
+        if self._is_done:
+            return []
+
+        if self._first_event_ms is None:
+            self._first_event_ms = self._next.timestamp_ms
+            self._start_wall = time.monotonic()
+
+        # wait until the next trade is due
+        if self.speed > 0:
+            delay_sec = self._due_at(self._next) - time.monotonic()
+            if delay_sec > 0:
+                time.sleep(delay_sec)
+
+        # take all the trades that are due now
+        now = time.monotonic()
+        trades = []
+        while self._next is not None and len(trades) < self.max_batch_size:
+            if self.speed > 0 and self._due_at(self._next) > now:
+                break
+            trades.append(self._next)
+            self._next = next(self._trades, None)
+
+        self._n_trades += len(trades)
+        self._last_event_ms = trades[-1].timestamp_ms
+
+        if self._next is None:
+            self._is_done = True
+            self._report()
+
+        return trades
+
+    def _due_at(self, trade: Trade) -> float:
+        """
+        Wall-clock time (`time.monotonic`) at which `trade` has to be produced.
+        """
+        elapsed_event_sec = (trade.timestamp_ms - self._first_event_ms) / 1000
+        return self._start_wall + elapsed_event_sec / self.speed
+
+    def _report(self):
+        elapsed_sec = max(time.monotonic() - self._start_wall, 1e-9)
+        recorded_sec = max((self._last_event_ms - self._first_event_ms) / 1000, 1e-9)
+        logger.info(
+            f'Replay completed: {self._n_trades:,} trades in {elapsed_sec:.1f}s, '
+            f'{self._n_trades / elapsed_sec:,.0f} msg/s achieved '
+            f'({self._n_trades / recorded_sec:,.1f} msg/s in the recording, '
+            f'{recorded_sec / elapsed_sec:,.1f}x real time)'
+        )
+
+    def is_done(self) -> bool:
+        return self._is_done
@@ -0,0 +1,142 @@
+import multiprocessing
+import signal
+import time
+from typing import Callable, Optional
+
+from loguru import logger
+
+
+def shard_product_ids(product_ids: list[str], n_shards: int) -> list[list[str]]:
+    """
+    Splits `product_ids` into at most `n_shards` non-empty groups, round-robin, so
+    the shards get the same number of pairs (give or take one).
+
+    Example:
+        shard_product_ids(['BTC/USD', 'ETH/USD', 'SOL/USD'], 2)
+        -> [['BTC/USD', 'SOL/USD'], ['ETH/USD']]
+    """
+    if n_shards < 1:
+        raise ValueError('n_shards must be at least 1')
+
+    shards = [product_ids[i::n_shards] for i in range(n_shards)]
+    return [shard for shard in shards if shard]
+
+
+class ShardSupervisor:
+    """
+    Runs the live ingestion in one worker process per shard of `product_ids`, each
+    with its own websocket connection and Kafka producer, and restarts the shards
+    that die.
+
+    Restarts use exponential backoff per shard. A shard that stayed up for at least
+    `healthy_after_sec` before dying starts again from the shortest backoff.
+    """
+
+    def __init__(
+        self,
+        product_ids: list[str],
+        n_shards: int,
+        target: Callable[[list[str]], None],
+        max_restart_backoff_sec: float = 60.0,
+        healthy_after_sec: float = 60.0,
+        check_interval_sec: float = 1.0,
+    ):
+        """
+        Args:
+            product_ids (list[str]): All the pairs to ingest
+            n_shards (int): Number of worker processes
+            target (Callable): Module-level function that ingests the pairs it gets
+                as argument. It runs in a freshly spawned process.
+            max_restart_backoff_sec (float): Upper bound of the restart backoff
+            healthy_after_sec (float): Uptime after which a shard's backoff is reset
+            check_interval_sec (float): How often the worker processes are checked
+        """
+        self.shards = shard_product_ids(product_ids, n_shards)
+        self.target = target
+        self.max_restart_backoff_sec = max_restart_backoff_sec
+        self.healthy_after_sec = healthy_after_sec
+        self.check_interval_sec = check_interval_sec
+
+        # spawn instead of fork, so no sockets or Kafka client threads are
+        # inherited from the supervisor
+        self._context = multiprocessing.get_context('spawn')
+        self._processes: list[Optional[multiprocessing.Process]] = [None] * len(
+            self.shards
+        )
+        self._started_at = [0.0] * len(self.shards)
+        self._n_failures = [0] * len(self.shards)
+        self._restart_at = [0.0] * len(self.shards)
+        self._running = False
+
+    def run(self):
+        """
+        Starts all the shards and supervises them until SIGTERM or SIGINT.
+        """
+        self._running = True
+        signal.signal(signal.SIGTERM, self._on_signal)
+        signal.signal(signal.SIGINT, self._on_signal)
+
+        for shard_id in range(len(self.shards)):
+            self._start(shard_id)
+
+        try:
+            while self._running:
+                self._check_shards()
+                time.sleep(self.check_interval_sec)
+        finally:
+            self._stop_all()
+
+    def _on_signal(self, signum, frame):
+        logger.info(f'Received signal {signum}, stopping all shards')
+        self._running = False
+
+    def _start(self, shard_id: int):
+        process = self._context.Process(
+            target=self.target,
+            args=(self.shards[shard_id],),
+            name=f'trades-shard-{shard_id}',
+        )
+        process.start()
+        self._processes[shard_id] = process
+        self._started_at[shard_id] = time.monotonic()
+        logger.info(
+            f'Started shard {shard_id} (pid {process.pid}) for {self.shards[shard_id]}'
+        )
+
+    def _check_shards(self):
+        now = time.monotonic()
+        for shard_id, process in enumerate(self._processes):
+            if process is not None and process.is_alive():
+                continue
+
+            if process is not None:
+                # the shard just died, schedule its restart
+                uptime_sec = now - self._started_at[shard_id]
+                if uptime_sec >= self.healthy_after_sec:
+                    self._n_failures[shard_id] = 0
+                self._n_failures[shard_id] += 1
+
+                backoff_sec = min(
+                    self.max_restart_backoff_sec,
+                    2 ** (self._n_failures[shard_id] - 1),
+                )
+                self._restart_at[shard_id] = now + backoff_sec
+                self._processes[shard_id] = None
+                logger.error(
+                    f'Shard {shard_id} for {self.shards[shard_id]} exited with code '
+                    f'{process.exitcode} after {uptime_sec:.0f}s. '
+                    f'Restarting in {backoff_sec}s'
+                )
+
+            elif now >= self._restart_at[shard_id]:
+                self._start(shard_id)
+
+    def _stop_all(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.kill()
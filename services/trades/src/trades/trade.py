@@ -1,26 +1,143 @@
 import datetime
+import math
+import time
+from typing import Optional
 
-from pydantic import BaseModel
+# 'YYYY-MM-DDTHH:MM:SS' string of the last whole second formatted, so the many
+# trades that share the same second only need their microseconds formatted.
+_last_iso_second: tuple[int, str] = (0, '1970-01-01T00:00:00')
 
 
-class Trade(BaseModel):
-    product_id: str
-    price: float
-    quantity: float
-    timestamp: str
-    timestamp_ms: int
+class Trade:
+    """
+    A single trade.
+
+    This is a plain class with `__slots__` instead of a pydantic model, because it
+    is built once per trade in the hot path of the service. The data comes from
+    our own parsing of the Kraken responses, so validation buys us nothing and
+    per-trade object churn is what shows up in the CPU profile.
+
+    The ISO `timestamp` string is only formatted when it is actually needed, so
+    trades coming from the REST API (which only gives us a float) don't pay for it
+    unless they are serialized.
+    """
+
+    __slots__ = (
+        'product_id',
+        'price',
+        'quantity',
+        'timestamp_ms',
+        'trade_id',
+        '_timestamp',
+    )
+
+    def __init__(
+        self,
+        product_id: str,
+        price: float,
+        quantity: float,
+        timestamp: Optional[str | float] = None,
+        timestamp_ms: Optional[int] = None,
+        trade_id: Optional[int] = None,
+    ):
+        """
+        Args:
+            product_id (str): The pair, e.g. 'BTC/USD'
+            price (float): Price of the trade
+            quantity (float): Quantity traded
+            timestamp (Optional[str | float]): ISO 8601 string, or Unix timestamp in
+                seconds that is formatted into one the first time it is read
+            timestamp_ms (Optional[int]): Unix timestamp in milliseconds. Derived
+                from `timestamp` if not given.
+            trade_id (Optional[int]): Kraken's id of the trade, unique per pair. It
+                is only used to drop duplicates, and is not part of `to_dict`.
+        """
+        if timestamp is None and timestamp_ms is None:
+            raise ValueError('Either timestamp or timestamp_ms must be given')
+
+        self.product_id = product_id
+        self.price = price
+        self.quantity = quantity
+        self._timestamp = timestamp if timestamp is not None else timestamp_ms / 1000
+
+        if timestamp_ms is None:
+            timestamp_ms = (
+                int(self.iso_format_to_unix_seconds(timestamp) * 1000)
+                if isinstance(timestamp, str)
+                else int(timestamp * 1000)
+            )
+        self.timestamp_ms = timestamp_ms
+        self.trade_id = trade_id
+
+    @property
+    def timestamp(self) -> str:
+        """
+        ISO 8601 timestamp of the trade, e.g. "2025-04-24T11:35:42.856851Z"
+        """
+        if not isinstance(self._timestamp, str):
+            self._timestamp = self.unix_seconds_to_iso_format(self._timestamp)
+        return self._timestamp
+
+    @property
+    def timestamp_sec(self) -> float:
+        """
+        Unix timestamp of the trade in seconds, with microsecond precision
+        """
+        if isinstance(self._timestamp, str):
+            return self.iso_format_to_unix_seconds(self._timestamp)
+        return self._timestamp
 
     def to_dict(self) -> dict:
-        return self.model_dump()
+        return {
+            'product_id': self.product_id,
+            'price': self.price,
+            'quantity': self.quantity,
+            'timestamp': self.timestamp,
+            'timestamp_ms': self.timestamp_ms,
+        }
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Trade):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return (
+            f'Trade(product_id={self.product_id!r}, price={self.price!r}, '
+            f'quantity={self.quantity!r}, timestamp_ms={self.timestamp_ms!r})'
+        )
 
     @staticmethod
     def unix_seconds_to_iso_format(timestamp_sec: float) -> str:
         """
         Convert Unix timestamp in seconds to ISO 8601 format string with UTC timezone
         Example: "2025-04-24T11:35:42.856851Z"
+
+        Gives the same output as `datetime.fromtimestamp(...).isoformat()`, but the
+        date and time part is reused for consecutive trades in the same second.
         """
-        dt = datetime.datetime.fromtimestamp(timestamp_sec, tz=datetime.timezone.utc)
-        return dt.isoformat().replace('+00:00', 'Z')
+        global _last_iso_second
+
+        # same rounding to microseconds as `datetime.fromtimestamp`
+        frac, sec = math.modf(timestamp_sec)
+        us = round(frac * 1e6)
+        if us >= 1000000:
+            sec += 1
+            us -= 1000000
+        elif us < 0:
+            sec -= 1
+            us += 1000000
+        sec = int(sec)
+
+        # read the cache once, other threads may replace it in the meantime
+        cached = _last_iso_second
+        if cached[0] != sec:
+            cached = (sec, time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(sec)))
+            _last_iso_second = cached
+
+        if us:
+            return f'{cached[1]}.{us:06d}Z'
+        return f'{cached[1]}Z'
 
     @staticmethod
     def iso_format_to_unix_seconds(iso_format: str) -> float:
@@ -37,34 +154,40 @@ class Trade(BaseModel):
         price: float,
         quantity: float,
         timestamp: str,
+        trade_id: Optional[int] = None,
     ) -> 'Trade':
         """
         Create a Trade object from the Kraken websocket response
         """
         return cls(
             product_id=product_id,
-            price=price,
-            quantity=quantity,
+            price=float(price),
+            quantity=float(quantity),
             timestamp=timestamp,
             timestamp_ms=int(cls.iso_format_to_unix_seconds(timestamp) * 1000),
+            trade_id=trade_id,
         )
 
     @classmethod
     def from_kraken_rest_api_response(
         cls,
         product_id: str,
-        price: float,
-        quantity: float,
+        price: float | str,
+        quantity: float | str,
         timestamp_sec: float,
+        trade_id: Optional[int] = None,
     ) -> 'Trade':
         """
         Create a Trade object from the Kraken REST API response
-        """
 
+        The REST API sends prices and quantities as strings, so they are converted
+        here. The ISO timestamp is formatted lazily from `timestamp_sec`.
+        """
         return cls(
             product_id=product_id,
-            price=price,
-            quantity=quantity,
-            timestamp=cls.unix_seconds_to_iso_format(timestamp_sec),
+            price=float(price),
+            quantity=float(quantity),
+            timestamp=float(timestamp_sec),
             timestamp_ms=int(timestamp_sec * 1000),
+            trade_id=trade_id,
         )
@@ -0,0 +1,368 @@
+import json
+import os
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from loguru import logger
+
+from trades.http_client import KrakenHTTPClient
+from trades.kraken_rest_api import KrakenRestAPI
+from trades.trade import Trade
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+SCHEMA = pa.schema(
+    [
+        ('product_id', pa.string()),
+        ('price', pa.float64()),
+        ('quantity', pa.float64()),
+        ('timestamp_sec', pa.float64()),
+        ('timestamp_ms', pa.int64()),
+        # null if the exchange gave no id. Files written before it was archived
+        # have no such column, and are read with nulls
+        ('trade_id', pa.int64()),
+    ]
+)
+
+
+class TradeArchive:
+    """
+    Local archive of historical trades, stored as Parquet files partitioned by pair
+    and day:
+
+        {root_dir}/pair=BTC-USD/date=2025-04-24/part-{first_ms}-{last_ms}-{id}.parquet
+
+    Next to the day partitions, each pair has a `_coverage.json` file with the time
+    ranges `[start_ms, end_ms)` whose trades are all in the archive. This lets a
+    backfill tell "no trades in this range" apart from "never downloaded", and fetch
+    only the missing ranges from the Kraken REST API.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = Path(root_dir)
+        self.root_dir.mkdir(parents=True, exist_ok=True)
+
+        # coverage files are shared by all the cursors of a pair
+        self._lock = threading.Lock()
+
+    def _pair_dir(self, product_id: str) -> Path:
+        return self.root_dir / f'pair={product_id.replace("/", "-")}'
+
+    def write(self, trades: list[Trade]):
+        """
+        Writes the trades into one new Parquet file per (pair, day).
+        """
+        by_partition: dict[tuple[str, int], list[Trade]] = {}
+        for trade in trades:
+            key = (trade.product_id, trade.timestamp_ms // MS_PER_DAY)
+            by_partition.setdefault(key, []).append(trade)
+
+        for (product_id, day), day_trades in by_partition.items():
+            date = time.strftime('%Y-%m-%d', time.gmtime(day * MS_PER_DAY // 1000))
+            partition_dir = self._pair_dir(product_id) / f'date={date}'
+            partition_dir.mkdir(parents=True, exist_ok=True)
+
+            table = pa.table(
+                {
+                    'product_id': [t.product_id for t in day_trades],
+                    'price': [t.price for t in day_trades],
+                    'quantity': [t.quantity for t in day_trades],
+                    'timestamp_sec': [t.timestamp_sec for t in day_trades],
+                    'timestamp_ms': [t.timestamp_ms for t in day_trades],
+                    'trade_id': [t.trade_id for t in day_trades],
+                },
+                schema=SCHEMA,
+            )
+            file_name = (
+                f'part-{day_trades[0].timestamp_ms}-{day_trades[-1].timestamp_ms}'
+                f'-{uuid.uuid4().hex[:8]}.parquet'
+            )
+            # write to a temporary file first, so readers never see half a file
+            tmp_path = partition_dir / f'.{file_name}.tmp'
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, partition_dir / file_name)
+
+    def _files(self, product_id: str, start_ms: int, end_ms: int) -> list[Path]:
+        """
+        Returns the Parquet files of `product_id` that may have trades in
+        `[start_ms, end_ms)`, in timestamp order.
+        """
+        pair_dir = self._pair_dir(product_id)
+        first_day = start_ms // MS_PER_DAY
+        last_day = (end_ms - 1) // MS_PER_DAY
+
+        paths = []
+        for day in range(first_day, last_day + 1):
+            date = time.strftime('%Y-%m-%d', time.gmtime(day * MS_PER_DAY // 1000))
+            partition_dir = pair_dir / f'date={date}'
+            if not partition_dir.exists():
+                continue
+
+            # files are named after their first and last timestamps
+            files = []
+            for path in partition_dir.glob('part-*.parquet'):
+                _, first_ms, last_ms, _ = path.stem.split('-')
+                if int(last_ms) >= start_ms and int(first_ms) < end_ms:
+                    files.append((int(first_ms), path))
+            paths.extend(path for _, path in sorted(files))
+
+        return paths
+
+    def read(
+        self, product_id: str, start_ms: int, end_ms: int
+    ) -> Iterator[list[Trade]]:
+        """
+        Yields the archived trades of `product_id` in `[start_ms, end_ms)`, in
+        timestamp order, one list per Parquet file.
+        """
+        for path in self._files(product_id, start_ms, end_ms):
+            columns = pq.read_table(path, schema=SCHEMA).to_pydict()
+            trades = [
+                Trade(
+                    product_id=product_id,
+                    price=price,
+                    quantity=quantity,
+                    timestamp=timestamp_sec,
+                    timestamp_ms=timestamp_ms,
+                    trade_id=trade_id,
+                )
+                for price, quantity, timestamp_sec, timestamp_ms, trade_id in zip(
+                    columns['price'],
+                    columns['quantity'],
+                    columns['timestamp_sec'],
+                    columns['timestamp_ms'],
+                    columns['trade_id'],
+                    strict=True,
+                )
+                if start_ms <= timestamp_ms < end_ms
+            ]
+            if trades:
+                yield trades
+
+    def read_table(self, product_id: str, start_ms: int, end_ms: int) -> pa.Table:
+        """
+        Returns the archived trades of `product_id` in `[start_ms, end_ms)` as one
+        Arrow table with the `SCHEMA` columns, in timestamp order, without building
+        a `Trade` per row. For offline batch processing.
+        """
+        tables = [
+            pq.read_table(path, schema=SCHEMA)
+            for path in self._files(product_id, start_ms, end_ms)
+        ]
+        if not tables:
+            return SCHEMA.empty_table()
+
+        table = pa.concat_tables(tables)
+        timestamp_ms = table['timestamp_ms']
+        return table.filter(
+            pc.and_(
+                pc.greater_equal(timestamp_ms, start_ms),
+                pc.less(timestamp_ms, end_ms),
+            )
+        )
+
+    def coverage(self, product_id: str) -> list[list[int]]:
+        """
+        Returns the sorted, non-overlapping `[start_ms, end_ms)` ranges of
+        `product_id` that are fully archived.
+        """
+        path = self._pair_dir(product_id) / '_coverage.json'
+        if not path.exists():
+            return []
+        return json.loads(path.read_text())
+
+    def add_coverage(self, product_id: str, start_ms: int, end_ms: int):
+        """
+        Marks `[start_ms, end_ms)` of `product_id` as fully archived. Call it only
+        after the trades of the range have been written.
+        """
+        if end_ms <= start_ms:
+            return
+
+        with self._lock:
+            ranges = sorted(self.coverage(product_id) + [[start_ms, end_ms]])
+
+            # merge overlapping and adjacent ranges
+            merged = [ranges[0]]
+            for start, end in ranges[1:]:
+                if start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+
+            pair_dir = self._pair_dir(product_id)
+            pair_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = pair_dir / '._coverage.json.tmp'
+            tmp_path.write_text(json.dumps(merged))
+            os.replace(tmp_path, pair_dir / '_coverage.json')
+
+    def plan(
+        self, product_id: str, start_ms: int, end_ms: int
+    ) -> list[tuple[int, int, bool]]:
+        """
+        Splits `[start_ms, end_ms)` into consecutive segments that are either
+        already archived or missing.
+
+        Returns:
+            list[tuple[int, int, bool]]: `(start_ms, end_ms, is_archived)` segments
+                in time order
+        """
+        segments = []
+        cursor = start_ms
+        for covered_start, covered_end in self.coverage(product_id):
+            if covered_end <= cursor or covered_start >= end_ms:
+                continue
+            if covered_start > cursor:
+                segments.append((cursor, covered_start, False))
+            segments.append(
+                (max(cursor, covered_start), min(covered_end, end_ms), True)
+            )
+            cursor = min(covered_end, end_ms)
+        if cursor < end_ms:
+            segments.append((cursor, end_ms, False))
+        return segments
+
+
+class ArchivedKrakenRestAPI:
+    """
+    Drop-in replacement for a `KrakenRestAPI` cursor that reads trades from a
+    `TradeArchive` first and only calls the Kraken REST API for the ranges that
+    are not archived yet. Trades fetched from the API are written to the archive,
+    so the next backfill over the same range reads them from local disk.
+    """
+
+    def __init__(
+        self,
+        product_id: str,
+        last_n_days: int,
+        archive: TradeArchive,
+        http_client: Optional[KrakenHTTPClient] = None,
+        since_timestamp_ns: Optional[int] = None,
+        until_timestamp_ns: Optional[int] = None,
+        flush_every_n_trades: int = 100000,
+    ):
+        """
+        Args:
+            product_id (str): The pair to fetch trades for
+            last_n_days (int): How many days back the backfill starts
+            archive (TradeArchive): Where trades are read from and written to
+            http_client (Optional[KrakenHTTPClient]): Client shared with other cursors
+            since_timestamp_ns (Optional[int]): Start of the backfill. Overrides `last_n_days`
+            until_timestamp_ns (Optional[int]): End of the backfill (exclusive). If None,
+                the cursor reads until the current time.
+            flush_every_n_trades (int): Trades fetched from the API are buffered and
+                written to the archive in files of about this many trades
+        """
+        self.product_id = product_id
+        self.last_n_days = last_n_days
+        self.archive = archive
+        self.http_client = http_client
+        self.until_timestamp_ns = until_timestamp_ns
+        self.flush_every_n_trades = flush_every_n_trades
+
+        if since_timestamp_ns is None:
+            since_timestamp_ns = int(
+                time.time_ns() - last_n_days * 24 * 60 * 60 * 1000000000
+            )
+        self.since_timestamp_ns = since_timestamp_ns
+
+        end_ms = (
+            until_timestamp_ns // 1000000
+            if until_timestamp_ns is not None
+            else time.time_ns() // 1000000
+        )
+        self._segments = archive.plan(product_id, since_timestamp_ns // 1000000, end_ms)
+        logger.info(
+            f'{product_id}: {sum(1 for s in self._segments if s[2])} archived and '
+            f'{sum(1 for s in self._segments if not s[2])} missing ranges'
+        )
+
+        # state of the segment being read
+        self._archive_pages: Optional[Iterator[list[Trade]]] = None
+        self._rest_api: Optional[KrakenRestAPI] = None
+        self._buffer: list[Trade] = []
+        self._buffer_start_ms = 0
+
+    def get_trades(self) -> list[Trade]:
+        """
+        Returns the next batch of trades: a file from the archive or a page from the
+        REST API, depending on the segment being read.
+        """
+        if not self._segments:
+            return []
+
+        start_ms, end_ms, is_archived = self._segments[0]
+        if is_archived:
+            return self._get_archived_trades(start_ms, end_ms)
+        return self._get_missing_trades(start_ms, end_ms)
+
+    def _get_archived_trades(self, start_ms: int, end_ms: int) -> list[Trade]:
+        if self._archive_pages is None:
+            self._archive_pages = self.archive.read(self.product_id, start_ms, end_ms)
+
+        trades = next(self._archive_pages, None)
+        if trades is None:
+            # done with this segment
+            self._archive_pages = None
+            self._segments.pop(0)
+            self.since_timestamp_ns = end_ms * 1000000
+            return []
+
+        self.since_timestamp_ns = trades[-1].timestamp_ms * 1000000
+        return trades
+
+    def _get_missing_trades(self, start_ms: int, end_ms: int) -> list[Trade]:
+        if self._rest_api is None:
+            # the last segment of an open-ended cursor pages until the current time
+            is_last_open_segment = (
+                self.until_timestamp_ns is None and len(self._segments) == 1
+            )
+            self._rest_api = KrakenRestAPI(
+                product_id=self.product_id,
+                last_n_days=self.last_n_days,
+                http_client=self.http_client,
+                since_timestamp_ns=start_ms * 1000000,
+                until_timestamp_ns=None if is_last_open_segment else end_ms * 1000000,
+            )
+            self._buffer_start_ms = start_ms
+
+        trades = self._rest_api.get_trades()
+        self._buffer.extend(trades)
+        self.since_timestamp_ns = self._rest_api.since_timestamp_ns
+
+        # the range we have all the trades for. A bounded cursor may have paged past
+        # `end_ms`, but it dropped those trades, so they are not covered.
+        covered_until_ms = self._rest_api.since_timestamp_ns // 1000000
+        if self._rest_api.until_timestamp_ns is not None:
+            covered_until_ms = min(covered_until_ms, end_ms)
+
+        if self._rest_api.is_done():
+            self._flush(covered_until_ms)
+            self._rest_api = None
+            self._segments.pop(0)
+        elif len(self._buffer) >= self.flush_every_n_trades:
+            self._flush(covered_until_ms)
+
+        return trades
+
+    def _flush(self, covered_until_ms: int):
+        """
+        Writes the buffered trades to the archive and marks the range they cover as
+        archived.
+        """
+        if self._buffer:
+            self.archive.write(self._buffer)
+        self.archive.add_coverage(
+            self.product_id, self._buffer_start_ms, covered_until_ms
+        )
+        self._buffer = []
+        self._buffer_start_ms = covered_until_ms
+
+    def is_done(self) -> bool:
+        return not self._segments
@@ -0,0 +1,141 @@
+import time
+from typing import Optional
+
+from loguru import logger
+from quixstreams.sources.base import StatefulSource
+
+from trades.dedup import TradeDeduplicator
+from trades.kraken_rest_api import KrakenRestAPIMultiplePairs
+from trades.metrics import ThroughputMeter
+
+
+class HistoricalTradesDataSource(StatefulSource):
+    """
+    Quix Streams stateful source that backfills historical trades from the Kraken
+    REST API.
+
+    The cursors of the backfill are saved in the source state after every page, so
+    if the container is restarted mid-backfill it resumes from where it left off
+    instead of downloading everything again from `last_n_days`.
+
+    Trades the REST API sends twice (e.g. at page boundaries and when resuming from
+    a checkpoint) are dropped. The keys of the recent trades are saved in the state
+    next to the cursors, so this also holds across restarts: the keys added by each
+    page, and every `persist_interval_sec` all the keys in one snapshot that
+    replaces them, so the state written per page does not grow with the keys kept.
+
+    With an `archive_dir`, trades are read from the local archive first and only
+    the ranges missing from it are downloaded (and archived for the next run).
+    """
+
+    def __init__(
+        self,
+        product_ids: list[str],
+        last_n_days: int,
+        max_requests_per_second: float,
+        n_slices_per_pair: Optional[int] = 1,
+        stats_interval_sec: Optional[float] = 10.0,
+        archive_dir: Optional[str] = None,
+        dedup_window_ms: int = 60000,
+        dedup_max_keys_per_pair: int = 100000,
+    ):
+        super().__init__(name='kraken_historical_trades')
+        self.product_ids = product_ids
+        self.last_n_days = last_n_days
+        self.max_requests_per_second = max_requests_per_second
+        self.n_slices_per_pair = n_slices_per_pair
+        self.stats_interval_sec = stats_interval_sec
+        self.archive_dir = archive_dir
+        self.dedup_window_ms = dedup_window_ms
+        self.dedup_max_keys_per_pair = dedup_max_keys_per_pair
+
+    def run(self):
+        # cursors saved by a previous run that did not complete the backfill
+        checkpoint = self.state.get('checkpoint', None)
+
+        archive = None
+        if self.archive_dir is not None:
+            # imported here so pyarrow is only needed when the archive is used
+            from trades.trade_archive import TradeArchive
+
+            archive = TradeArchive(self.archive_dir)
+
+        # The REST client owns a thread pool, so it is created here, in the
+        # subprocess where the source runs, and not in the constructor.
+        kraken_api = KrakenRestAPIMultiplePairs(
+            product_ids=self.product_ids,
+            last_n_days=self.last_n_days,
+            max_requests_per_second=self.max_requests_per_second,
+            n_slices_per_pair=self.n_slices_per_pair,
+            checkpoint=checkpoint,
+            archive=archive,
+        )
+
+        deduplicator = None
+        # number of pages whose dedup keys are saved since the last snapshot
+        n_dedup_pages = self.state.get('dedup_pages', 0)
+        last_dedup_snapshot = time.monotonic()
+        if self.dedup_window_ms > 0:
+            deduplicator = TradeDeduplicator(
+                window_ms=self.dedup_window_ms,
+                max_keys_per_pair=self.dedup_max_keys_per_pair,
+                stats_interval_sec=self.stats_interval_sec,
+            )
+            deduplicator.restore(self.state.get('dedup', {}))
+            for page in range(n_dedup_pages):
+                deduplicator.update(self.state.get(f'dedup_page_{page}', {}))
+
+        meter = ThroughputMeter(
+            'historical trades producer', report_interval_sec=self.stats_interval_sec
+        )
+
+        while self.running and not kraken_api.is_done():
+            trades = kraken_api.get_trades()
+            start = time.monotonic()
+
+            if deduplicator is not None:
+                trades = deduplicator.filter(trades)
+
+            # serialize the whole page of trades as bytes
+            messages = [
+                self.serialize(key=trade.product_id, value=trade.to_dict())
+                for trade in trades
+            ]
+            # push the serialized trades to the topic
+            for message in messages:
+                self.produce(key=message.key, value=message.value)
+
+            # save the cursors matching the trades we just produced
+            self.state.set('checkpoint', kraken_api.checkpoint())
+            if deduplicator is not None:
+                now = time.monotonic()
+                if now - last_dedup_snapshot >= deduplicator.persist_interval_sec:
+                    # one snapshot replaces the keys saved by the previous pages
+                    self.state.set('dedup', deduplicator.snapshot())
+                    self._delete_dedup_pages(n_dedup_pages)
+                    n_dedup_pages = 0
+                    last_dedup_snapshot = now
+                else:
+                    self.state.set(
+                        f'dedup_page_{n_dedup_pages}', deduplicator.changes()
+                    )
+                    n_dedup_pages += 1
+                self.state.set('dedup_pages', n_dedup_pages)
+
+            # flush the state together with the produced trades
+            self.flush()
+
+            meter.record(len(messages), time.monotonic() - start)
+
+        if kraken_api.is_done():
+            # the backfill is complete, so the next run starts a fresh one
+            logger.info('Historical backfill completed. Clearing checkpoint')
+            self.state.delete('checkpoint')
+            self.state.delete('dedup')
+            self._delete_dedup_pages(n_dedup_pages)
+            self.state.delete('dedup_pages')
+            self.flush()
+
+    def _delete_dedup_pages(self, n_pages: int):
+        for page in range(n_pages):
+            self.state.delete(f'dedup_page_{page}')